@@ -6,7 +6,9 @@ import sys
 
 def main():
     """Run administrative tasks."""
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'nembus_project.settings')
+    # Los tests tienen sus propios ajustes (réplica de lectura espejo, ver nembus_project/settings_test.py)
+    ajustes = 'nembus_project.settings_test' if sys.argv[1:2] == ['test'] else 'nembus_project.settings'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', ajustes)
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
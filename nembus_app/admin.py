@@ -1,31 +1,43 @@
+from django import forms
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
 from .models import (
     Cliente, Camion, ReporteVenta, PerfilTrabajador, Traspaso,
     PuntoDeVenta, Bomba, Turno, ReporteTurno, LecturaBomba,
-    RegistroVentaIndividualBomba # Importar el nuevo modelo
+    RegistroVentaIndividualBomba, # Importar el nuevo modelo
+    TrabajoExportacion, MovimientoCombustible, SnapshotSaldo, OperacionSincronizada
 )
 from django.utils.html import format_html
-from django.db.models import Sum, F # Importar Sum y F
-from decimal import Decimal
+from . import inventario
 
 # --- Admin para Modelos Existentes (sin cambios o con ajustes menores) ---
 
 class ReporteVentaAdmin(admin.ModelAdmin):
-    list_display = ('__str__', 'trabajador', 'camion', 'cliente', 'litros_vendidos', 'monto_total_clp', 'fecha_hora')
+    list_display = ('__str__', 'trabajador', 'camion', 'cliente', 'litros_vendidos', 'monto_total_clp', 'fecha_hora', 'miniatura_foto')
     # Ajustar fields si es necesario, asegurarse que 'ver_foto_evidencia' sigue siendo válido
-    fields = ('trabajador', 'cliente', 'camion', 'litros_vendidos', 'monto_combustible_clp', 'costo_flete_clp', 'monto_total_clp', 'ver_foto_evidencia', 'fecha_hora')
-    readonly_fields = ('ver_foto_evidencia', 'fecha_hora') # Hacer fecha_hora readonly
+    fields = ('trabajador', 'cliente', 'camion', 'litros_vendidos', 'monto_combustible_clp', 'costo_flete_clp', 'monto_total_clp', 'ver_foto_evidencia', 'foto_estado', 'fecha_hora')
+    readonly_fields = ('ver_foto_evidencia', 'foto_estado', 'fecha_hora') # Hacer fecha_hora readonly
     search_fields = ('cliente__nombre', 'camion__patente', 'trabajador__username')
-    list_filter = ('fecha_hora', 'trabajador', 'camion', 'cliente')
+    list_filter = ('fecha_hora', 'trabajador', 'camion', 'cliente', 'foto_estado')
+    list_select_related = ('cliente', 'trabajador', 'camion') # __str__ usa el cliente; trabajador y camión van en list_display
 
+    # Las vistas muestran la miniatura (ver fotos.py) y enlazan a la foto completa; el original sin procesar
+    # no se incrusta como <img>, para que el listado no descargue fotos de varios MB
     def ver_foto_evidencia(self, obj):
+        if obj.foto_miniatura:
+            return format_html('<a href="{0}" target="_blank"><img src="{1}" width="150" loading="lazy" /></a>', obj.foto_evidencia.url, obj.foto_miniatura.url)
         if obj.foto_evidencia:
-            return format_html('<a href="{0}" target="_blank"><img src="{0}" width="150" /></a>', obj.foto_evidencia.url)
+            return format_html('<a href="{0}" target="_blank">Ver foto ({1})</a>', obj.foto_evidencia.url, obj.get_foto_estado_display() or 'sin procesar')
         return "No hay foto"
     ver_foto_evidencia.short_description = 'Foto Evidencia'
 
+    def miniatura_foto(self, obj):
+        if obj.foto_miniatura:
+            return format_html('<a href="{0}" target="_blank"><img src="{1}" height="40" loading="lazy" /></a>', obj.foto_evidencia.url, obj.foto_miniatura.url)
+        return obj.get_foto_estado_display() or '-'
+    miniatura_foto.short_description = 'Foto'
+
 class PerfilTrabajadorInline(admin.StackedInline):
     model = PerfilTrabajador
     can_delete = False
@@ -54,8 +66,8 @@ class RegistroVentaIndividualBombaInline(admin.TabularInline):
 
 # Modificado para reflejar la nueva estructura y añadir el inline de ventas
 class LecturaBombaAdmin(admin.ModelAdmin): # Crear un admin explícito para LecturaBomba
-    list_display = ('__str__', 'reporte_turno', 'bomba', 'contador_inicial', 'contador_final', 'litros_vendidos_turno')
-    readonly_fields = ('litros_vendidos_turno',) # El total se calcula
+    list_display = ('__str__', 'reporte_turno', 'bomba', 'contador_inicial', 'contador_final', 'litros_vendidos_turno', 'num_ventas_turno', 'ingreso_turno')
+    readonly_fields = ('litros_vendidos_turno', 'num_ventas_turno', 'ingreso_turno') # Totales corrientes de las ventas
     inlines = [RegistroVentaIndividualBombaInline] # Mostrar ventas aquí
     list_filter = ('reporte_turno__fecha_inicio', 'bomba') # Asume que ReporteTurno tiene fecha_inicio
     search_fields = ('bomba__nombre', 'reporte_turno__trabajador__username')
@@ -81,21 +93,87 @@ class ReporteTurnoAdmin(admin.ModelAdmin):
     list_filter = ('esta_abierto', 'fecha_inicio', 'turno', 'trabajador') # Asume que ReporteTurno tiene estos campos
     search_fields = ('trabajador__username', 'turno__nombre')
     ordering = ('-fecha_inicio',) # Asume que ReporteTurno tiene fecha_inicio
+    list_select_related = ('trabajador', 'turno') # __str__ los usa en cada fila
 
-    # Métodos para calcular totales (ahora usan los nuevos campos/relaciones)
+    # Totales corrientes guardados en el turno (sin agregar ventas por cada fila del listado)
     def total_litros_vendidos(self, obj):
-        # Sumar los totales de cada lectura de bomba asociada
-        total = obj.lecturas.aggregate(total_l=Sum('litros_vendidos_turno'))['total_l'] # Asume related_name='lecturas' y campo='litros_vendidos_turno'
-        return total or 0
+        return obj.total_litros
     total_litros_vendidos.short_description = 'Total Litros (Turno)'
+    total_litros_vendidos.admin_order_field = 'total_litros'
 
     def total_ingresos_turno(self, obj):
-        # Sumar los ingresos de TODAS las ventas individuales asociadas a las lecturas de este turno
-        total = RegistroVentaIndividualBomba.objects.filter(lectura_bomba__reporte_turno=obj).aggregate(total_i=Sum('ingreso_registro'))['total_i'] # Asume campo='ingreso_registro'
         # Formatear como moneda
-        total_decimal = total or Decimal('0.00')
-        return f"${int(total_decimal):,}".replace(",", ".") # Formato chileno
+        return f"${int(obj.total_ingreso):,}".replace(",", ".") # Formato chileno
     total_ingresos_turno.short_description = 'Total Ingresos (CLP)'
+    total_ingresos_turno.admin_order_field = 'total_ingreso'
+
+# Cola de exportaciones en segundo plano (solo lectura, las crea el dashboard)
+class TrabajoExportacionAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'nombre_archivo', 'solicitado_por', 'estado', 'filas_estimadas', 'filas_exportadas', 'fecha_creacion', 'fecha_fin')
+    list_filter = ('estado', 'tipo')
+    readonly_fields = ('tipo', 'parametros', 'nombre_archivo', 'estado', 'solicitado_por', 'filas_estimadas', 'filas_exportadas', 'archivo', 'mensaje_error', 'fecha_creacion', 'fecha_inicio', 'fecha_latido', 'fecha_fin')
+    def has_add_permission(self, request): return False
+
+# Camiones y bombas: litros_actuales solo se fija al crear (queda como "Saldo inicial" en el libro de movimientos).
+# Después es de solo lectura: el formulario guardaría el saldo leído al abrir la página y revertiría las ventas,
+# recargas y traspasos concurrentes. Las correcciones se hacen con un ajuste en litros (delta), aplicado con F().
+class AjusteEstanqueForm(forms.ModelForm):
+    ajuste_litros = forms.DecimalField(
+        required=False, max_digits=12, decimal_places=4, label="Ajuste de litros",
+        help_text="Litros a sumar (o restar, con signo negativo) al saldo actual. Queda como AJUSTE en el libro de movimientos.",
+    )
+
+class EstanqueAdminMixin:
+    def get_readonly_fields(self, request, obj=None):
+        readonly = super().get_readonly_fields(request, obj)
+        return (*readonly, 'litros_actuales') if obj else readonly
+
+    def get_form(self, request, obj=None, change=False, **kwargs):
+        if obj:
+            kwargs['form'] = AjusteEstanqueForm
+        return super().get_form(request, obj, change=change, **kwargs)
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            super().save_model(request, obj, form, change)
+            if obj.litros_actuales:
+                inventario.registrar_ajuste(obj, obj.litros_actuales, trabajador=request.user, nota="Saldo inicial")
+            return
+        # Sin litros_actuales en el UPDATE: el saldo solo cambia con F() (aquí o en los flujos de inventario)
+        obj.save(update_fields=[f.name for f in obj._meta.concrete_fields if not f.primary_key and f.name != 'litros_actuales'])
+        ajuste = form.cleaned_data.get('ajuste_litros')
+        if ajuste: # El admin ya envuelve el guardado en transaction.atomic()
+            inventario.ajustar_saldo(obj, ajuste, trabajador=request.user, nota="Ajuste manual desde el admin")
+            obj.refresh_from_db(fields=['litros_actuales'])
+
+class CamionAdmin(EstanqueAdminMixin, admin.ModelAdmin):
+    list_display = ('patente', 'capacidad_total', 'litros_actuales')
+
+class BombaAdmin(EstanqueAdminMixin, admin.ModelAdmin):
+    list_display = ('__str__', 'precio_litro_clp', 'litros_actuales')
+
+# Libro de movimientos: append-only, solo lectura en el admin
+class MovimientoCombustibleAdmin(admin.ModelAdmin):
+    list_display = ('fecha_hora', 'tipo', 'camion', 'bomba', 'litros', 'trabajador', 'nota')
+    list_filter = ('tipo', 'camion', 'bomba')
+    date_hierarchy = 'fecha_hora'
+    readonly_fields = ('fecha_hora', 'tipo', 'camion', 'bomba', 'litros', 'trabajador', 'reporte_venta', 'traspaso', 'lectura_bomba', 'nota')
+    def has_add_permission(self, request): return False
+    def has_delete_permission(self, request, obj=None): return False
+
+class SnapshotSaldoAdmin(admin.ModelAdmin):
+    list_display = ('fecha_hora', 'camion', 'bomba', 'litros')
+    list_filter = ('camion', 'bomba')
+    readonly_fields = ('fecha_hora', 'camion', 'bomba', 'litros')
+    def has_add_permission(self, request): return False
+
+# Operaciones recibidas por la sincronización sin conexión (solo lectura: las crea api_sincronizar)
+class OperacionSincronizadaAdmin(admin.ModelAdmin):
+    list_display = ('fecha_aplicada', 'usuario', 'tipo', 'clave', 'fecha_cliente')
+    list_filter = ('tipo',)
+    search_fields = ('clave', 'usuario__username')
+    readonly_fields = ('usuario', 'clave', 'tipo', 'resultado', 'fecha_cliente', 'fecha_aplicada', 'reporte_venta', 'traspaso', 'movimiento')
+    def has_add_permission(self, request): return False
 
 # --- Registros en el Admin Site ---
 
@@ -103,12 +181,16 @@ admin.site.unregister(User) # Desregistrar el User admin por defecto
 admin.site.register(User, UserAdmin) # Registrar User con nuestro inline
 
 admin.site.register(Cliente)
-admin.site.register(Camion)
+admin.site.register(Camion, CamionAdmin)
 admin.site.register(ReporteVenta, ReporteVentaAdmin)
 admin.site.register(Traspaso)
 admin.site.register(PuntoDeVenta)
-admin.site.register(Bomba)
+admin.site.register(Bomba, BombaAdmin)
 admin.site.register(Turno)
 admin.site.register(ReporteTurno, ReporteTurnoAdmin)
 admin.site.register(LecturaBomba, LecturaBombaAdmin)
+admin.site.register(TrabajoExportacion, TrabajoExportacionAdmin)
+admin.site.register(MovimientoCombustible, MovimientoCombustibleAdmin)
+admin.site.register(SnapshotSaldo, SnapshotSaldoAdmin)
+admin.site.register(OperacionSincronizada, OperacionSincronizadaAdmin)
 # No registramos RegistroVentaIndividualBomba directamente, se ve a través de LecturaBombaAdmin
\ No newline at end of file
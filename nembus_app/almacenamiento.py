@@ -0,0 +1,102 @@
+# nembus_app/almacenamiento.py
+# Almacenamiento direccionado por contenido para las fotos de evidencia (ReporteVenta.foto_evidencia y
+# foto_miniatura). El nombre de cada archivo es el SHA-256 de su contenido, repartido en subcarpetas por
+# los primeros caracteres del hash:  evidencias/3f/a2/3fa2...e9.jpg
+# - Subir dos veces la misma foto (ej. el chofer reintenta tras un POST fallido) no escribe un archivo nuevo:
+#   save() devuelve el nombre del que ya existe y ambas ventas lo comparten.
+# - Las subcarpetas por prefijo (256 x 256) evitan directorios con cientos de miles de archivos.
+# - Backend local (EvidenciasLocal, bajo MEDIA_ROOT) o S3 compatible (EvidenciasS3: AWS, MinIO, R2...), según
+#   EVIDENCIAS_STORAGE en settings. S3 requiere django-storages[s3].
+# Como un archivo puede estar referenciado por varias ventas, nunca se borra sin revisar antes que nadie más
+# lo use (fotos.borrar_si_sin_uso). save() y ese borrado toman el mismo bloqueo por nombre (bloquear_nombre): si
+# una subida reutiliza un archivo que el worker está por borrar, el borrado espera a que la venta nueva se
+# confirme y la encuentra; o el archivo ya se borró y la subida lo vuelve a escribir.
+import hashlib
+import logging
+import os
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, storages
+from django.core.files.utils import validate_file_name
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+ALIAS = 'evidencias'
+
+
+def evidencias():
+    """Storage de las fotos de evidencia (callable para el storage= de los campos; se resuelve al usarse)."""
+    return storages[ALIAS]
+
+
+def hash_contenido(content):
+    """SHA-256 (hex) del archivo, leído por bloques; deja el archivo al inicio."""
+    sha = hashlib.sha256()
+    for bloque in content.chunks():
+        sha.update(bloque)
+    content.seek(0)
+    return sha.hexdigest()
+
+
+def bloquear_nombre(nombre):
+    """Bloquea (SELECT FOR UPDATE, hasta el commit de la transacción en curso) la fila ArchivoEvidencia del nombre,
+    creándola si no existe. Llamar dentro de transaction.atomic()."""
+    from .models import ArchivoEvidencia # models importa este módulo (storage de los campos de foto)
+    while True:
+        ArchivoEvidencia.objects.get_or_create(nombre=nombre)
+        if ArchivoEvidencia.objects.select_for_update().filter(nombre=nombre).values_list('pk', flat=True):
+            return
+        # La fila la borró un borrado concurrente que confirmó mientras se esperaba el bloqueo: se vuelve a crear
+
+
+class DeduplicadoMixin:
+    """Guarda cada archivo con el nombre <carpeta>/<h[0:2]>/<h[2:4]>/<hash><ext> y no lo reescribe si ya existe."""
+    niveles = 2 # Subcarpetas por prefijo del hash
+    ancho = 2   # Caracteres del hash por subcarpeta
+
+    def nombre_contenido(self, name, content):
+        carpeta = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        digest = hash_contenido(content)
+        prefijos = [digest[i * self.ancho:(i + 1) * self.ancho] for i in range(self.niveles)]
+        return '/'.join(filter(None, [carpeta, *prefijos, digest + extension]))
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        validate_file_name(name, allow_relative_path=True)
+        nombre = self.nombre_contenido(name, content)
+        validate_file_name(nombre, allow_relative_path=True)
+        if max_length and len(nombre) > max_length:
+            raise ValueError(f"El nombre '{nombre}' supera los {max_length} caracteres del campo.")
+        # Dentro de la transacción de quien sube (la vista guarda la venta en transaction.atomic()), el bloqueo dura
+        # hasta que la venta que referencia el archivo queda confirmada
+        with transaction.atomic():
+            bloquear_nombre(nombre)
+            if self.exists(nombre):
+                logger.info("archivo_deduplicado nombre=%s bytes=%s", nombre, content.size)
+                return nombre
+            return self._save(nombre, content)
+
+
+class EvidenciasLocal(DeduplicadoMixin, FileSystemStorage):
+    """Disco local (MEDIA_ROOT). Si dos procesos guardan a la vez el mismo contenido, el segundo sobreescribe
+    el archivo con bytes idénticos en vez de buscar otro nombre."""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('allow_overwrite', True)
+        super().__init__(**kwargs)
+
+
+try:
+    from storages.backends.s3 import S3Storage
+except ImportError: # django-storages es opcional: solo hace falta con EVIDENCIAS_STORAGE=s3
+    class EvidenciasS3:
+        def __init__(self, **kwargs):
+            raise ImproperlyConfigured("EVIDENCIAS_STORAGE=s3 requiere django-storages[s3] (pip install 'django-storages[s3]').")
+else:
+    class EvidenciasS3(DeduplicadoMixin, S3Storage):
+        """Bucket S3 o compatible (MinIO, R2...) configurado con EVIDENCIAS_S3_* en settings."""
@@ -2,4 +2,7 @@ from django.apps import AppConfig
 
 class NembusAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'nembus_app'
\ No newline at end of file
+    name = 'nembus_app'
+
+    def ready(self):
+        from . import signals # noqa: F401 (registra los receivers)
@@ -0,0 +1,104 @@
+# nembus_app/asincrono.py
+# Soporte para servir con ASGI (nembus_project/asgi.py, ej. gunicorn -k uvicorn_worker.UvicornWorker).
+# - Las vistas de lectura pesada (dashboard, API de métricas, /metrics y exportaciones) son async: mientras
+#   esperan a la BD o envían un archivo no ocupan un worker, y una exportación lenta no bloquea al resto.
+# - en_paralelo(): corre agregados independientes (particiones de un período, período de comparación) a la
+#   vez, cada uno en un hilo de un pool propio (ASGI_HILOS_CONSULTAS) con su propia conexión a la BD.
+# - Todos los middlewares de la cadena deben ser async para que ASGI no pase cada request por un hilo
+#   (Django adapta la cadena entera al primero que sea solo síncrono): WhiteNoise no lo es, de ahí
+#   EstaticosMiddleware.
+# Con WSGI (gunicorn sync) todo sigue funcionando: Django corre las vistas async con async_to_sync.
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections, connections
+from whitenoise.middleware import WhiteNoiseMiddleware
+from . import instrumentacion
+
+TROZO_ARCHIVO = 64 * 1024 # Bytes por lectura al enviar un archivo
+
+_ejecutor = None
+
+
+def es_asgi(request):
+    return isinstance(request, ASGIRequest)
+
+
+def _pool():
+    # Pool propio y de tamaño fijo: cada hilo mantiene su conexión (CONN_MAX_AGE), así el número de conexiones
+    # extra por proceso queda acotado. El pool por defecto de asyncio se crea y destruye con cada event loop
+    # (en WSGI, uno por request) y dejaría conexiones abiertas en hilos muertos.
+    global _ejecutor
+    if _ejecutor is None:
+        _ejecutor = ThreadPoolExecutor(max_workers=settings.ASGI_HILOS_CONSULTAS, thread_name_prefix='nembus-consultas')
+    return _ejecutor
+
+
+def _en_transaccion():
+    return any(conexion.in_atomic_block for conexion in connections.all(initialized_only=True))
+
+
+def _en_hilo(funcion):
+    registro = instrumentacion.registro_actual() # Las consultas del hilo cuentan para el request (Server-Timing, log)
+    def ejecutar():
+        close_old_connections()
+        try:
+            with instrumentacion.medir_consultas(registro):
+                return funcion()
+        finally:
+            close_old_connections()
+    return ejecutar
+
+
+async def en_paralelo(*funciones):
+    """Ejecuta funciones síncronas independientes (sin argumentos) a la vez y devuelve sus resultados en orden.
+    Dentro de una transacción corren en serie en la conexión del request: otra conexión no vería lo que
+    la transacción aún no confirma."""
+    if await sync_to_async(_en_transaccion)():
+        return [await sync_to_async(funcion)() for funcion in funciones]
+    return list(await asyncio.gather(*(
+        sync_to_async(_en_hilo(funcion), thread_sensitive=False, executor=_pool())() for funcion in funciones
+    )))
+
+
+async def trozos(archivo, tamano=TROZO_ARCHIVO):
+    """Lee un archivo en trozos sin bloquear el event loop (contenido de un StreamingHttpResponse async)."""
+    leer = sync_to_async(archivo.read, thread_sensitive=False)
+    try:
+        while trozo := await leer(tamano):
+            yield trozo
+    finally:
+        await sync_to_async(archivo.close, thread_sensitive=False)()
+
+
+class EstaticosMiddleware(WhiteNoiseMiddleware):
+    """WhiteNoise con soporte async. Con ASGI el archivo se envía en trozos async; WhiteNoise lo entregaría
+    como iterador síncrono y Django lo leería entero a memoria antes de enviarlo."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        self.asincrono = iscoroutinefunction(get_response)
+        if self.asincrono:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.asincrono:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh: # Solo en desarrollo (busca el archivo en disco en cada request)
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is None:
+            return await self.get_response(request)
+        response = self.serve(static_file, request)
+        archivo = getattr(response, 'file_to_stream', None)
+        if archivo is not None:
+            response.streaming_content = trozos(archivo)
+        return response
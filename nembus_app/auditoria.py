@@ -0,0 +1,161 @@
+# nembus_app/auditoria.py
+# Registro de auditoría (LogEntry del admin) fuera del camino crítico de las escrituras.
+# - registrar() no toca la BD: arma el LogEntry en memoria y lo encola con transaction.on_commit, así un
+#   evento de una transacción (o savepoint) revertida se descarta solo.
+# - Dentro de un request (AuditoriaMiddleware) los eventos confirmados se acumulan y se escriben al terminar
+#   el request con UN bulk_create. Fuera de un request (comandos, shell) se escriben al confirmar.
+# - Con AUDITORIA_ASINCRONA=True la escritura la hace un hilo de fondo que junta eventos de varios requests
+#   (hasta AUDITORIA_LOTE filas o AUDITORIA_INTERVALO segundos) por lote. Lo que quede en la cola se escribe
+#   al salir del proceso; si el proceso muere de golpe, los eventos aún en memoria se pierden.
+# Un fallo al escribir la auditoría se registra en el log y nunca revierte ni rompe la operación auditada.
+import atexit
+import logging
+import queue
+import threading
+import time
+from asgiref.local import Local
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.admin.models import LogEntry
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# _local.pendientes: eventos confirmados del request en curso (None fuera de un request). Local de asgiref y no
+# threading.local: con vistas async el request pasa por el event loop y por hilos de sync_to_async
+_local = Local()
+_cola = queue.Queue()
+_hilo = None
+_hilo_lock = threading.Lock()
+
+
+def registrar(usuario, objeto, accion, mensaje):
+    """Encola un LogEntry (ADDITION/CHANGE/DELETION) para `objeto`; se escribe solo si la transacción se confirma.
+    El repr y la hora se toman ahora (el objeto puede borrarse antes de escribir la auditoría)."""
+    evento = LogEntry(
+        action_time=timezone.now(), user_id=usuario.pk,
+        content_type_id=ContentType.objects.get_for_model(objeto).pk, # ContentType queda en memoria tras la 1.ª vez
+        object_id=str(objeto.pk), object_repr=str(objeto)[:200], action_flag=accion, change_message=mensaje,
+    )
+    transaction.on_commit(lambda: _confirmado(evento))
+
+
+def registrar_lote(eventos):
+    """Como registrar() para varios (usuario, objeto, acción, mensaje) de una misma transacción."""
+    for evento in eventos:
+        registrar(*evento)
+
+
+def _confirmado(evento):
+    pendientes = getattr(_local, 'pendientes', None)
+    if pendientes is not None:
+        pendientes.append(evento)
+    else:
+        _despachar([evento])
+
+
+def _despachar(eventos):
+    if not eventos:
+        return
+    if getattr(settings, 'AUDITORIA_ASINCRONA', False):
+        _iniciar_hilo()
+        for evento in eventos:
+            _cola.put(evento)
+    else:
+        _escribir(eventos)
+
+
+def _escribir(eventos):
+    try:
+        LogEntry.objects.bulk_create(eventos)
+    except Exception:
+        logger.exception("auditoria_error eventos=%d", len(eventos))
+    else:
+        logger.debug("auditoria_escrita eventos=%d", len(eventos))
+
+
+# --- REQUEST ---
+
+class AuditoriaMiddleware:
+    """Acumula los eventos de auditoría confirmados durante el request y los escribe juntos al final."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.asincrono = iscoroutinefunction(get_response)
+        if self.asincrono:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.asincrono:
+            return self.__acall__(request)
+        _local.pendientes = []
+        try:
+            return self.get_response(request)
+        finally:
+            pendientes, _local.pendientes = _local.pendientes, None
+            _despachar(pendientes)
+
+    async def __acall__(self, request):
+        _local.pendientes = []
+        try:
+            return await self.get_response(request)
+        finally:
+            pendientes, _local.pendientes = _local.pendientes, None
+            await sync_to_async(_despachar)(pendientes)
+
+
+# --- ESCRITOR DE FONDO (AUDITORIA_ASINCRONA) ---
+
+def _iniciar_hilo():
+    global _hilo
+    if _hilo is not None:
+        return
+    with _hilo_lock:
+        if _hilo is None:
+            _hilo = threading.Thread(target=_escritor, name='nembus-auditoria', daemon=True)
+            _hilo.start()
+            atexit.register(vaciar)
+
+
+def _tomar_lote():
+    """Espera el primer evento y junta los que lleguen hasta completar el lote o cumplir el intervalo."""
+    lote = [_cola.get()]
+    limite = time.monotonic() + settings.AUDITORIA_INTERVALO
+    try:
+        while len(lote) < settings.AUDITORIA_LOTE:
+            lote.append(_cola.get(timeout=max(limite - time.monotonic(), 0)))
+    except queue.Empty:
+        pass
+    return lote
+
+
+def _escritor():
+    while True:
+        lote = _tomar_lote()
+        try:
+            _escribir(lote)
+        finally:
+            # El hilo pasa casi todo el tiempo esperando en la cola: la conexión se cierra tras cada lote para no
+            # retener un cupo del pool (DB_POOL) ni una conexión ociosa en PostgreSQL mientras tanto
+            connections.close_all()
+            for _ in lote:
+                _cola.task_done()
+
+
+def vaciar():
+    """Escribe ya lo que esté en la cola del escritor de fondo (al salir del proceso y en comandos)."""
+    lote = []
+    while True:
+        try:
+            lote.append(_cola.get_nowait())
+        except queue.Empty:
+            break
+    if lote:
+        _escribir(lote)
+        logger.info("auditoria_vaciada eventos=%d", len(lote))
+    for _ in lote:
+        _cola.task_done()
@@ -0,0 +1,108 @@
+# nembus_app/cache_dashboard.py
+# Caché del dashboard de gerencia, por clave (división, panel, rango de fechas). Los paneles se agregan por
+# partes (metricas.datos_panel): los días ya cerrados de un período y el día en curso por separado.
+# - Rangos CERRADOS (terminan antes de hoy): solo cambian por correcciones (venta con fecha pasada, borrado), que
+#   también los invalidan; expiran tras DASHBOARD_CACHE_TIMEOUT_HISTORICO segundos (sin expiración solo con una
+#   caché compartida: con locmem la invalidación no llega a los otros procesos).
+# - Rango ACTUAL (incluye hoy): se invalida en cada escritura de ventas/turnos/traspasos/inventario
+#   (ver signals.py) y, por si la invalidación no llega a otro proceso (caché locmem), expira tras
+#   DASHBOARD_CACHE_TIMEOUT segundos.
+# La invalidación no borra claves: sube un número de versión que forma parte de la clave, así sirve
+# igual con cualquier backend (locmem, archivo o BD) sin tener que listar las claves existentes.
+# La versión es el instante (en ns) de la última invalidación: la API de métricas la usa como
+# ETag/Last-Modified, y responde 304 sin tocar la caché de datos ni la BD.
+# Con réplica de lectura (replica.py), un rango invalidado después de lo que la réplica ya tiene se calcula en
+# el primario: si no, quedaría en caché sin la escritura que lo invalidó.
+import time
+from datetime import datetime
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+from . import replica
+
+ALIAS = 'dashboard'
+VERSION_ACTUAL = 'dashboard:version:actual'
+VERSION_HISTORICO = 'dashboard:version:historico'
+CONTADORES = ('aciertos', 'fallos', 'invalidaciones')
+
+
+def _cache():
+    return caches[ALIAS]
+
+def _incrementar(clave, inicial):
+    cache = _cache()
+    try:
+        cache.incr(clave)
+    except ValueError: # La clave no existe (nunca creada, expulsada por el backend, o DummyCache)
+        cache.set(clave, inicial + 1, timeout=None)
+
+def _version(clave):
+    # Según el reloj: si el backend expulsa la clave, la versión nueva no coincide con claves viejas
+    return _cache().get_or_set(clave, lambda: time.time_ns(), timeout=None)
+
+def _subir_version(clave):
+    # Siempre crece (aunque dos procesos invaliden a la vez, ambos escriben una versión nueva)
+    cache = _cache()
+    cache.set(clave, max((cache.get(clave) or 0) + 1, time.time_ns()), timeout=None)
+
+def _contar(nombre):
+    _incrementar(f'dashboard:contador:{nombre}', 0)
+
+
+def periodo_cerrado(fecha_hasta):
+    """True si el período (fecha_hasta exclusiva) terminó antes de hoy."""
+    return fecha_hasta <= timezone.localdate()
+
+def version_periodo(fecha_hasta):
+    """Versión vigente de los datos de un período: cambia con cada invalidación que lo afecta."""
+    return _version(VERSION_HISTORICO if periodo_cerrado(fecha_hasta) else VERSION_ACTUAL)
+
+def version_rangos(rangos):
+    """Versión vigente de un conjunto de rangos (desde, hasta): la mayor de las que les afectan."""
+    return max((version_periodo(hasta) for _, hasta in rangos), default=_version(VERSION_HISTORICO))
+
+def obtener(nombre, fecha_desde, fecha_hasta, calcular):
+    """Devuelve (datos, acierto): el agregado `nombre` (división:panel) del rango [fecha_desde, fecha_hasta) desde la
+    caché, o el resultado de calcular() guardado en caché."""
+    cerrado = periodo_cerrado(fecha_hasta)
+    version = version_periodo(fecha_hasta)
+    clave = f'dashboard:{nombre}:{fecha_desde.isoformat()}:{fecha_hasta.isoformat()}:v{version}'
+    datos = _cache().get(clave)
+    if datos is not None:
+        _contar('aciertos')
+        return datos, True
+    _contar('fallos')
+    if replica.incluye(version / 1e9):
+        datos = calcular()
+    else:
+        with replica.usar_primario():
+            datos = calcular()
+    _cache().set(clave, datos, timeout=settings.DASHBOARD_CACHE_TIMEOUT_HISTORICO if cerrado else settings.DASHBOARD_CACHE_TIMEOUT)
+    return datos, False
+
+
+def invalidar(fecha=None):
+    """Invalida el período actual y, si la escritura es de un día anterior a hoy (o no se indica fecha), también
+    los períodos cerrados. Se aplica al confirmar la transacción, para que otro request no vuelva a cachear
+    datos aún sin confirmar. fecha puede ser date o datetime."""
+    if isinstance(fecha, datetime):
+        fecha = timezone.localtime(fecha).date()
+    def _invalidar():
+        _subir_version(VERSION_ACTUAL)
+        if fecha is None or fecha < timezone.localdate():
+            _subir_version(VERSION_HISTORICO)
+        _contar('invalidaciones')
+    transaction.on_commit(_invalidar)
+
+
+def estadisticas():
+    """Contadores acumulados de la caché del dashboard (por proceso si el backend es locmem)."""
+    cache = _cache()
+    datos = {nombre: cache.get(f'dashboard:contador:{nombre}', 0) for nombre in CONTADORES}
+    consultas = datos['aciertos'] + datos['fallos']
+    datos['tasa_aciertos'] = datos['aciertos'] / consultas if consultas else 0.0
+    return datos
+
+def reiniciar_estadisticas():
+    _cache().delete_many([f'dashboard:contador:{nombre}' for nombre in CONTADORES])
@@ -0,0 +1,144 @@
+# nembus_app/capacidades.py
+# Qué puede hacer cada usuario en las vistas de trabajadores, en una FOTO inmutable (Capacidades): rol, punto de
+# venta asignado, permisos de recarga/traspaso e IDs de clientes, camiones y camiones de traspaso asignados.
+# - CapacidadesMiddleware la deja en request.capacidades (perezosa: solo se carga si la vista la usa) y las
+#   vistas validan lo que llega en el POST contra los conjuntos de IDs, sin releer el perfil ni las M2M.
+# - Se guarda en la caché CAPACIDADES_CACHE por usuario; signals.py la invalida al confirmar cualquier cambio
+#   del PerfilTrabajador, de sus M2M o del usuario. Con una caché por proceso (locmem) otro worker puede verla
+#   vieja hasta CAPACIDADES_CACHE_TIMEOUT segundos (unos pocos por defecto): con varios workers, una caché
+#   compartida (CAPACIDADES_CACHE_BACKEND) permite una foto más larga.
+# - Un usuario sin PerfilTrabajador no tiene asignaciones (tiene_perfil=False): ya no se crea el perfil al entrar.
+from dataclasses import dataclass
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.functional import SimpleLazyObject
+from .models import PerfilTrabajador
+
+ROL_GERENTE = 'gerente'
+ROL_BOMBERO = 'bombero'
+ROL_CHOFER = 'chofer'
+
+
+def _id(valor):
+    """ID entero de un valor del POST, o None si no es un número."""
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass(frozen=True)
+class Capacidades:
+    usuario_id: int = None
+    rol: str = None # None: usuario anónimo
+    tiene_perfil: bool = False
+    punto_de_venta_id: int = None
+    punto_de_venta_nombre: str = ''
+    puede_recargar: bool = False
+    puede_traspasar: bool = False
+    clientes: frozenset = frozenset()
+    camiones: frozenset = frozenset()
+    camiones_traspaso: frozenset = frozenset()
+
+    @property
+    def es_bombero(self):
+        return self.rol == ROL_BOMBERO
+
+    @property
+    def es_chofer(self):
+        return self.rol == ROL_CHOFER
+
+    @property
+    def punto_de_venta(self):
+        """Lo que usan los templates del punto de venta asignado (None si no tiene)."""
+        if self.punto_de_venta_id is None:
+            return None
+        return {'id': self.punto_de_venta_id, 'nombre': self.punto_de_venta_nombre}
+
+    def cliente_asignado(self, cliente_id):
+        return _id(cliente_id) in self.clientes
+
+    def camion_asignado(self, camion_id):
+        return _id(camion_id) in self.camiones
+
+    def camion_traspaso(self, camion_id):
+        return _id(camion_id) in self.camiones_traspaso
+
+
+ANONIMO = Capacidades()
+
+
+def _cache():
+    return caches[settings.CAPACIDADES_CACHE]
+
+def _clave(usuario_id):
+    return f'capacidades:{usuario_id}'
+
+
+def cargar(usuario):
+    """Capacidades del usuario leídas de la BD: el perfil (con su punto de venta) y los IDs de las tres M2M."""
+    perfil = PerfilTrabajador.objects.select_related('punto_de_venta_asignado').filter(usuario_id=usuario.pk).first()
+    if perfil is None:
+        return Capacidades(usuario_id=usuario.pk, rol=ROL_GERENTE if usuario.is_superuser else ROL_CHOFER)
+    punto_venta = perfil.punto_de_venta_asignado
+    # Mismo orden que el login de siempre: con punto de venta es bombero aunque sea superusuario
+    if punto_venta:
+        rol = ROL_BOMBERO
+    else:
+        rol = ROL_GERENTE if usuario.is_superuser else ROL_CHOFER
+    return Capacidades(
+        usuario_id=usuario.pk, rol=rol, tiene_perfil=True,
+        punto_de_venta_id=punto_venta.pk if punto_venta else None,
+        punto_de_venta_nombre=punto_venta.nombre if punto_venta else '',
+        puede_recargar=perfil.puede_recargar_combustible,
+        puede_traspasar=perfil.puede_hacer_traspasos,
+        clientes=frozenset(perfil.clientes_asignados.values_list('id', flat=True)),
+        camiones=frozenset(perfil.camiones_asignados.values_list('id', flat=True)),
+        camiones_traspaso=frozenset(perfil.camiones_traspaso.values_list('id', flat=True)),
+    )
+
+
+def de_usuario(usuario):
+    """Capacidades del usuario desde la caché (o cargadas y guardadas)."""
+    if not usuario.is_authenticated:
+        return ANONIMO
+    clave = _clave(usuario.pk)
+    capacidades = _cache().get(clave)
+    if capacidades is None:
+        capacidades = cargar(usuario)
+        _cache().set(clave, capacidades, timeout=settings.CAPACIDADES_CACHE_TIMEOUT)
+    return capacidades
+
+
+def invalidar(*usuario_ids):
+    """Descarta la foto de esos usuarios al confirmar la transacción (antes, otro request la volvería a cargar
+    sin el cambio)."""
+    claves = [_clave(usuario_id) for usuario_id in usuario_ids if usuario_id is not None]
+    if claves:
+        transaction.on_commit(lambda: _cache().delete_many(claves))
+
+
+class CapacidadesMiddleware:
+    """request.capacidades: la foto de capacidades del usuario, cargada la primera vez que se usa en el request.
+    Va después de AuthenticationMiddleware."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.asincrono = iscoroutinefunction(get_response)
+        if self.asincrono:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.asincrono:
+            return self.__acall__(request)
+        request.capacidades = SimpleLazyObject(lambda: de_usuario(request.user))
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        # Las vistas async (gerencia) no la usan; si una la usara, debe leerla con sync_to_async
+        request.capacidades = SimpleLazyObject(lambda: de_usuario(request.user))
+        return await self.get_response(request)
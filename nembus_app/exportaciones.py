@@ -0,0 +1,327 @@
+# nembus_app/exportaciones.py
+# Generadores de filas para las exportaciones. Leen con .values_list().iterator() para que la
+# memoria se mantenga constante sin importar cuántos registros tenga el período exportado.
+import csv
+import logging
+import tempfile
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.core.files import File
+from django.db.models import Q
+from django.utils import timezone
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, Border, Side, PatternFill, NamedStyle
+from openpyxl.styles.fonts import DEFAULT_FONT
+from .models import ReporteVenta, RegistroVentaIndividualBomba, TrabajoExportacion
+from . import replica
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 2000 # Filas por lote al leer de la BD
+LATIDO_SEGUNDOS = 30 # Cada cuánto el worker renueva fecha_latido mientras escribe filas
+
+CABECERA_CSV_CAMIONES = ['Fecha', 'Hora', 'Trabajador', 'Cliente', 'Camion', 'Litros Vendidos', 'Monto Combustible (CLP)', 'Costo Flete (CLP)', 'Monto Total (CLP)']
+
+
+def a_datetime_local(valor):
+    """Acepta date o datetime y devuelve un datetime con timezone (medianoche local si era date)."""
+    if valor is None or isinstance(valor, datetime):
+        return valor
+    return timezone.make_aware(datetime.combine(valor, datetime.min.time()))
+
+
+# --- VENTAS DE CAMIONES (CSV) ---
+
+def reportes_camion_query(start_dt, end_dt):
+    return ReporteVenta.objects.filter(
+        fecha_hora__gte=a_datetime_local(start_dt), fecha_hora__lt=a_datetime_local(end_dt)
+    ).order_by('fecha_hora')
+
+
+CAMPOS_CSV_CAMIONES = (
+    'fecha_hora', 'trabajador__username', 'cliente__nombre', 'camion__patente',
+    'litros_vendidos', 'monto_combustible_clp', 'costo_flete_clp', 'monto_total_clp'
+)
+
+
+def _fila_csv_camion(fecha_hora, trabajador, cliente, patente, litros, combustible, flete, total):
+    fecha_hora_local = timezone.localtime(fecha_hora)
+    return [
+        fecha_hora_local.strftime('%Y-%m-%d'),
+        fecha_hora_local.strftime('%H:%M:%S'),
+        trabajador or 'N/A',
+        cliente or 'N/A',
+        patente or 'N/A',
+        # Usar punto como separador decimal para CSV estándar, Excel debería reconocerlo
+        str(litros).replace(',', '.'),
+        str(combustible).replace(',', '.'),
+        str(flete).replace(',', '.'),
+        str(total).replace(',', '.')
+    ]
+
+
+def filas_reportes_camion(start_dt, end_dt):
+    """Genera las filas del CSV de ventas de camión (sin cabecera) entre start_dt y end_dt."""
+    for valores in reportes_camion_query(start_dt, end_dt).values_list(*CAMPOS_CSV_CAMIONES).iterator(chunk_size=CHUNK_SIZE):
+        yield _fila_csv_camion(*valores)
+
+
+class _Eco:
+    """Pseudo-buffer para csv.writer: devuelve la línea escrita en vez de guardarla."""
+    def write(self, value):
+        return value
+
+
+def lineas_csv_camiones(start_dt, end_dt):
+    """Genera el CSV completo (BOM + cabecera + filas) como bytes UTF-8, línea por línea."""
+    writer = csv.writer(_Eco(), delimiter=';') # Usar punto y coma
+    yield u'\ufeff'.encode('utf8') # BOM para Excel
+    yield writer.writerow(CABECERA_CSV_CAMIONES).encode('utf8')
+    for fila in filas_reportes_camion(start_dt, end_dt):
+        yield writer.writerow(fila).encode('utf8')
+
+
+async def alineas_csv_camiones(start_dt, end_dt):
+    """Como lineas_csv_camiones, como generador async (ORM async) para un StreamingHttpResponse servido con ASGI.
+    Las líneas de cada lote se envían juntas: un trozo por lote y no uno por fila."""
+    writer = csv.writer(_Eco(), delimiter=';')
+    yield u'\ufeff'.encode('utf8') + writer.writerow(CABECERA_CSV_CAMIONES).encode('utf8')
+    lote = []
+    # values() y no values_list(): en Django 5.2 aiterator() de values_list() ejecuta la consulta en el event loop
+    async for valores in reportes_camion_query(start_dt, end_dt).values(*CAMPOS_CSV_CAMIONES).aiterator(chunk_size=CHUNK_SIZE):
+        lote.append(writer.writerow(_fila_csv_camion(*valores.values())))
+        if len(lote) >= CHUNK_SIZE:
+            yield ''.join(lote).encode('utf8')
+            lote = []
+    if lote:
+        yield ''.join(lote).encode('utf8')
+
+
+# --- VENTAS DE BOMBAS (EXCEL, MODO write_only) ---
+# El libro se escribe fila a fila (openpyxl write_only vuelca cada fila a un archivo temporal),
+# con estilos con nombre compartidos en vez de fuentes/bordes/formatos asignados celda por celda.
+
+CABECERA_XLSX_BOMBAS = [
+    "Turno", "Fecha Pago", "Máquina", "Socio", "Pagado (CLP)",
+    "Litros", "Precio Litro", "Bomba", "Trabajador", "Punto Venta"
+]
+ANCHOS_XLSX_BOMBAS = {'A': 12, 'B': 12, 'C': 15, 'D': 25, 'E': 15, 'F': 12, 'G': 12, 'H': 20, 'I': 15, 'J': 20}
+
+_BORDE = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+_DERECHA = Alignment(horizontal="right", vertical="center")
+_FORMATO_MONEDA = '$ #,##0'
+_FORMATO_LITROS = '#,##0.00 "L"'
+_FORMATO_PRECIO = '$ #,##0.00'
+
+def _estilos_bombas():
+    return [
+        NamedStyle(name='nb_titulo', font=Font(bold=True, size=16), border=Border(), alignment=Alignment(horizontal="center", vertical="center", wrap_text=True)),
+        NamedStyle(name='nb_negrita', font=Font(bold=True), border=Border()),
+        NamedStyle(name='nb_encabezado', font=Font(bold=True, size=12, color="FFFFFF"),
+                   fill=PatternFill(start_color="1F4E78", end_color="1F4E78", fill_type="solid"),
+                   alignment=Alignment(horizontal="center", vertical="center", wrap_text=True), border=_BORDE),
+        NamedStyle(name='nb_celda', font=DEFAULT_FONT, border=_BORDE),
+        NamedStyle(name='nb_moneda', font=DEFAULT_FONT, border=_BORDE, alignment=_DERECHA, number_format=_FORMATO_MONEDA),
+        NamedStyle(name='nb_litros', font=DEFAULT_FONT, border=_BORDE, alignment=_DERECHA, number_format=_FORMATO_LITROS),
+        NamedStyle(name='nb_precio', font=DEFAULT_FONT, border=_BORDE, alignment=_DERECHA, number_format=_FORMATO_PRECIO),
+        NamedStyle(name='nb_total_etiqueta', font=Font(bold=True), border=_BORDE, alignment=_DERECHA),
+        NamedStyle(name='nb_total_moneda', font=Font(bold=True), border=_BORDE, alignment=_DERECHA, number_format=_FORMATO_MONEDA),
+        NamedStyle(name='nb_total_litros', font=Font(bold=True), border=_BORDE, alignment=_DERECHA, number_format=_FORMATO_LITROS),
+    ]
+
+# Estilo de cada columna en las filas de datos (1-10)
+_ESTILOS_COLUMNAS_DATOS = ['nb_celda'] * 4 + ['nb_moneda', 'nb_litros', 'nb_precio'] + ['nb_celda'] * 3
+
+
+def ventas_bomba_query(start_dt=None, end_dt=None, punto_venta_id=None):
+    """Ventas de bomba ordenadas por fecha. Sin fechas = todos los registros."""
+    ventas_query = RegistroVentaIndividualBomba.objects.all()
+    if punto_venta_id:
+        ventas_query = ventas_query.filter(lectura_bomba__bomba__punto_de_venta_id=punto_venta_id)
+    if start_dt is not None:
+        ventas_query = ventas_query.filter(fecha_registro__gte=a_datetime_local(start_dt), fecha_registro__lt=a_datetime_local(end_dt))
+    return ventas_query.order_by('fecha_registro')
+
+
+def filas_ventas_bomba(ventas_query):
+    """Genera tuplas con los valores de cada venta de bomba (en el orden de CABECERA_XLSX_BOMBAS)."""
+    filas = ventas_query.values_list(
+        'lectura_bomba__reporte_turno__turno__nombre', 'fecha_registro', 'numero_maquina', 'socio_propietario',
+        'ingreso_registro', 'litros_vendidos', 'precio_litro_venta', 'lectura_bomba__bomba__nombre',
+        'lectura_bomba__reporte_turno__trabajador__username', 'lectura_bomba__bomba__punto_de_venta__nombre'
+    )
+    for turno, fecha, maquina, socio, ingreso, litros, precio, bomba, trabajador, pdv in filas.iterator(chunk_size=CHUNK_SIZE):
+        yield (
+            turno or 'N/A',
+            fecha.strftime("%d/%m/%Y") if isinstance(fecha, datetime) else 'N/A',
+            maquina, socio,
+            ingreso if ingreso is not None else Decimal('0.00'),
+            litros if litros is not None else Decimal('0.00'),
+            precio if precio else Decimal('0.00'),
+            bomba or 'N/A', trabajador or 'N/A', pdv or 'N/A',
+        )
+
+
+def escribir_xlsx_ventas_bomba(destino, ventas_query, titulo_reporte, periodo_texto, punto_venta_nombre=None, latido=None):
+    """Escribe el informe de ventas de bombas en `destino` (ruta o archivo binario). Devuelve el número de filas.
+    `latido`, si se pasa, se llama por cada fila escrita (el worker de exportaciones lo usa para dar señales de vida)."""
+    workbook = Workbook(write_only=True)
+    for estilo in _estilos_bombas():
+        workbook.add_named_style(estilo)
+    sheet = workbook.create_sheet("Ventas desde Bombas")
+
+    def celda(valor, estilo=None):
+        c = WriteOnlyCell(sheet, value=valor)
+        if estilo: c.style = estilo
+        return c
+
+    # En write_only las dimensiones deben definirse ANTES de escribir filas
+    header_row_num = 6 if punto_venta_nombre else 5
+    for col, width in ANCHOS_XLSX_BOMBAS.items():
+        sheet.column_dimensions[col].width = width
+    sheet.row_dimensions[header_row_num].height = 30
+    sheet.merged_cells.add('A1:J1')
+
+    # --- Cabecera del Reporte ---
+    sheet.append([celda(titulo_reporte, 'nb_titulo')])
+    sheet.append([])
+    sheet.append(["Fecha de Reporte:", timezone.localtime(timezone.now()).strftime("%d/%m/%Y %H:%M:%S")])
+    sheet.append(["Período:", periodo_texto])
+    if punto_venta_nombre:
+        sheet.append([celda("Punto de Venta:", 'nb_negrita'), punto_venta_nombre])
+    sheet.append([celda(titulo, 'nb_encabezado') for titulo in CABECERA_XLSX_BOMBAS])
+
+    # --- Datos (los totales se acumulan mientras se escriben las filas) ---
+    total_litros = Decimal('0.00')
+    total_ingreso = Decimal('0.00')
+    num_filas = 0
+    for fila in filas_ventas_bomba(ventas_query):
+        sheet.append([celda(valor, estilo) for valor, estilo in zip(fila, _ESTILOS_COLUMNAS_DATOS)])
+        total_ingreso += fila[4]
+        total_litros += fila[5]
+        num_filas += 1
+        if latido: latido()
+
+    # --- Totales ---
+    sheet.append([
+        celda(None, 'nb_celda'), celda(None, 'nb_celda'), celda(None, 'nb_celda'),
+        celda("TOTALES:", 'nb_total_etiqueta'), celda(total_ingreso, 'nb_total_moneda'), celda(total_litros, 'nb_total_litros'),
+        celda(None, 'nb_celda'), celda(None, 'nb_celda'), celda(None, 'nb_celda'), celda(None, 'nb_celda'),
+    ])
+
+    workbook.save(destino)
+    return num_filas
+
+
+# --- TRABAJOS DE EXPORTACIÓN EN SEGUNDO PLANO ---
+
+def umbral_filas_sincronas():
+    """Sobre este número de filas estimadas, las exportaciones se encolan en vez de generarse en el request."""
+    return getattr(settings, 'EXPORTACION_UMBRAL_FILAS', 20000)
+
+
+def encolar_exportacion(tipo, usuario, nombre_archivo, filas_estimadas, start_dt=None, end_dt=None, **extra):
+    """Crea un TrabajoExportacion pendiente. Las fechas se guardan resueltas (ISO) para que el worker no dependa de 'hoy'."""
+    parametros = {
+        'desde': a_datetime_local(start_dt).isoformat() if start_dt is not None else None,
+        'hasta': a_datetime_local(end_dt).isoformat() if end_dt is not None else None,
+        **extra,
+    }
+    return TrabajoExportacion.objects.create(
+        tipo=tipo, solicitado_por=usuario, nombre_archivo=nombre_archivo,
+        filas_estimadas=filas_estimadas, parametros=parametros,
+    )
+
+
+def tomar_siguiente_trabajo():
+    """Reclama el trabajo pendiente más antiguo con un UPDATE condicional (seguro con varios workers, sin SELECT FOR UPDATE)."""
+    for pk in TrabajoExportacion.objects.filter(estado=TrabajoExportacion.PENDIENTE).order_by('fecha_creacion').values_list('pk', flat=True)[:10]:
+        ahora = timezone.now()
+        reclamado = TrabajoExportacion.objects.filter(pk=pk, estado=TrabajoExportacion.PENDIENTE).update(
+            estado=TrabajoExportacion.EN_PROCESO, fecha_inicio=ahora, fecha_latido=ahora
+        )
+        if reclamado:
+            return TrabajoExportacion.objects.get(pk=pk)
+    return None
+
+
+def recuperar_colgados(minutos):
+    """Devuelve a la cola los trabajos en proceso cuyo worker no da señales de vida hace `minutos` (se cayó o lo
+    reiniciaron). Se mide por fecha_latido y no por fecha_inicio: una exportación larga pero viva lo sigue renovando."""
+    limite = timezone.now() - timedelta(minutes=minutos)
+    return TrabajoExportacion.objects.filter(estado=TrabajoExportacion.EN_PROCESO).filter(
+        Q(fecha_latido__lt=limite) | Q(fecha_latido__isnull=True, fecha_inicio__lt=limite) # Trabajos anteriores al latido
+    ).update(estado=TrabajoExportacion.PENDIENTE, fecha_inicio=None, fecha_latido=None)
+
+
+class ReclamoPerdido(Exception):
+    """El trabajo fue recuperado por otro worker mientras esta corrida lo procesaba."""
+
+
+def _reclamo(trabajo):
+    """El trabajo, solo mientras siga reclamado por esta corrida (en proceso y con la misma fecha_inicio)."""
+    return TrabajoExportacion.objects.filter(pk=trabajo.pk, estado=TrabajoExportacion.EN_PROCESO, fecha_inicio=trabajo.fecha_inicio)
+
+
+def _latido(trabajo):
+    """Función para llamar por cada fila: cada LATIDO_SEGUNDOS renueva fecha_latido y corta si se perdió el reclamo."""
+    proximo = time.monotonic() + LATIDO_SEGUNDOS
+
+    def latido():
+        nonlocal proximo
+        if time.monotonic() < proximo:
+            return
+        if not _reclamo(trabajo).update(fecha_latido=timezone.now()):
+            raise ReclamoPerdido(trabajo.pk)
+        proximo = time.monotonic() + LATIDO_SEGUNDOS
+    return latido
+
+
+def procesar_trabajo(trabajo):
+    """Genera el archivo del trabajo en MEDIA_ROOT (vía el storage del FileField) y lo marca completado o con error.
+    Devuelve el trabajo, o None si otro worker lo recuperó mientras tanto (lo generado aquí se descarta)."""
+    p = trabajo.parametros
+    start_dt = datetime.fromisoformat(p['desde']) if p.get('desde') else None
+    end_dt = datetime.fromisoformat(p['hasta']) if p.get('hasta') else None
+    latido = _latido(trabajo)
+    try:
+        with tempfile.TemporaryFile() as tmp, replica.usar_replica(): # Las filas se leen de la réplica si está al día
+            if trabajo.tipo == TrabajoExportacion.TIPO_CSV_CAMIONES:
+                num_filas = -2 # BOM y cabecera no cuentan
+                for linea in lineas_csv_camiones(start_dt, end_dt):
+                    tmp.write(linea)
+                    num_filas += 1
+                    latido()
+            elif trabajo.tipo == TrabajoExportacion.TIPO_XLSX_BOMBAS:
+                num_filas = escribir_xlsx_ventas_bomba(
+                    tmp, ventas_bomba_query(start_dt, end_dt, p.get('punto_venta_id')),
+                    p.get('titulo_reporte', ''), p.get('periodo_texto', ''), p.get('punto_venta_nombre'), latido=latido
+                )
+            else:
+                raise ValueError(f"Tipo de exportación desconocido: {trabajo.tipo}")
+            tmp.seek(0)
+            trabajo.archivo.save(trabajo.nombre_archivo, File(tmp), save=False)
+        trabajo.filas_exportadas = max(num_filas, 0)
+        trabajo.estado = TrabajoExportacion.COMPLETADO
+    except ReclamoPerdido:
+        pass # La escritura final de abajo no encontrará el reclamo y descartará la corrida
+    except Exception as e:
+        logger.exception("Error procesando TrabajoExportacion %s", trabajo.pk)
+        trabajo.estado = TrabajoExportacion.ERROR
+        trabajo.mensaje_error = str(e)
+    trabajo.fecha_fin = timezone.now()
+    # Escritura final condicional: si el trabajo fue recuperado y reclamado por otro worker, esta corrida no pisa
+    # su estado ni su archivo
+    guardado = _reclamo(trabajo).update(
+        archivo=trabajo.archivo.name, filas_exportadas=trabajo.filas_exportadas, estado=trabajo.estado,
+        mensaje_error=trabajo.mensaje_error, fecha_fin=trabajo.fecha_fin,
+    )
+    if not guardado:
+        logger.warning("TrabajoExportacion %s fue recuperado por otro worker: se descarta esta corrida", trabajo.pk)
+        if trabajo.archivo:
+            trabajo.archivo.delete(save=False)
+        return None
+    return trabajo
@@ -1,7 +1,10 @@
 # nembus_app/forms.py
 from django import forms
 from .models import Turno, Bomba, ReporteTurno, LecturaBomba, RegistroVentaIndividualBomba # Importa los modelos necesarios
-from django.forms import inlineformset_factory # Para el formset de ventas
+from django.forms import inlineformset_factory, BaseInlineFormSet # Para el formset de ventas
+import logging
+
+logger = logging.getLogger(__name__)
 
 # Formulario para la pantalla "Iniciar Turno"
 # nembus_app/forms.py
@@ -14,18 +17,12 @@ class IniciarTurnoForm(forms.Form):
         punto_venta = kwargs.pop('punto_venta', None)
         super().__init__(*args, **kwargs)
 
-        print(f"--- Depurando IniciarTurnoForm.__init__ ---") # <-- AÑADIR
-        print(f"Punto de Venta recibido: {punto_venta}") # <-- AÑADIR
-
         if punto_venta:
             self.fields['turno'].queryset = Turno.objects.filter(punto_de_venta=punto_venta)
             bombas = Bomba.objects.filter(punto_de_venta=punto_venta)
 
-            print(f"Bombas encontradas para {punto_venta}: {list(bombas)}") # <-- AÑADIR (Convertir a lista para ver)
-
             for bomba in bombas:
                 field_name = f'contador_inicial_{bomba.id}' # <-- Nombre esperado
-                print(f"  Añadiendo campo: {field_name}") # <-- AÑADIR
                 self.fields[field_name] = forms.DecimalField(
                     label=f"Contador Inicial ({bomba.nombre})",
                     max_digits=12,
@@ -33,8 +30,7 @@ class IniciarTurnoForm(forms.Form):
                     required=True,
                     widget=forms.NumberInput(attrs={'step': '0.01'})
                 )
-        print(f"Campos finales en el form: {list(self.fields.keys())}") # <-- AÑADIR
-        print(f"--- Fin Depuración Form ---") # <-- AÑADIR
+        logger.debug("iniciar_turno_form punto_venta=%s campos=%s", getattr(punto_venta, 'pk', punto_venta), list(self.fields))
 
 # Formulario base para UNA venta individual
 class VentaIndividualForm(forms.ModelForm):
@@ -49,12 +45,40 @@ class VentaIndividualForm(forms.ModelForm):
             'litros_vendidos': forms.NumberInput(attrs={'step': '0.01', 'min': '0'}),
         }
 
+# Campo oculto 'id' de cada venta existente: Django lo valida con un SELECT por formulario (N+1 en turnos
+# con cientos de ventas). Este lo resuelve contra las ventas que el formset ya cargó en una sola consulta.
+class _VentaExistenteField(forms.ModelChoiceField):
+    def __init__(self, formset, *args, **kwargs):
+        self.formset = formset
+        super().__init__(*args, **kwargs)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            pk = self.queryset.model._meta.pk.to_python(value)
+        except forms.ValidationError:
+            pk = None
+        venta = self.formset._existing_object(pk) if pk is not None else None
+        if venta is None:
+            raise forms.ValidationError(self.error_messages['invalid_choice'], code='invalid_choice', params={'value': value})
+        return venta
+
+class BaseVentaIndividualFormSet(BaseInlineFormSet):
+    def add_fields(self, form, index):
+        super().add_fields(form, index)
+        campo = form.fields[self._pk_field.name]
+        form.fields[self._pk_field.name] = _VentaExistenteField(
+            self, campo.queryset, initial=campo.initial, required=False, widget=campo.widget
+        )
+
 # FormSet: Permite manejar MÚLTIPLES formularios de VentaIndividualForm
 # asociados a UNA LecturaBomba específica (es decir, todas las ventas de una bomba en un turno)
 VentaIndividualFormSet = inlineformset_factory(
     LecturaBomba,                     # Modelo Padre (la lectura de la bomba en el turno)
     RegistroVentaIndividualBomba,    # Modelo Hijo (las ventas de esa bomba en ese turno)
     form=VentaIndividualForm,         # Formulario a usar para cada venta
+    formset=BaseVentaIndividualFormSet, # Valida los 'id' sin una consulta por venta
     fields=['numero_maquina', 'socio_propietario', 'litros_vendidos'], # Campos a mostrar/editar
     extra=1,                          # Muestra 1 formulario vacío listo para añadir una nueva venta
     can_delete=True                   # Permite marcar ventas para borrarlas (útil si se comete un error)
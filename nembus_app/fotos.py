@@ -0,0 +1,124 @@
+# nembus_app/fotos.py
+# Procesamiento de las fotos de evidencia de ReporteVenta fuera del request. La vista guarda el archivo tal
+# como llega y deja la venta con foto_estado='pendiente'; el worker (python manage.py procesar_fotos) la
+# reemplaza por una versión normalizada (rotada según EXIF, sin metadatos, lado mayor <= FOTO_LADO_MAX,
+# WebP o JPEG) y genera la miniatura que usan el admin y los listados.
+# Varios workers pueden correr a la vez: el resultado se guarda con un UPDATE condicional al archivo original,
+# así si dos procesan la misma foto solo uno gana y el otro borra lo que generó.
+# El almacenamiento deduplica (almacenamiento.py): varias ventas pueden compartir un archivo, por eso se borra
+# con borrar_si_sin_uso() y no directamente.
+import logging
+import os
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Q
+from PIL import Image, ImageOps
+from .models import ReporteVenta, ArchivoEvidencia
+from .almacenamiento import bloquear_nombre
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONES = {'WEBP': 'webp', 'JPEG': 'jpg'}
+
+
+def _formato():
+    formato = getattr(settings, 'FOTO_FORMATO', 'WEBP').upper()
+    return formato if formato in EXTENSIONES else 'JPEG'
+
+def _abrir(archivo, lado):
+    """Abre la imagen aplicando la rotación EXIF. Para JPEG, draft() decodifica ya reducida (2x-8x menos memoria y CPU)."""
+    imagen = Image.open(archivo)
+    imagen.draft('RGB', (lado, lado))
+    imagen = ImageOps.exif_transpose(imagen)
+    if imagen.mode not in ('RGB', 'L'): # Transparencia o paleta: sobre fondo blanco (JPEG no tiene alfa)
+        fondo = Image.new('RGB', imagen.size, 'white')
+        con_alfa = imagen.convert('RGBA')
+        fondo.paste(con_alfa, mask=con_alfa.getchannel('A'))
+        imagen = fondo
+    return imagen
+
+def _codificar(imagen, lado, calidad, formato):
+    copia = imagen.copy()
+    copia.thumbnail((lado, lado), Image.Resampling.LANCZOS) # Solo reduce, nunca agranda
+    salida = BytesIO()
+    opciones = {'quality': calidad}
+    if formato == 'JPEG':
+        opciones.update(optimize=True, progressive=True)
+    else:
+        opciones.update(method=4)
+    copia.save(salida, formato, **opciones) # Sin exif=: los metadatos (GPS, modelo del teléfono) no se copian
+    return ContentFile(salida.getvalue())
+
+
+def normalizar(archivo):
+    """Devuelve (foto, miniatura, extensión) a partir de un archivo de imagen abierto."""
+    formato = _formato()
+    lado_max = settings.FOTO_LADO_MAX
+    imagen = _abrir(archivo, lado_max)
+    foto = _codificar(imagen, lado_max, settings.FOTO_CALIDAD, formato)
+    miniatura = _codificar(imagen, settings.FOTO_LADO_MINIATURA, settings.FOTO_CALIDAD, formato)
+    return foto, miniatura, EXTENSIONES[formato]
+
+
+def pendientes(limite):
+    return list(ReporteVenta.objects.filter(foto_estado=ReporteVenta.FOTO_PENDIENTE).order_by('pk').values_list('pk', 'foto_evidencia')[:limite])
+
+
+def procesar(pk, original):
+    """Normaliza la foto `original` de la venta `pk`. Devuelve el nuevo estado (procesada/error) o None si otro
+    worker (o una edición) cambió la foto mientras tanto."""
+    campo = ReporteVenta._meta.get_field('foto_evidencia')
+    storage = campo.storage
+    base = os.path.splitext(os.path.basename(original))[0]
+    bytes_original = _tamano(storage, original)
+    try:
+        with storage.open(original, 'rb') as archivo:
+            foto, miniatura, extension = normalizar(archivo)
+    except Exception as e: # Archivo faltante, no es imagen, truncado, bomba de descompresión...
+        logger.warning("foto_error venta=%s archivo=%s error=%s", pk, original, e)
+        actualizados = ReporteVenta.objects.filter(pk=pk, foto_evidencia=original).update(foto_estado=ReporteVenta.FOTO_ERROR)
+        return ReporteVenta.FOTO_ERROR if actualizados else None
+
+    campo_miniatura = ReporteVenta._meta.get_field('foto_miniatura')
+    with transaction.atomic(): # Los archivos guardados quedan bloqueados hasta que la venta los referencia
+        nombre_foto = storage.save(campo.generate_filename(None, f'{base}.{extension}'), foto)
+        nombre_miniatura = campo_miniatura.storage.save(campo_miniatura.generate_filename(None, f'{base}.{extension}'), miniatura)
+        # UPDATE condicional: sin señales (la foto no toca resúmenes ni caché) y sin pisar un cambio concurrente
+        actualizados = ReporteVenta.objects.filter(pk=pk, foto_evidencia=original, foto_estado=ReporteVenta.FOTO_PENDIENTE).update(
+            foto_evidencia=nombre_foto, foto_miniatura=nombre_miniatura, foto_estado=ReporteVenta.FOTO_PROCESADA,
+        )
+    if not actualizados:
+        borrar_si_sin_uso(nombre_foto)
+        borrar_si_sin_uso(nombre_miniatura)
+        return None
+    if nombre_foto != original:
+        borrar_si_sin_uso(original)
+    logger.info("foto_procesada venta=%s archivo=%s bytes_antes=%s bytes_despues=%s miniatura=%s",
+                pk, nombre_foto, bytes_original, foto.size, miniatura.size)
+    return ReporteVenta.FOTO_PROCESADA
+
+def borrar_si_sin_uso(nombre):
+    """Borra el archivo de evidencia `nombre` si ninguna venta lo referencia (como foto o miniatura). Toma el bloqueo
+    del nombre (almacenamiento.bloquear_nombre): una subida concurrente del mismo contenido se confirma antes de revisar."""
+    with transaction.atomic():
+        bloquear_nombre(nombre)
+        if ReporteVenta.objects.filter(Q(foto_evidencia=nombre) | Q(foto_miniatura=nombre)).exists():
+            return False
+        ReporteVenta._meta.get_field('foto_evidencia').storage.delete(nombre)
+        ArchivoEvidencia.objects.filter(nombre=nombre).delete()
+    return True
+
+def _tamano(storage, nombre):
+    try:
+        return storage.size(nombre)
+    except (OSError, NotImplementedError):
+        return None
+
+
+def encolar_existentes():
+    """Marca como pendientes las fotos que aún no tienen miniatura (ventas anteriores al pipeline o con error)."""
+    return ReporteVenta.objects.exclude(Q(foto_evidencia='') | Q(foto_evidencia__isnull=True)).filter(
+        Q(foto_miniatura='') | Q(foto_miniatura__isnull=True)
+    ).update(foto_estado=ReporteVenta.FOTO_PENDIENTE)
@@ -0,0 +1,166 @@
+# nembus_app/instrumentacion.py
+# Medición de cada request: tiempo total, tiempo y número de consultas SQL, consultas duplicadas (misma SQL y
+# mismos parámetros) y repetidas (misma SQL con distintos parámetros: el patrón N+1 de un loop por PDV).
+# - Se exponen en el header Server-Timing (visible en las DevTools del navegador) según
+#   INSTRUMENTACION_SERVER_TIMING: 'staff' (por defecto), 'todos' o 'no'.
+# - Cada request deja una línea de log estructurado (DEBUG) y los que superan los umbrales de settings
+#   (INSTRUMENTACION_UMBRALES por vista, o los generales) un WARNING 'peticion_lenta' con la SQL más repetida.
+# Los mismos valores alimentan los histogramas de /metrics (telemetria.py). Con ASGI también cuenta las consultas
+# que las vistas async hacen en otros hilos (asincrono.en_paralelo), vía registro_actual().
+# Las consultas se capturan con connection.execute_wrapper: funciona con DEBUG=False y sin guardar la SQL
+# más allá del request.
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from . import telemetria
+
+logger = logging.getLogger(__name__)
+
+_registro = ContextVar('nembus_registro_consultas', default=None) # RegistroConsultas del request en curso
+
+
+class RegistroConsultas:
+    """execute_wrapper que acumula tiempo y texto de cada consulta del request."""
+
+    def __init__(self):
+        self.consultas = 0
+        self.segundos = 0.0
+        self.exactas = Counter() # (sql, parámetros) -> veces
+        self.plantillas = Counter() # sql -> veces
+        self.por_bd = Counter() # alias -> consultas (primario / réplica, ver replica.py)
+        self._lock = threading.Lock() # Con vistas async, varios hilos pueden consultar a la vez (asincrono.en_paralelo)
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duracion = time.perf_counter() - inicio
+            with self._lock:
+                self.segundos += duracion
+                self.consultas += 1
+                self.plantillas[sql] += 1
+                self.exactas[(sql, repr(params))] += 1
+                self.por_bd[context['connection'].alias] += 1
+
+    @property
+    def duplicadas(self):
+        return sum(n - 1 for n in self.exactas.values() if n > 1)
+
+    def mas_repetida(self):
+        """(sql, veces) de la consulta que más se repitió, o (None, 0)."""
+        return self.plantillas.most_common(1)[0] if self.plantillas else (None, 0)
+
+
+def registro_actual():
+    """RegistroConsultas del request en curso (None fuera de un request)."""
+    return _registro.get()
+
+
+@contextmanager
+def medir_consultas(registro):
+    """Cuenta en `registro` las consultas de este hilo en todas las BD configuradas (ej. réplica de lectura)."""
+    with ExitStack() as pila:
+        if registro is not None:
+            for alias in connections:
+                pila.enter_context(connections[alias].execute_wrapper(registro))
+        yield
+
+
+def umbrales(vista):
+    """Umbrales de la vista (nombre de URL, ej. 'nembus_app:dashboard_gerente') sobre los generales."""
+    generales = {
+        'ms': settings.INSTRUMENTACION_LENTA_MS,
+        'consultas': settings.INSTRUMENTACION_MAX_CONSULTAS,
+        'repeticiones': settings.INSTRUMENTACION_MAX_REPETICIONES,
+    }
+    return {**generales, **settings.INSTRUMENTACION_UMBRALES.get(vista, {})}
+
+
+class InstrumentacionMiddleware:
+    """Mide cada request (tiempo, SQL) y lo informa en Server-Timing y en el log."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.asincrono = iscoroutinefunction(get_response)
+        if self.asincrono:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.asincrono:
+            return self.__acall__(request)
+        registro = RegistroConsultas()
+        token = _registro.set(registro)
+        inicio = time.perf_counter()
+        try:
+            with medir_consultas(registro):
+                response = self.get_response(request)
+        finally:
+            _registro.reset(token)
+        total_ms = (time.perf_counter() - inicio) * 1000
+        self._informar(request, response, registro, total_ms, getattr(request, 'user', None))
+        return response
+
+    async def __acall__(self, request):
+        # Las vistas síncronas y el ORM async corren en el hilo del request (ThreadSensitiveContext de Django):
+        # el execute_wrapper se instala en la conexión de ese hilo, no en la del event loop
+        registro = RegistroConsultas()
+        token = _registro.set(registro)
+        inicio = time.perf_counter()
+        medicion = medir_consultas(registro)
+        await sync_to_async(medicion.__enter__)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(medicion.__exit__)(None, None, None)
+            _registro.reset(token)
+        total_ms = (time.perf_counter() - inicio) * 1000
+        usuario = None
+        if settings.INSTRUMENTACION_SERVER_TIMING == 'staff' and hasattr(request, 'auser'):
+            usuario = await request.auser() # request.user haría una consulta síncrona desde el event loop
+        self._informar(request, response, registro, total_ms, usuario)
+        return response
+
+    def _informar(self, request, response, registro, total_ms, usuario):
+        match = getattr(request, 'resolver_match', None)
+        vista = match.view_name if match else None
+        sql_repetida, repeticiones = registro.mas_repetida()
+        request.instrumentacion = datos = {
+            'vista': vista, 'estado': response.status_code, 'ms': total_ms, 'db_ms': registro.segundos * 1000,
+            'consultas': registro.consultas, 'duplicadas': registro.duplicadas, 'repeticiones': repeticiones,
+            'por_bd': dict(registro.por_bd),
+        }
+        telemetria.observar_peticion(vista, request.method, response.status_code, total_ms / 1000, registro.consultas)
+        if self._mostrar_server_timing(usuario):
+            response['Server-Timing'] = (
+                f'app;dur={total_ms:.1f}, '
+                f'db;dur={datos["db_ms"]:.1f};desc="{registro.consultas} consultas, {registro.duplicadas} duplicadas"'
+            )
+
+        limites = umbrales(vista)
+        excedidos = [f"{clave}>{limites[clave]}" for clave, valor in (('ms', total_ms), ('consultas', registro.consultas), ('repeticiones', repeticiones))
+                     if limites.get(clave) is not None and valor > limites[clave]]
+        campos = (f"vista={vista} metodo={request.method} ruta={request.path} estado={response.status_code} "
+                  f"ms={total_ms:.1f} db_ms={datos['db_ms']:.1f} consultas={registro.consultas} "
+                  f"duplicadas={registro.duplicadas} repeticiones={repeticiones} "
+                  f"bd={','.join(f'{alias}:{n}' for alias, n in sorted(registro.por_bd.items())) or '-'}")
+        if excedidos:
+            logger.warning("peticion_lenta %s excede=%s sql_repetida=%r", campos, ",".join(excedidos), (sql_repetida or '')[:300])
+        else:
+            logger.debug("peticion %s", campos)
+
+    def _mostrar_server_timing(self, usuario):
+        modo = settings.INSTRUMENTACION_SERVER_TIMING
+        if modo == 'todos':
+            return True
+        if modo == 'staff': # request.user lo pone AuthenticationMiddleware (más adentro) en este mismo request
+            return bool(usuario and usuario.is_authenticated and usuario.is_staff)
+        return False
@@ -0,0 +1,157 @@
+# nembus_app/inventario.py
+# Movimientos de inventario de camiones seguros ante concurrencia.
+# En vez de leer litros_actuales en Python y guardarlo de vuelta (dos choferes sobre el mismo camión
+# pierden una de las actualizaciones), cada movimiento es UN UPDATE con F() que además verifica
+# stock no negativo / capacidad en la misma sentencia. Los traspasos bloquean ambos camiones con
+# SELECT ... FOR UPDATE siempre en orden de id, para que dos traspasos cruzados no se bloqueen mutuamente.
+#
+# Cada movimiento además queda registrado en el libro MovimientoCombustible (append-only), del cual
+# litros_actuales es solo una materialización. Llamar siempre dentro de transaction.atomic().
+from datetime import timedelta
+from decimal import Decimal
+from django.db.models import F, Sum, Case, When, Value, DecimalField
+from django.utils import timezone
+from .models import Camion, Bomba, MovimientoCombustible, SnapshotSaldo
+
+
+class InventarioError(ValueError):
+    """Movimiento rechazado por falta de stock o por exceder la capacidad. El mensaje es apto para el usuario."""
+
+
+def _litros_disponibles(camion_id):
+    return Camion.objects.filter(pk=camion_id).values_list('litros_actuales', flat=True).first() or Decimal('0.00')
+
+
+def descontar_camion(camion, litros, trabajador=None, reporte_venta=None):
+    """Resta litros del camión solo si alcanza el stock (venta). Lanza InventarioError si no."""
+    actualizados = Camion.objects.filter(pk=camion.pk, litros_actuales__gte=litros).update(
+        litros_actuales=F('litros_actuales') - litros
+    )
+    if not actualizados:
+        raise InventarioError(f"Error: No hay suficientes litros en el camión ({camion.patente}). Disponibles: {_litros_disponibles(camion.pk)} L.")
+    return MovimientoCombustible.objects.create(
+        tipo=MovimientoCombustible.VENTA, camion=camion, litros=-litros, trabajador=trabajador, reporte_venta=reporte_venta
+    )
+
+
+def recargar_camion(camion, litros, trabajador=None):
+    """Suma litros al camión solo si no excede su capacidad. Lanza InventarioError si no."""
+    actualizados = Camion.objects.filter(pk=camion.pk, litros_actuales__lte=F('capacidad_total') - litros).update(
+        litros_actuales=F('litros_actuales') + litros
+    )
+    if not actualizados:
+        maximo = camion.capacidad_total - _litros_disponibles(camion.pk)
+        raise InventarioError(f"Error: La recarga excede la capacidad de {camion.patente}. Máximo a añadir: {maximo} L.")
+    return MovimientoCombustible.objects.create(
+        tipo=MovimientoCombustible.RECARGA, camion=camion, litros=litros, trabajador=trabajador
+    )
+
+
+def traspasar_entre_camiones(camion_origen, camion_destino, litros, trabajador=None, traspaso=None):
+    """Mueve litros entre dos camiones bajo bloqueo de fila (en orden de id). Debe llamarse dentro de transaction.atomic()."""
+    if camion_origen.pk == camion_destino.pk:
+        raise InventarioError("Error: El camión de origen y destino no pueden ser el mismo.")
+    # Orden fijo de bloqueo: evita deadlocks entre A->B y B->A simultáneos
+    bloqueados = {
+        c.pk: c for c in Camion.objects.select_for_update().filter(
+            pk__in=[camion_origen.pk, camion_destino.pk]
+        ).order_by('pk').only('pk', 'patente', 'capacidad_total', 'litros_actuales')
+    }
+    origen, destino = bloqueados[camion_origen.pk], bloqueados[camion_destino.pk]
+    if origen.litros_actuales < litros:
+        raise InventarioError(f"Error: No hay suficientes litros en {origen.patente}. Disponibles: {origen.litros_actuales} L.")
+    if destino.litros_actuales + litros > destino.capacidad_total:
+        raise InventarioError(f"Error: El traspaso excede la capacidad de {destino.patente}.")
+    Camion.objects.filter(pk=origen.pk).update(litros_actuales=F('litros_actuales') - litros)
+    Camion.objects.filter(pk=destino.pk).update(litros_actuales=F('litros_actuales') + litros)
+    ahora = timezone.now()
+    MovimientoCombustible.objects.bulk_create([
+        MovimientoCombustible(fecha_hora=ahora, tipo=MovimientoCombustible.TRASPASO_SALIDA, camion_id=origen.pk,
+                              litros=-litros, trabajador=trabajador, traspaso=traspaso),
+        MovimientoCombustible(fecha_hora=ahora, tipo=MovimientoCombustible.TRASPASO_ENTRADA, camion_id=destino.pk,
+                              litros=litros, trabajador=trabajador, traspaso=traspaso),
+    ])
+
+
+def descontar_bomba(lectura, litros, trabajador=None):
+    """Cierre de turno: resta de la bomba lo vendido en la lectura (se permiten negativos, como antes)."""
+    Bomba.objects.filter(pk=lectura.bomba_id).update(litros_actuales=F('litros_actuales') - litros)
+    return MovimientoCombustible.objects.create(
+        tipo=MovimientoCombustible.CIERRE_TURNO, bomba_id=lectura.bomba_id, litros=-litros,
+        trabajador=trabajador, lectura_bomba=lectura
+    )
+
+
+def descontar_bombas(lecturas, trabajador=None):
+    """Cierre de turno en lote: un solo UPDATE (CASE por bomba) y un bulk_create de movimientos para todas las lecturas."""
+    por_bomba = {}
+    for lectura in lecturas:
+        por_bomba[lectura.bomba_id] = por_bomba.get(lectura.bomba_id, Decimal('0')) + lectura.litros_vendidos_turno
+    if not por_bomba:
+        return []
+    Bomba.objects.filter(pk__in=por_bomba).update(litros_actuales=F('litros_actuales') - Case(
+        *[When(pk=pk, then=Value(litros)) for pk, litros in por_bomba.items()],
+        output_field=DecimalField(max_digits=12, decimal_places=4)
+    ))
+    ahora = timezone.now()
+    return MovimientoCombustible.objects.bulk_create([
+        MovimientoCombustible(fecha_hora=ahora, tipo=MovimientoCombustible.CIERRE_TURNO, bomba_id=lectura.bomba_id,
+                              litros=-lectura.litros_vendidos_turno, trabajador=trabajador, lectura_bomba=lectura)
+        for lectura in lecturas
+    ])
+
+
+def registrar_ajuste(estanque, litros, trabajador=None, nota=''):
+    """Registra en el libro un cambio de saldo hecho por fuera de los flujos normales (ej. edición en el admin)."""
+    campo = 'camion' if isinstance(estanque, Camion) else 'bomba'
+    return MovimientoCombustible.objects.create(
+        tipo=MovimientoCombustible.AJUSTE, litros=litros, trabajador=trabajador, nota=nota, **{campo: estanque}
+    )
+
+
+def ajustar_saldo(estanque, litros, trabajador=None, nota=''):
+    """Ajuste manual (admin): suma (o resta, si es negativo) litros al saldo actual con F() bajo bloqueo de fila y lo
+    registra como AJUSTE. Nunca escribe un saldo absoluto, así no pisa los movimientos concurrentes. Dentro de transaction.atomic()."""
+    modelo = type(estanque)
+    modelo.objects.select_for_update().filter(pk=estanque.pk).values_list('pk', flat=True).first()
+    modelo.objects.filter(pk=estanque.pk).update(litros_actuales=F('litros_actuales') + litros)
+    return registrar_ajuste(estanque, litros, trabajador=trabajador, nota=nota)
+
+# --- SALDOS HISTÓRICOS (SNAPSHOTS + MOVIMIENTOS) ---
+
+def _filtro_estanque(estanque):
+    return {'camion': estanque} if isinstance(estanque, Camion) else {'bomba': estanque}
+
+
+def saldo_en(estanque, momento):
+    """Saldo de un camión o bomba al instante `momento`: último snapshot <= momento + movimientos posteriores hasta momento."""
+    filtro = _filtro_estanque(estanque)
+    snapshot = SnapshotSaldo.objects.filter(fecha_hora__lte=momento, **filtro).order_by('-fecha_hora').first()
+    movimientos = MovimientoCombustible.objects.filter(fecha_hora__lte=momento, **filtro)
+    base = Decimal('0')
+    if snapshot:
+        base = snapshot.litros
+        movimientos = movimientos.filter(fecha_hora__gt=snapshot.fecha_hora)
+    return base + (movimientos.aggregate(t=Sum('litros'))['t'] or Decimal('0'))
+
+
+def crear_snapshots(margen=timedelta(minutes=5)):
+    """Crea un checkpoint por estanque con fecha now-margen (el margen deja cerrar transacciones en curso)."""
+    momento = timezone.now() - margen
+    snapshots = [
+        SnapshotSaldo(fecha_hora=momento, litros=saldo_en(estanque, momento), **_filtro_estanque(estanque))
+        for estanque in [*Camion.objects.all(), *Bomba.objects.all()]
+    ]
+    return SnapshotSaldo.objects.bulk_create(snapshots)
+
+
+def saldos_descuadrados():
+    """Estanques cuyo litros_actuales (caché) no coincide con la suma del libro. Devuelve [(estanque, cache, libro)]."""
+    por_camion = dict(MovimientoCombustible.objects.filter(camion__isnull=False).values('camion').annotate(t=Sum('litros')).values_list('camion', 't'))
+    por_bomba = dict(MovimientoCombustible.objects.filter(bomba__isnull=False).values('bomba').annotate(t=Sum('litros')).values_list('bomba', 't'))
+    descuadres = []
+    for estanque, totales in [*((c, por_camion) for c in Camion.objects.all()), *((b, por_bomba) for b in Bomba.objects.all())]:
+        libro = totales.get(estanque.pk) or Decimal('0')
+        if libro != estanque.litros_actuales:
+            descuadres.append((estanque, estanque.litros_actuales, libro))
+    return descuadres
@@ -0,0 +1,198 @@
+# nembus_app/management/commands/benchmark_asgi.py
+
+import asyncio
+import json
+import logging
+import os
+import queue
+import random
+import statistics
+import threading
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+# Tipo de petición -> (peso en la mezcla, URLs posibles). Las exportaciones son las lentas.
+MEZCLA = {
+    'api_panel': (70, [
+        ('camiones', 'mes', 'kpis', 'comparar=anterior'), ('camiones', 'semana', 'eficiencia_flota', ''),
+        ('bombas', 'mes', 'kpis', 'comparar=anio'), ('bombas', 'mes', 'pdv', ''),
+        ('relaciones', 'ultimos_30', 'kpis', 'comparar=anterior'), ('relaciones', 'mes', 'clientes', ''),
+    ]),
+    'dashboard': (10, [('camiones', 'mes'), ('bombas', 'semana'), ('relaciones', 'mes')]),
+    'exportar_csv': (10, ['mes']),
+    'exportar_excel': (10, ['mes']),
+}
+# Sin caché del dashboard: se mide el cálculo de los paneles, no aciertos de caché
+SIN_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+             'dashboard': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+             'capacidades': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+class Command(BaseCommand):
+    help = ('Compara WSGI (N workers síncronos, uno por hilo) con ASGI (un event loop con C requests en vuelo) bajo una '
+            'mezcla de lecturas: paneles de la API de métricas, páginas del dashboard y exportaciones CSV/Excel del mes, '
+            'contra la BD configurada (usar datos de sembrar_carga). Informa p50/p95 por tipo de petición y req/s totales. '
+            'Todo corre en este proceso (un solo GIL): la diferencia se ve cuando domina la espera a la BD (PostgreSQL), '
+            'no con SQLite ni con el trabajo de CPU de openpyxl.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--peticiones', type=int, default=200, help='Peticiones por modo.')
+        parser.add_argument('--workers', type=int, default=4, help='Workers síncronos (hilos) en el modo WSGI.')
+        parser.add_argument('--concurrencia', type=int, default=32, help='Peticiones simultáneas en el modo ASGI.')
+        parser.add_argument('--con-cache', action='store_true', help='Usar la caché del dashboard configurada (por defecto, sin caché).')
+        parser.add_argument('--semilla', type=int, default=42)
+        parser.add_argument('--salida', help='Archivo JSON donde guardar los resultados.')
+
+    def handle(self, *args, **options):
+        usuario = User.objects.filter(is_superuser=True, is_active=True).order_by('pk').first()
+        if usuario is None:
+            raise CommandError("Se necesita un superusuario activo (las vistas medidas son de gerencia).")
+        rnd = random.Random(options['semilla'])
+        tipos = list(MEZCLA)
+        peticiones = []
+        for tipo in rnd.choices(tipos, weights=[MEZCLA[t][0] for t in tipos], k=options['peticiones']):
+            peticiones.append((tipo, self.url(tipo, rnd.choice(MEZCLA[tipo][1]))))
+
+        logger_app = logging.getLogger('nembus_app') # Silencia peticion_lenta (las exportaciones lo disparan) salvo con -v 2
+        nivel_original = logger_app.level
+        if options['verbosity'] < 2:
+            logger_app.setLevel(logging.CRITICAL)
+        try:
+            # 'testserver' es el host de los clientes de prueba (el test runner de Django lo agrega igual)
+            ajustes = {'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver']}
+            if not options['con_cache']:
+                ajustes['CACHES'] = SIN_CACHE
+            with override_settings(**ajustes):
+                self.stdout.write(f"WSGI: {options['workers']} workers síncronos, {len(peticiones)} peticiones...")
+                wsgi = self.correr_wsgi(usuario, peticiones, options['workers'])
+                self.stdout.write(f"ASGI: 1 event loop, {options['concurrencia']} en vuelo, {len(peticiones)} peticiones...")
+                asgi = asyncio.run(self.correr_asgi(usuario, peticiones, options['concurrencia']))
+        finally:
+            logger_app.setLevel(nivel_original)
+
+        resultados = {'motor': connection.vendor, 'parametros': {k: options[k] for k in ('peticiones', 'workers', 'concurrencia', 'con_cache', 'semilla')},
+                      'wsgi': wsgi, 'asgi': asgi}
+        self.mostrar(resultados)
+        if options['salida']:
+            os.makedirs(os.path.dirname(os.path.abspath(options['salida'])), exist_ok=True)
+            with open(options['salida'], 'w', encoding='utf-8') as archivo:
+                json.dump(resultados, archivo, indent=2, ensure_ascii=False)
+            self.stdout.write(f"Resultados guardados en {options['salida']}")
+
+    def url(self, tipo, args):
+        if tipo == 'api_panel':
+            division, periodo, panel, consulta = args
+            return reverse('nembus_app:api_metricas', args=[division, periodo, panel]) + (f'?{consulta}' if consulta else '')
+        if tipo == 'dashboard':
+            return reverse('nembus_app:dashboard_gerente', args=list(args))
+        if tipo == 'exportar_csv':
+            return reverse('nembus_app:exportar_reportes') + f'?periodo={args}'
+        return reverse('nembus_app:exportar_ventas_bomba_excel') + f'?periodo={args}'
+
+    # --- EJECUCIÓN ---
+
+    def correr_wsgi(self, usuario, peticiones, workers):
+        cola = queue.Queue()
+        for peticion in peticiones:
+            cola.put(peticion)
+        muestras, lock = [], threading.Lock()
+
+        def worker():
+            cliente = Client()
+            cliente.force_login(usuario)
+            propias = []
+            try:
+                while True:
+                    try:
+                        tipo, url = cola.get_nowait()
+                    except queue.Empty:
+                        break
+                    inicio = time.perf_counter()
+                    try:
+                        respuesta = cliente.get(url)
+                        if respuesta.streaming:
+                            for _ in respuesta.streaming_content: # El tiempo incluye enviar el archivo completo
+                                pass
+                        ok = respuesta.status_code in (200, 302)
+                    except Exception:
+                        ok = False
+                    propias.append((tipo, time.perf_counter() - inicio, ok))
+            finally:
+                with lock:
+                    muestras.extend(propias)
+                connection.close()
+
+        hilos = [threading.Thread(target=worker) for _ in range(workers)]
+        inicio = time.monotonic()
+        for h in hilos: h.start()
+        for h in hilos: h.join()
+        return self.estadisticas(muestras, time.monotonic() - inicio)
+
+    async def correr_asgi(self, usuario, peticiones, concurrencia):
+        cola = asyncio.Queue()
+        for peticion in peticiones:
+            cola.put_nowait(peticion)
+        muestras = []
+        cliente = AsyncClient()
+        await cliente.aforce_login(usuario)
+
+        async def en_vuelo():
+            while not cola.empty():
+                tipo, url = cola.get_nowait()
+                inicio = time.perf_counter()
+                try:
+                    respuesta = await cliente.get(url)
+                    if respuesta.streaming:
+                        if respuesta.is_async:
+                            async for _ in respuesta.streaming_content:
+                                pass
+                        else:
+                            for _ in respuesta.streaming_content:
+                                pass
+                    ok = respuesta.status_code in (200, 302)
+                except Exception:
+                    ok = False
+                muestras.append((tipo, time.perf_counter() - inicio, ok))
+
+        inicio = time.monotonic()
+        await asyncio.gather(*(en_vuelo() for _ in range(concurrencia)))
+        duracion = time.monotonic() - inicio
+        await sync_to_async(close_old_connections)()
+        return self.estadisticas(muestras, duracion)
+
+    # --- RESULTADOS ---
+
+    def estadisticas(self, muestras, duracion):
+        por_tipo = {}
+        for tipo in MEZCLA:
+            propias = [m for m in muestras if m[0] == tipo]
+            tiempos = sorted(m[1] * 1000 for m in propias if m[2])
+            if len(tiempos) >= 2:
+                p = statistics.quantiles(tiempos, n=100, method='inclusive')
+                p50, p95 = p[49], p[94]
+            else:
+                p50 = p95 = tiempos[0] if tiempos else None
+            por_tipo[tipo] = {'peticiones': len(propias), 'errores': len(propias) - len(tiempos),
+                              'p50_ms': round(p50, 2) if p50 is not None else None, 'p95_ms': round(p95, 2) if p95 is not None else None}
+        ok = sum(1 for m in muestras if m[2])
+        return {'tipos': por_tipo, 'duracion_s': round(duracion, 3), 'rps': round(ok / duracion, 2) if duracion else None,
+                'errores': len(muestras) - ok}
+
+    def mostrar(self, resultados):
+        fmt = lambda x: f"{x:.1f}" if x is not None else '-'
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n=== {resultados['motor']} ==="))
+        self.stdout.write(f"{'Tipo':16} {'pet.':>5} | {'WSGI p50':>9} {'p95':>9} {'err.':>5} | {'ASGI p50':>9} {'p95':>9} {'err.':>5}")
+        for tipo in MEZCLA:
+            w, a = resultados['wsgi']['tipos'][tipo], resultados['asgi']['tipos'][tipo]
+            self.stdout.write(f"{tipo:16} {w['peticiones']:>5} | {fmt(w['p50_ms']):>9} {fmt(w['p95_ms']):>9} {w['errores']:>5} | "
+                              f"{fmt(a['p50_ms']):>9} {fmt(a['p95_ms']):>9} {a['errores']:>5}")
+        w, a = resultados['wsgi'], resultados['asgi']
+        self.stdout.write(f"{'Total':16} {'':>5} | {fmt(w['rps']):>9} req/s {w['duracion_s']:>6.1f} s | {fmt(a['rps']):>9} req/s {a['duracion_s']:>6.1f} s")
+        if w['errores'] or a['errores']:
+            self.stdout.write(self.style.WARNING(f"Errores: WSGI {w['errores']}, ASGI {a['errores']} (ver con -v 2)."))
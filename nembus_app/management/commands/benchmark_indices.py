@@ -0,0 +1,152 @@
+# nembus_app/management/commands/benchmark_indices.py
+
+import itertools
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from nembus_app.models import (
+    Cliente, Camion, PuntoDeVenta, Bomba, Turno, ReporteVenta, ReporteTurno,
+    LecturaBomba, RegistroVentaIndividualBomba
+)
+from nembus_app.exportaciones import reportes_camion_query, ventas_bomba_query
+
+# Índices agregados en 0014_indices_rangos_fecha: se miden sin ellos ("antes") y con ellos ("después")
+INDICES = [
+    (ReporteVenta, 'rv_fecha_camion_idx'),
+    (RegistroVentaIndividualBomba, 'rvb_fecha_lectura_idx'),
+    (ReporteTurno, 'rt_fecha_inicio_idx'),
+    (ReporteTurno, 'rt_abierto_trabajador_idx'),
+]
+
+class Rollback(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = ('Siembra ventas de prueba (1M por defecto) dentro de una transacción, mide las consultas por rango '
+            'de fecha de dashboards/exportaciones sin y con los índices compuestos/parciales, muestra planes y '
+            'tiempos, y al final revierte todo (no deja datos ni cambios de esquema).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--filas', type=int, default=1_000_000, help='Ventas de camión y ventas de bomba a sembrar (cada una).')
+        parser.add_argument('--dias', type=int, default=365, help='Días de histórico sobre los que se reparten las ventas.')
+        parser.add_argument('--repeticiones', type=int, default=5, help='Ejecuciones por consulta (se informa la mediana).')
+        parser.add_argument('--sin-planes', action='store_true', help='No imprimir los planes de ejecución.')
+
+    def handle(self, *args, **options):
+        self.opciones = options
+        try:
+            with transaction.atomic():
+                self.sembrar(options['filas'], options['dias'])
+                antes = self.medir_fase('ANTES (sin índices nuevos)', crear=False)
+                despues = self.medir_fase('DESPUÉS (con índices nuevos)', crear=True)
+                self.resumen(antes, despues)
+                raise Rollback()
+        except Rollback:
+            self.stdout.write("Datos de prueba revertidos.")
+
+    # --- SIEMBRA ---
+
+    def sembrar(self, filas, dias):
+        rnd = random.Random(42)
+        inicio = time.monotonic()
+        ahora = timezone.now()
+        usuarios = [User.objects.create(username=f"bench-{i}") for i in range(20)]
+        clientes = [Cliente.objects.create(nombre=f"BENCH Cliente {i}", precio_litro_clp=1000, costo_flete_clp=0) for i in range(50)]
+        camiones = [Camion.objects.create(patente=f"BENCH{i}", capacidad_total=30000) for i in range(10)]
+        pdv = PuntoDeVenta.objects.create(nombre="BENCH PDV")
+        bombas = [Bomba.objects.create(punto_de_venta=pdv, nombre=f"Bomba {i}", precio_litro_clp=1000) for i in range(4)]
+        turno = Turno.objects.create(punto_de_venta=pdv, nombre="BENCH Turno")
+
+        def fecha_al_azar():
+            return ahora - timedelta(seconds=rnd.randint(0, dias * 86400))
+
+        self.stdout.write(f"Sembrando {filas} ventas de camión...")
+        # fecha_hora es auto_now_add: se desactiva mientras se siembra para repartir las ventas en el histórico
+        campo_fecha = ReporteVenta._meta.get_field('fecha_hora')
+        campo_fecha.auto_now_add = False
+        try:
+            self._insertar_en_lotes(ReporteVenta, (
+                ReporteVenta(
+                    trabajador=rnd.choice(usuarios), cliente=rnd.choice(clientes), camion=rnd.choice(camiones),
+                    litros_vendidos=litros, monto_combustible_clp=litros * 1000, monto_total_clp=litros * 1000,
+                    fecha_hora=fecha_al_azar(),
+                ) for litros in (Decimal(rnd.randint(10, 5000)) for _ in range(filas))
+            ))
+        finally:
+            campo_fecha.auto_now_add = True
+
+        # Un turno (cerrado) cada ~50 ventas de bomba, más un turno abierto por trabajador
+        n_turnos = max(filas // 50, 1)
+        self.stdout.write(f"Sembrando {n_turnos} turnos y {filas} ventas de bomba...")
+        turnos = ReporteTurno.objects.bulk_create(
+            [ReporteTurno(trabajador=rnd.choice(usuarios), turno=turno, fecha_inicio=fecha_al_azar(), esta_abierto=False) for _ in range(n_turnos)],
+            batch_size=5000
+        )
+        ReporteTurno.objects.bulk_create([ReporteTurno(trabajador=u, turno=turno) for u in usuarios])
+        lecturas = LecturaBomba.objects.bulk_create(
+            [LecturaBomba(reporte_turno=t, bomba=rnd.choice(bombas), contador_inicial=0) for t in turnos], batch_size=5000
+        )
+        self._insertar_en_lotes(RegistroVentaIndividualBomba, (
+            RegistroVentaIndividualBomba(
+                lectura_bomba=rnd.choice(lecturas), numero_maquina=str(rnd.randint(1, 500)), socio_propietario="BENCH",
+                litros_vendidos=litros, precio_litro_venta=1000, ingreso_registro=litros * 1000, fecha_registro=fecha_al_azar(),
+            ) for litros in (Decimal(rnd.randint(5, 200)) for _ in range(filas))
+        ))
+        self.usuario_consulta = usuarios[0]
+        self.stdout.write(f"Siembra lista en {time.monotonic() - inicio:.1f}s.")
+
+    def _insertar_en_lotes(self, modelo, objetos, tamano=5000):
+        # bulk_create convierte todo a lista: se le pasan lotes para no tener 1M de instancias en memoria
+        while lote := list(itertools.islice(objetos, tamano)):
+            modelo.objects.bulk_create(lote)
+
+    # --- MEDICIÓN ---
+
+    def consultas(self):
+        fin = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        semana = fin - timedelta(days=7)
+        mes = fin - timedelta(days=30)
+        return [
+            ('CSV ventas camión (7 días)', reportes_camion_query(semana, fin).values_list(
+                'fecha_hora', 'trabajador__username', 'cliente__nombre', 'camion__patente', 'litros_vendidos', 'monto_total_clp')),
+            ('Excel ventas bomba (7 días)', ventas_bomba_query(semana, fin).values_list(
+                'fecha_registro', 'lectura_bomba__bomba__nombre', 'litros_vendidos', 'ingreso_registro')),
+            ('Turnos reportados (30 días)', ReporteTurno.objects.filter(fecha_inicio__gte=mes, fecha_inicio__lt=fin).values('pk')),
+            ('Turno abierto del trabajador', ReporteTurno.objects.filter(trabajador=self.usuario_consulta, esta_abierto=True).values('pk')[:1]),
+        ]
+
+    def medir_fase(self, titulo, crear):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n=== {titulo} ==="))
+        editor = connection.schema_editor()
+        with connection.cursor() as cursor:
+            for modelo, nombre in INDICES:
+                indice = next(i for i in modelo._meta.indexes if i.name == nombre)
+                if crear:
+                    cursor.execute(str(indice.create_sql(modelo, editor)))
+                else:
+                    cursor.execute(editor.sql_delete_index % {'table': editor.quote_name(modelo._meta.db_table), 'name': editor.quote_name(nombre)})
+            cursor.execute('ANALYZE') # Estadísticas frescas para el planificador
+        tiempos = {}
+        for nombre, qs in self.consultas():
+            if not self.opciones['sin_planes']:
+                self.stdout.write(f"-- {nombre}\n{qs.explain()}")
+            muestras = []
+            for _ in range(self.opciones['repeticiones']):
+                inicio = time.perf_counter()
+                n = len(list(qs.iterator(chunk_size=2000)))
+                muestras.append(time.perf_counter() - inicio)
+            tiempos[nombre] = statistics.median(muestras)
+            self.stdout.write(f"   {nombre}: {n} filas, mediana {tiempos[nombre] * 1000:.1f} ms")
+        return tiempos
+
+    def resumen(self, antes, despues):
+        self.stdout.write(self.style.MIGRATE_HEADING("\n=== RESUMEN ==="))
+        for nombre in antes:
+            factor = antes[nombre] / despues[nombre] if despues[nombre] else float('inf')
+            self.stdout.write(f"  {nombre:32} {antes[nombre] * 1000:9.1f} ms -> {despues[nombre] * 1000:9.1f} ms  (x{factor:.1f})")
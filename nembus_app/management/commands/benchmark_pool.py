@@ -0,0 +1,133 @@
+# nembus_app/management/commands/benchmark_pool.py
+
+import copy
+import importlib.util
+import statistics
+import threading
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Count, Sum
+from django.db.utils import Error as ErrorBD
+from django.utils import timezone
+from nembus_app.models import ReporteVenta
+
+MODOS = ['sin_pool', 'persistente', 'pool']
+
+class Command(BaseCommand):
+    help = ('Prueba de carga de las conexiones a PostgreSQL: N workers concurrentes hacen "requests" (una consulta del '
+            'dashboard y devolver la conexión como al final de un request de Django) con conexión nueva por request '
+            '(sin_pool), conexión persistente por worker (persistente, CONN_MAX_AGE) y el pool de psycopg 3 (pool). '
+            'Informa latencia p50/p95/p99, req/s, errores y el máximo de conexiones abiertas en el servidor.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, nargs='+', default=[8, 32], help='Workers concurrentes (uno o varios valores).')
+        parser.add_argument('--requests', type=int, default=50, help='Requests por worker.')
+        parser.add_argument('--modos', nargs='+', choices=MODOS, default=MODOS)
+        parser.add_argument('--pool-max', type=int, default=10, help='max_size del pool en el modo pool.')
+        parser.add_argument('--pool-timeout', type=float, default=10, help='Segundos esperando una conexión del pool.')
+
+    def handle(self, *args, **options):
+        base = connections['default'].settings_dict
+        if connections['default'].vendor != 'postgresql':
+            raise CommandError("Esta prueba es para PostgreSQL (DATABASE_URL=postgres://...).")
+        modos = list(options['modos'])
+        if 'pool' in modos and not (importlib.util.find_spec('psycopg') and importlib.util.find_spec('psycopg_pool')):
+            self.stdout.write(self.style.WARNING("El modo pool requiere psycopg 3 y psycopg-pool (pip install \"psycopg[binary,pool]\"); se omite."))
+            modos.remove('pool')
+
+        filas = []
+        for workers in options['workers']:
+            for modo in modos:
+                alias = f'benchmark_{modo}'
+                connections.settings[alias] = self.ajustes(base, modo, options)
+                self.stdout.write(f"{modo}: {workers} workers x {options['requests']} requests...")
+                try:
+                    filas.append((modo, workers, self.correr(alias, workers, options['requests'])))
+                finally:
+                    if modo == 'pool':
+                        connections[alias].close_pool()
+                    del connections.settings[alias]
+
+        self.stdout.write(f"\n{'Modo':12} {'workers':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'errores':>8} {'conex. máx':>10}")
+        for modo, workers, e in filas:
+            fmt = lambda x: f"{x:.1f}" if x is not None else '-'
+            self.stdout.write(f"{modo:12} {workers:>7} {fmt(e['p50']):>8} {fmt(e['p95']):>8} {fmt(e['p99']):>8} "
+                              f"{fmt(e['rps']):>8} {e['errores']:>8} {e['conexiones_max']:>10}")
+            for error in e['ejemplos_error']:
+                self.stdout.write(self.style.ERROR(f"    {error}"))
+
+    def ajustes(self, base, modo, options):
+        ajustes = copy.deepcopy(base)
+        opciones = ajustes.setdefault('OPTIONS', {})
+        opciones.pop('pool', None)
+        ajustes['CONN_MAX_AGE'] = 600 if modo == 'persistente' else 0
+        if modo == 'pool':
+            opciones['pool'] = {'min_size': 2, 'max_size': options['pool_max'], 'timeout': options['pool_timeout']}
+        return ajustes
+
+    # --- EJECUCIÓN ---
+
+    def request(self, alias, desde):
+        """Lo que hace un request del dashboard contra la BD: una agregación y devolver la conexión."""
+        try:
+            ReporteVenta.objects.using(alias).filter(fecha_hora__gte=desde).aggregate(litros=Sum('litros_vendidos'), n=Count('id'))
+        finally:
+            # Igual que close_old_connections al terminar un request: cierra si CONN_MAX_AGE venció (0 = siempre;
+            # con pool, "cerrar" es devolverla al pool)
+            connections[alias].close_if_unusable_or_obsolete()
+
+    def correr(self, alias, workers, requests):
+        desde = timezone.now() - timedelta(days=1)
+        tiempos, errores, lock = [], [], threading.Lock()
+        listos = threading.Barrier(workers + 1) # Todos arrancan a la vez: una ráfaga, como un cambio de turno
+        terminado = threading.Event()
+        conexiones_max = [0]
+
+        def worker():
+            propios = []
+            listos.wait()
+            for _ in range(requests):
+                inicio = time.perf_counter()
+                try:
+                    self.request(alias, desde)
+                    propios.append((time.perf_counter() - inicio) * 1000)
+                except ErrorBD as e:
+                    with lock:
+                        errores.append(str(e).strip().splitlines()[0][:150])
+            with lock:
+                tiempos.extend(propios)
+            connections[alias].close()
+
+        def monitor():
+            # Conexiones abiertas en el servidor para esta BD (incluye la del monitor y las de otros clientes)
+            while not terminado.is_set():
+                try:
+                    with connections['default'].cursor() as cursor:
+                        cursor.execute("SELECT count(*) FROM pg_stat_activity WHERE datname = current_database()")
+                        conexiones_max[0] = max(conexiones_max[0], cursor.fetchone()[0])
+                except ErrorBD:
+                    pass
+                terminado.wait(0.05)
+            connections['default'].close()
+
+        hilos = [threading.Thread(target=worker) for _ in range(workers)]
+        vigia = threading.Thread(target=monitor)
+        vigia.start()
+        for h in hilos: h.start()
+        listos.wait()
+        inicio = time.monotonic()
+        for h in hilos: h.join()
+        duracion = time.monotonic() - inicio
+        terminado.set()
+        vigia.join()
+
+        tiempos.sort()
+        if len(tiempos) >= 2:
+            p = statistics.quantiles(tiempos, n=100, method='inclusive')
+            p50, p95, p99 = p[49], p[94], p[98]
+        else:
+            p50 = p95 = p99 = tiempos[0] if tiempos else None
+        return {'p50': p50, 'p95': p95, 'p99': p99, 'rps': len(tiempos) / duracion if duracion else None,
+                'errores': len(errores), 'ejemplos_error': sorted(set(errores))[:3], 'conexiones_max': conexiones_max[0]}
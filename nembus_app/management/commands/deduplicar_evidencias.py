@@ -0,0 +1,86 @@
+# nembus_app/management/commands/deduplicar_evidencias.py
+
+import re
+import uuid
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from nembus_app.models import ReporteVenta
+from nembus_app.fotos import borrar_si_sin_uso
+
+# Nombre ya direccionado por contenido: .../ab/cd/<sha256>.<ext>
+DIRECCIONADO = re.compile(r'(^|/)[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.[^/]*)?$')
+CAMPOS = ('foto_evidencia', 'foto_miniatura')
+
+class Command(BaseCommand):
+    help = ('Mueve las fotos de evidencia existentes al almacenamiento direccionado por contenido (EVIDENCIAS_STORAGE): '
+            'renombra cada archivo por su hash, une los duplicados y borra los archivos viejos sin uso.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde-local', action='store_true',
+                            help='Lee los archivos viejos de MEDIA_ROOT (al pasar a EVIDENCIAS_STORAGE=s3). Los locales no se borran.')
+        parser.add_argument('--verificar', action='store_true',
+                            help='Solo comprueba el almacenamiento configurado (guardar 2 veces, leer, URL, borrar) y termina.')
+
+    def handle(self, *args, **options):
+        storage = ReporteVenta._meta.get_field('foto_evidencia').storage
+        self.stdout.write(f"Almacenamiento de evidencias: {storage.__class__.__name__} ({settings.EVIDENCIAS_STORAGE})")
+        if options['verificar']:
+            self.verificar(storage)
+            return
+
+        origen = FileSystemStorage(location=settings.MEDIA_ROOT) if options['desde_local'] else storage
+        movidos, faltantes = 0, 0
+        viejos, nuevos = set(), set()
+        for campo in CAMPOS:
+            filas = ReporteVenta.objects.exclude(Q(**{campo: ''}) | Q(**{f'{campo}__isnull': True})).values_list('pk', campo)
+            for pk, nombre in filas.iterator():
+                if DIRECCIONADO.search(nombre) and not options['desde_local']:
+                    continue
+                try:
+                    with origen.open(nombre, 'rb') as archivo:
+                        nuevo = storage.save(nombre, archivo)
+                except FileNotFoundError:
+                    faltantes += 1
+                    self.stdout.write(self.style.WARNING(f"  Venta #{pk}: {nombre} no existe en el origen, se omite."))
+                    continue
+                if nuevo == nombre:
+                    continue
+                # Condicional: si el worker de fotos cambió el archivo mientras tanto, se deja su versión
+                if ReporteVenta.objects.filter(**{'pk': pk, campo: nombre}).update(**{campo: nuevo}):
+                    movidos += 1
+                    viejos.add(nombre)
+                    nuevos.add(nuevo)
+                else:
+                    borrar_si_sin_uso(nuevo)
+
+        borrados = 0
+        if not options['desde_local']:
+            borrados = sum(borrar_si_sin_uso(nombre) for nombre in viejos)
+        self.stdout.write(self.style.SUCCESS(
+            f"Listo: {movidos} referencia(s) movida(s) a {len(nuevos)} archivo(s) únicos, "
+            f"{borrados} archivo(s) viejo(s) borrado(s), {faltantes} faltante(s)."
+        ))
+
+    def verificar(self, storage):
+        """Prueba de humo del backend (local o S3/MinIO): dedup, lectura, URL y borrado."""
+        contenido = f'nembus verificacion {uuid.uuid4()}'.encode()
+        primero = storage.save('evidencias/verificacion.txt', ContentFile(contenido))
+        segundo = storage.save('evidencias/otro_nombre.txt', ContentFile(contenido))
+        try:
+            if primero != segundo:
+                raise CommandError(f"El mismo contenido se guardó con dos nombres: {primero} / {segundo}")
+            if not DIRECCIONADO.search(primero):
+                raise CommandError(f"El nombre no está direccionado por contenido: {primero}")
+            with storage.open(primero, 'rb') as archivo:
+                if archivo.read() != contenido:
+                    raise CommandError("El contenido leído no coincide con el guardado.")
+            self.stdout.write(f"  Guardado dos veces como {primero}")
+            self.stdout.write(f"  URL: {storage.url(primero)}")
+        finally:
+            storage.delete(primero)
+        if storage.exists(primero):
+            raise CommandError(f"No se pudo borrar {primero}")
+        self.stdout.write(self.style.SUCCESS("Almacenamiento OK."))
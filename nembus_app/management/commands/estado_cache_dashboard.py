@@ -0,0 +1,25 @@
+# nembus_app/management/commands/estado_cache_dashboard.py
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from nembus_app import cache_dashboard
+
+class Command(BaseCommand):
+    help = ('Muestra aciertos, fallos e invalidaciones de la caché del dashboard de gerencia. '
+            'Con backend locmem los contadores son del proceso que ejecuta el comando.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reiniciar', action='store_true', help='Pone los contadores en cero.')
+        parser.add_argument('--invalidar', action='store_true', help='Invalida todos los períodos cacheados (actual y cerrados).')
+
+    def handle(self, *args, **options):
+        if options['invalidar']:
+            cache_dashboard.invalidar()
+            self.stdout.write(self.style.SUCCESS("Caché del dashboard invalidada."))
+        if options['reiniciar']:
+            cache_dashboard.reiniciar_estadisticas()
+            self.stdout.write(self.style.SUCCESS("Contadores reiniciados."))
+        datos = cache_dashboard.estadisticas()
+        self.stdout.write(f"Backend: {settings.DASHBOARD_CACHE_BACKEND}")
+        self.stdout.write(f"Aciertos: {datos['aciertos']}  Fallos: {datos['fallos']}  Invalidaciones: {datos['invalidaciones']}  "
+                          f"Tasa de aciertos: {datos['tasa_aciertos']:.1%}")
@@ -0,0 +1,50 @@
+# nembus_app/management/commands/procesar_exportaciones.py
+
+import time
+from django.core.management.base import BaseCommand
+from nembus_app.models import TrabajoExportacion
+from nembus_app.exportaciones import tomar_siguiente_trabajo, procesar_trabajo, recuperar_colgados
+
+INTERVALO_RECUPERACION = 60 # Segundos entre revisiones de trabajos colgados
+
+class Command(BaseCommand):
+    help = 'Worker de exportaciones en segundo plano (CSV/Excel). Usa la BD como cola, no requiere Redis ni Celery.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--una-vez', action='store_true', help='Procesa los trabajos pendientes y termina.')
+        parser.add_argument('--intervalo', type=float, default=5.0, help='Segundos de espera cuando no hay trabajos (default: 5).')
+        parser.add_argument('--timeout-colgados', type=int, default=30,
+                            help='Minutos sin latido tras los cuales un trabajo "en proceso" se considera colgado y vuelve a la cola (default: 30).')
+
+    def recuperar_colgados(self, timeout_colgados):
+        # Devuelve a la cola los trabajos cuyo worker dejó de dar señales de vida (ej. caído o reiniciado durante un deploy)
+        recuperados = recuperar_colgados(timeout_colgados)
+        if recuperados:
+            self.stdout.write(self.style.WARNING(f"{recuperados} trabajo(s) colgado(s) devuelto(s) a la cola."))
+
+    def handle(self, *args, **options):
+        self.stdout.write("Worker de exportaciones iniciado.")
+        # La recuperación se repite dentro del bucle: si otro worker muere, este reencola sus trabajos
+        # sin esperar a un reinicio. Basta con revisarlo una vez por minuto.
+        proxima_revision = 0.0
+        while True:
+            if time.monotonic() >= proxima_revision:
+                self.recuperar_colgados(options['timeout_colgados'])
+                proxima_revision = time.monotonic() + INTERVALO_RECUPERACION
+            trabajo = tomar_siguiente_trabajo()
+            if trabajo is None:
+                if options['una_vez']:
+                    break
+                time.sleep(options['intervalo'])
+                continue
+
+            self.stdout.write(f"Procesando {trabajo}...")
+            inicio = time.monotonic()
+            if procesar_trabajo(trabajo) is None:
+                self.stdout.write(self.style.WARNING(f"  Trabajo #{trabajo.pk} recuperado por otro worker: se descarta esta corrida."))
+                continue
+            duracion = time.monotonic() - inicio
+            if trabajo.estado == TrabajoExportacion.COMPLETADO:
+                self.stdout.write(self.style.SUCCESS(f"  {trabajo.nombre_archivo}: {trabajo.filas_exportadas} filas en {duracion:.1f}s"))
+            else:
+                self.stdout.write(self.style.ERROR(f"  Error en trabajo #{trabajo.pk}: {trabajo.mensaje_error}"))
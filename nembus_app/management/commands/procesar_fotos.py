@@ -0,0 +1,41 @@
+# nembus_app/management/commands/procesar_fotos.py
+
+import time
+from django.core.management.base import BaseCommand
+from nembus_app.models import ReporteVenta
+from nembus_app import fotos
+
+class Command(BaseCommand):
+    help = ('Worker de fotos de evidencia: normaliza (rotación EXIF, tamaño máximo, WebP/JPEG sin metadatos) las fotos '
+            'pendientes de ReporteVenta y genera sus miniaturas. Usa la BD como cola, no requiere Redis ni Celery.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--una-vez', action='store_true', help='Procesa las fotos pendientes y termina.')
+        parser.add_argument('--intervalo', type=float, default=5.0, help='Segundos de espera cuando no hay fotos (default: 5).')
+        parser.add_argument('--lote', type=int, default=20, help='Fotos que se leen de la cola por vuelta (default: 20).')
+        parser.add_argument('--encolar-existentes', action='store_true',
+                            help='Antes de empezar, marca como pendientes las fotos que aún no tienen miniatura.')
+
+    def handle(self, *args, **options):
+        if options['encolar_existentes']:
+            self.stdout.write(f"{fotos.encolar_existentes()} foto(s) existente(s) encolada(s).")
+
+        self.stdout.write("Worker de fotos iniciado.")
+        while True:
+            lote = fotos.pendientes(options['lote'])
+            if not lote:
+                if options['una_vez']:
+                    break
+                time.sleep(options['intervalo'])
+                continue
+
+            for pk, original in lote:
+                inicio = time.monotonic()
+                estado = fotos.procesar(pk, original)
+                duracion = time.monotonic() - inicio
+                if estado == ReporteVenta.FOTO_PROCESADA:
+                    self.stdout.write(self.style.SUCCESS(f"  Venta #{pk}: {original} procesada en {duracion:.2f}s"))
+                elif estado == ReporteVenta.FOTO_ERROR:
+                    self.stdout.write(self.style.ERROR(f"  Venta #{pk}: {original} no es una imagen válida"))
+                else:
+                    self.stdout.write(f"  Venta #{pk}: la foto cambió mientras se procesaba, se omite.")
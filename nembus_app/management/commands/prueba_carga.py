@@ -0,0 +1,241 @@
+# nembus_app/management/commands/prueba_carga.py
+
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import threading
+import time
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+from nembus_app.models import Turno, Bomba, LecturaBomba
+from .sembrar_carga import USUARIO_CHOFER, USUARIO_BOMBERO, exigir_bd_de_pruebas
+
+# Escenario -> pasos que mide (cada paso es un tipo de petición con su propia latencia y consultas)
+ESCENARIOS = {
+    'venta_camion': ['venta_camion'],
+    'traspaso': ['traspaso'],
+    'turno': ['turno_iniciar', 'turno_guardar', 'turno_finalizar'],
+}
+VERSION_RESULTADOS = 1
+
+class Command(BaseCommand):
+    help = ('Prueba de carga de los flujos de escritura de choferes y bomberos: N hilos concurrentes (cada uno con su '
+            'usuario sembrado por sembrar_carga) registran ventas de camión, traspasos y turnos completos (iniciar, '
+            'guardar ventas, finalizar) contra la BD configurada (SQLite o PostgreSQL según DATABASE_URL). Informa '
+            'p50/p95/p99, consultas por petición y throughput, y guarda/compara resultados en JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--escenarios', nargs='+', choices=list(ESCENARIOS), default=list(ESCENARIOS))
+        parser.add_argument('--hilos', type=int, default=8, help='Usuarios concurrentes por escenario.')
+        parser.add_argument('--iteraciones', type=int, default=25, help='Operaciones (o turnos completos) por hilo.')
+        parser.add_argument('--ventas-turno', type=int, default=10, help='Ventas por bomba guardadas en cada turno.')
+        parser.add_argument('--semilla', type=int, default=42)
+        parser.add_argument('--salida', help='Archivo JSON donde guardar los resultados (ej. resultados_carga/<commit>-sqlite.json).')
+        parser.add_argument('--comparar', help='JSON de una corrida anterior: falla si algún paso empeoró más allá de la tolerancia.')
+        parser.add_argument('--tolerancia', type=float, default=0.20, help='Empeoramiento de p95 tolerado al comparar (default: 0.20 = 20%%).')
+        parser.add_argument('--forzar', action='store_true', help='Permite correr con DEBUG desactivado (solo en una BD de pruebas).')
+
+    def handle(self, *args, **options):
+        exigir_bd_de_pruebas(options)
+        self.opciones = options
+        choferes = list(User.objects.filter(username__in=[USUARIO_CHOFER.format(i) for i in range(options['hilos'])]).order_by('pk'))
+        bomberos = list(User.objects.filter(username__in=[USUARIO_BOMBERO.format(i) for i in range(options['hilos'])]).order_by('pk'))
+        if len(choferes) < options['hilos'] or len(bomberos) < options['hilos']:
+            raise CommandError(f"Faltan usuarios de carga para {options['hilos']} hilos: corre antes "
+                               f"'python manage.py sembrar_carga --choferes {options['hilos']} --bomberos {options['hilos']}'.")
+
+        # El log de cada venta (y el traceback de cada error) ahoga la salida: se silencia salvo con -v 2.
+        # Los errores se cuentan igual en la tabla (columna err.)
+        logger_app = logging.getLogger('nembus_app')
+        nivel_original = logger_app.level
+        if options['verbosity'] < 2:
+            logger_app.setLevel(logging.CRITICAL)
+        try:
+            pasos = {}
+            for escenario in options['escenarios']:
+                usuarios = bomberos if escenario == 'turno' else choferes
+                self.stdout.write(f"Escenario {escenario}: {options['hilos']} hilos x {options['iteraciones']} iteraciones...")
+                pasos.update(self.correr(escenario, usuarios))
+        finally:
+            logger_app.setLevel(nivel_original)
+
+        resultados = {
+            'version': VERSION_RESULTADOS,
+            'fecha': timezone.now().isoformat(timespec='seconds'),
+            'commit': self.commit_actual(),
+            'motor': connection.vendor,
+            'version_motor': '.'.join(map(str, connection.Database.sqlite_version_info)) if connection.vendor == 'sqlite' else getattr(connection, 'pg_version', None),
+            'parametros': {clave: options[clave] for clave in ('escenarios', 'hilos', 'iteraciones', 'ventas_turno', 'semilla')},
+            'pasos': pasos,
+        }
+        self.mostrar(resultados)
+        if options['salida']:
+            os.makedirs(os.path.dirname(os.path.abspath(options['salida'])), exist_ok=True)
+            with open(options['salida'], 'w', encoding='utf-8') as archivo:
+                json.dump(resultados, archivo, indent=2, ensure_ascii=False)
+            self.stdout.write(f"Resultados guardados en {options['salida']}")
+        if options['comparar']:
+            self.comparar(resultados, options['comparar'], options['tolerancia'])
+
+    # --- EJECUCIÓN ---
+
+    def correr(self, escenario, usuarios):
+        muestras = {paso: [] for paso in ESCENARIOS[escenario]}
+        lock = threading.Lock()
+        errores = []
+
+        def hilo(usuario, semilla):
+            propias = {paso: [] for paso in muestras}
+            try:
+                cliente = Client(SERVER_NAME='localhost')
+                cliente.force_login(usuario)
+                getattr(self, f'escenario_{escenario}')(cliente, usuario, random.Random(semilla), propias)
+            except Exception as e: # Un hilo caído no debe colgar la prueba: se informa al final
+                errores.append(f"{usuario.username}: {e!r}")
+            finally:
+                with lock:
+                    for paso, lista in propias.items():
+                        muestras[paso] += lista
+                connection.close() # Cada hilo tiene su propia conexión
+
+        rnd = random.Random(self.opciones['semilla'])
+        hilos = [threading.Thread(target=hilo, args=(usuario, rnd.random())) for usuario in usuarios[:self.opciones['hilos']]]
+        inicio = time.monotonic()
+        for h in hilos: h.start()
+        for h in hilos: h.join()
+        duracion = time.monotonic() - inicio
+        for error in errores:
+            self.stdout.write(self.style.ERROR(f"  Hilo abortado: {error}"))
+        return {paso: self.estadisticas(lista, duracion) for paso, lista in muestras.items()}
+
+    def medir(self, cliente, muestras, paso, url, datos):
+        """POST midiendo latencia y consultas. Los flujos de escritura redirigen (302) si la operación se guardó."""
+        with CaptureQueriesContext(connection) as ctx:
+            inicio = time.perf_counter()
+            respuesta = cliente.post(url, datos)
+            duracion = time.perf_counter() - inicio
+        muestras[paso].append((duracion, len(ctx.captured_queries), respuesta.status_code == 302))
+        return respuesta
+
+    def escenario_venta_camion(self, cliente, usuario, rnd, muestras):
+        perfil = usuario.perfiltrabajador
+        clientes = list(perfil.clientes_asignados.values_list('pk', flat=True))
+        camiones = list(perfil.camiones_asignados.values_list('pk', flat=True))
+        url = reverse('nembus_app:crear_reporte')
+        for _ in range(self.opciones['iteraciones']):
+            self.medir(cliente, muestras, 'venta_camion', url,
+                       {'cliente': rnd.choice(clientes), 'camion': rnd.choice(camiones), 'litros': rnd.randint(1, 50)})
+
+    def escenario_traspaso(self, cliente, usuario, rnd, muestras):
+        camiones = list(usuario.perfiltrabajador.camiones_traspaso.values_list('pk', flat=True))
+        url = reverse('nembus_app:crear_traspaso')
+        for i in range(self.opciones['iteraciones']):
+            origen, destino = (camiones[0], camiones[1]) if i % 2 == 0 else (camiones[1], camiones[0]) # Ida y vuelta: saldos estables
+            self.medir(cliente, muestras, 'traspaso', url, {'camion_origen': origen, 'camion_destino': destino, 'litros': rnd.randint(1, 50)})
+
+    def escenario_turno(self, cliente, usuario, rnd, muestras):
+        pdv = usuario.perfiltrabajador.punto_de_venta_asignado
+        turnos = list(Turno.objects.filter(punto_de_venta=pdv).values_list('pk', flat=True))
+        bombas = list(Bomba.objects.filter(punto_de_venta=pdv).values_list('pk', flat=True))
+        for _ in range(self.opciones['iteraciones']):
+            # 1) Iniciar (si quedó un turno abierto de una corrida anterior, redirige a ese y se cierra igual)
+            respuesta = self.medir(cliente, muestras, 'turno_iniciar', reverse('nembus_app:iniciar_turno'),
+                                   {'turno': rnd.choice(turnos), **{f'contador_inicial_{b}': '0' for b in bombas}})
+            if respuesta.status_code != 302:
+                continue
+            reporte_id = resolve(respuesta.url).kwargs['reporte_id']
+            url = reverse('nembus_app:gestionar_turno', args=[reporte_id])
+            # 2) Guardar las ventas de todas las bombas en un POST (formsets)
+            lecturas = LecturaBomba.objects.filter(reporte_turno_id=reporte_id).values_list('pk', flat=True)
+            self.medir(cliente, muestras, 'turno_guardar', url, self.datos_ventas(lecturas, rnd))
+            # 3) Finalizar
+            self.medir(cliente, muestras, 'turno_finalizar', url, {'finalizar_turno': '1'})
+
+    def datos_ventas(self, lecturas, rnd):
+        datos = {}
+        n = self.opciones['ventas_turno']
+        for lectura in lecturas:
+            prefijo = f'ventas_{lectura}'
+            datos.update({f'{prefijo}-TOTAL_FORMS': n, f'{prefijo}-INITIAL_FORMS': 0, f'{prefijo}-MIN_NUM_FORMS': 0, f'{prefijo}-MAX_NUM_FORMS': 1000})
+            for i in range(n):
+                datos.update({f'{prefijo}-{i}-numero_maquina': str(rnd.randint(1, 500)), f'{prefijo}-{i}-socio_propietario': 'CARGA',
+                              f'{prefijo}-{i}-litros_vendidos': rnd.randint(5, 200), f'{prefijo}-{i}-lectura_bomba': lectura})
+        return datos
+
+    # --- RESULTADOS ---
+
+    def estadisticas(self, muestras, duracion):
+        ok = [m for m in muestras if m[2]]
+        tiempos = sorted(m[0] * 1000 for m in ok)
+        consultas = [m[1] for m in ok]
+        if len(tiempos) >= 2:
+            p = statistics.quantiles(tiempos, n=100, method='inclusive')
+            p50, p95, p99 = p[49], p[94], p[98]
+        else:
+            p50 = p95 = p99 = tiempos[0] if tiempos else None
+        redondear = lambda x: round(x, 2) if x is not None else None
+        return {
+            'peticiones': len(muestras), 'errores': len(muestras) - len(ok),
+            'p50_ms': redondear(p50), 'p95_ms': redondear(p95), 'p99_ms': redondear(p99),
+            'media_ms': redondear(statistics.fmean(tiempos)) if tiempos else None,
+            'consultas_media': redondear(statistics.fmean(consultas)) if consultas else None,
+            'consultas_p50': statistics.median_low(consultas) if consultas else None,
+            'consultas_max': max(consultas, default=None),
+            'rps': round(len(ok) / duracion, 2) if duracion else None,
+        }
+
+    def mostrar(self, resultados):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"\n=== {resultados['motor']} {resultados['version_motor'] or ''} | commit {resultados['commit'] or '?'} ==="))
+        self.stdout.write(f"{'Paso':16} {'pet.':>6} {'err.':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'consultas':>10} {'máx':>5} {'req/s':>8}")
+        for paso, e in resultados['pasos'].items():
+            fmt = lambda x: f"{x:.1f}" if x is not None else '-'
+            self.stdout.write(f"{paso:16} {e['peticiones']:>6} {e['errores']:>5} {fmt(e['p50_ms']):>8} {fmt(e['p95_ms']):>8} "
+                              f"{fmt(e['p99_ms']):>8} {fmt(e['consultas_media']):>10} {e['consultas_max'] or '-':>5} {fmt(e['rps']):>8}")
+
+    def comparar(self, actual, ruta, tolerancia):
+        try:
+            with open(ruta, encoding='utf-8') as archivo:
+                base = json.load(archivo)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"No se pudo leer {ruta}: {e}")
+        if base.get('motor') != actual['motor']:
+            self.stdout.write(self.style.WARNING(f"La base es de {base.get('motor')} y esta corrida de {actual['motor']}: los tiempos no son comparables."))
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n=== Comparación con {ruta} (commit {base.get('commit') or '?'}) ==="))
+        regresiones = []
+        for paso, e in actual['pasos'].items():
+            b = base.get('pasos', {}).get(paso)
+            if not b or b.get('p95_ms') is None or e['p95_ms'] is None:
+                continue
+            cambio = e['p95_ms'] / b['p95_ms'] - 1 if b['p95_ms'] else 0
+            self.stdout.write(f"  {paso:16} p95 {b['p95_ms']:.1f} -> {e['p95_ms']:.1f} ms ({cambio:+.0%}), "
+                              f"consultas (mediana) {b.get('consultas_p50')} -> {e['consultas_p50']}, errores {b['errores']} -> {e['errores']}")
+            # Un par de ms de diferencia es ruido aunque en porcentaje sea mucho
+            if cambio > tolerancia and e['p95_ms'] - b['p95_ms'] > 2:
+                regresiones.append(f"{paso}: p95 {cambio:+.0%}")
+            # Mediana y no media: la primera petición de cada hilo carga cachés (ContentType, versiones) y hace más consultas
+            if e['consultas_p50'] is not None and b.get('consultas_p50') is not None and e['consultas_p50'] > b['consultas_p50']:
+                regresiones.append(f"{paso}: consultas por petición {b['consultas_p50']} -> {e['consultas_p50']}")
+            # Errores por tasa, con 5 puntos de margen (en SQLite los bloqueos bajo concurrencia varían entre corridas)
+            tasa, tasa_base = e['errores'] / e['peticiones'], b['errores'] / b['peticiones'] if b['peticiones'] else 0
+            if tasa > tasa_base + 0.05:
+                regresiones.append(f"{paso}: errores {tasa_base:.0%} -> {tasa:.0%}")
+        if regresiones:
+            raise CommandError("Regresiones: " + "; ".join(regresiones))
+        self.stdout.write(self.style.SUCCESS("OK: sin regresiones respecto de la base."))
+
+    def commit_actual(self):
+        try:
+            salida = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=5)
+        except (OSError, subprocess.SubprocessError):
+            return None
+        return salida.stdout.strip() or None
@@ -0,0 +1,23 @@
+# nembus_app/management/commands/reconstruir_resumenes.py
+
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from nembus_app import resumenes
+
+class Command(BaseCommand):
+    help = 'Reconstruye las tablas de resumen del dashboard (ventas camión por hora y ventas bomba por día).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', help='Fecha local inicial inclusiva (YYYY-MM-DD). Por defecto, todo el histórico.')
+        parser.add_argument('--hasta', help='Fecha local final inclusiva (YYYY-MM-DD).')
+
+    def handle(self, *args, **options):
+        try:
+            desde = date.fromisoformat(options['desde']) if options['desde'] else None
+            hasta = date.fromisoformat(options['hasta']) if options['hasta'] else None
+        except ValueError as e:
+            raise CommandError(f"Fecha inválida: {e}")
+
+        self.stdout.write(f"Reconstruyendo resúmenes (desde={desde or 'inicio'}, hasta={hasta or 'hoy'})...")
+        n_camion, n_bomba = resumenes.reconstruir(desde=desde, hasta=hasta)
+        self.stdout.write(self.style.SUCCESS(f"Resúmenes reconstruidos: {n_camion} filas camión/hora, {n_bomba} filas bomba/día."))
@@ -0,0 +1,217 @@
+# nembus_app/management/commands/sembrar_carga.py
+
+import itertools
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from nembus_app.models import (
+    Cliente, Camion, PuntoDeVenta, Bomba, Turno, PerfilTrabajador, ReporteVenta, Traspaso, ReporteTurno,
+    LecturaBomba, RegistroVentaIndividualBomba, MovimientoCombustible, TrabajoExportacion
+)
+from nembus_app import inventario, resumenes
+
+# Todo lo sembrado lleva este prefijo (usuarios, clientes, patentes, puntos de venta) para poder limpiarlo
+PREFIJO = 'CARGA'
+USUARIO_CHOFER = 'carga-chofer-{}'
+USUARIO_BOMBERO = 'carga-bombero-{}'
+PASSWORD = 'carga'
+# Saldos y capacidades holgados: las pruebas de carga no deben fallar por stock
+CAPACIDAD_CAMION = 10_000_000
+LITROS_CAMION = Decimal('5000000')
+LITROS_BOMBA = Decimal('50000000')
+
+def exigir_bd_de_pruebas(options):
+    """Sembrar y la prueba de carga crean usuarios activos con clave conocida y miles de ventas falsas que entran a los
+    resúmenes, el dashboard y las exportaciones: solo con DEBUG o pidiéndolo explícitamente (--forzar)."""
+    if not settings.DEBUG and not options['forzar']:
+        raise CommandError(
+            f"DEBUG está desactivado: la BD configurada ({connection.vendor} '{connection.settings_dict['NAME']}') puede ser "
+            f"la de producción. Este comando crea usuarios con clave '{PASSWORD}' y datos de prueba; si es una BD de "
+            f"pruebas, repite con --forzar."
+        )
+
+class Command(BaseCommand):
+    help = ('Siembra (y confirma) datos para las pruebas de carga (prueba_carga): clientes, camiones, puntos de venta '
+            'con bombas y turnos, choferes y bomberos con su perfil, y un histórico de ventas de camión y de bomba '
+            '(millones si se pide). Todo lleva el prefijo CARGA; --limpiar lo borra.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clientes', type=int, default=50)
+        parser.add_argument('--camiones', type=int, default=20)
+        parser.add_argument('--pdv', type=int, default=5, help='Puntos de venta.')
+        parser.add_argument('--bombas', type=int, default=4, help='Bombas (y turnos) por punto de venta.')
+        parser.add_argument('--choferes', type=int, default=16, help='Choferes (uno por hilo de prueba_carga).')
+        parser.add_argument('--bomberos', type=int, default=16, help='Bomberos (uno por hilo de prueba_carga).')
+        parser.add_argument('--ventas', type=int, default=100_000, help='Ventas de camión del histórico.')
+        parser.add_argument('--ventas-bomba', type=int, default=100_000, help='Ventas de bomba del histórico.')
+        parser.add_argument('--dias', type=int, default=365, help='Días de histórico sobre los que se reparten las ventas.')
+        parser.add_argument('--semilla', type=int, default=42)
+        parser.add_argument('--limpiar', action='store_true', help='Borra los datos sembrados (y lo que hayan generado las pruebas) y termina.')
+        parser.add_argument('--forzar', action='store_true', help='Permite correr con DEBUG desactivado (solo en una BD de pruebas).')
+
+    def handle(self, *args, **options):
+        exigir_bd_de_pruebas(options)
+        if options['limpiar']:
+            self.limpiar()
+            return
+        if Camion.objects.filter(patente__startswith=PREFIJO).exists():
+            raise CommandError("Ya hay datos de carga sembrados. Bórralos antes con --limpiar.")
+        if options['camiones'] < 2 or options['pdv'] < 1 or options['choferes'] < 1 or options['bomberos'] < 1:
+            raise CommandError("Se necesitan al menos 2 camiones (traspasos), 1 punto de venta, 1 chofer y 1 bombero.")
+
+        inicio = time.monotonic()
+        self.rnd = random.Random(options['semilla'])
+        with transaction.atomic():
+            self.sembrar_maestros(options)
+        self.sembrar_historico(options)
+        self.stdout.write("Reconstruyendo resúmenes del dashboard...")
+        resumenes.reconstruir()
+        self.stdout.write(self.style.SUCCESS(
+            f"Siembra lista en {time.monotonic() - inicio:.1f}s. Usuarios: {USUARIO_CHOFER.format('N')} / "
+            f"{USUARIO_BOMBERO.format('N')} (clave '{PASSWORD}')."
+        ))
+
+    # --- MAESTROS ---
+
+    def sembrar_maestros(self, options):
+        rnd = self.rnd
+        self.clientes = [
+            Cliente.objects.create(nombre=f"{PREFIJO} Cliente {i:04d}", precio_litro_clp=rnd.randint(900, 1300), costo_flete_clp=rnd.choice([0, 5000, 10000]))
+            for i in range(options['clientes'])
+        ]
+        self.camiones = [
+            Camion.objects.create(patente=f"{PREFIJO}{i:04d}", capacidad_total=CAPACIDAD_CAMION, litros_actuales=LITROS_CAMION)
+            for i in range(options['camiones'])
+        ]
+        self.pdvs, self.bombas, self.turnos = [], [], []
+        for i in range(options['pdv']):
+            pdv = PuntoDeVenta.objects.create(nombre=f"{PREFIJO} PDV {i:03d}")
+            self.pdvs.append(pdv)
+            self.bombas += [Bomba.objects.create(punto_de_venta=pdv, nombre=f"Bomba {j}", precio_litro_clp=1000 + 10 * j, litros_actuales=LITROS_BOMBA)
+                            for j in range(options['bombas'])]
+            self.turnos += [Turno.objects.create(punto_de_venta=pdv, nombre=f"Turno {j}") for j in range(options['bombas'])]
+        # Saldo inicial en el libro, para que snapshot_saldos/saldos_descuadrados cuadren con los datos sembrados
+        for estanque in self.camiones + self.bombas:
+            inventario.registrar_ajuste(estanque, estanque.litros_actuales, nota="Saldo inicial carga")
+
+        self.choferes, self.bomberos = [], []
+        for i in range(options['choferes']):
+            usuario = self._usuario(USUARIO_CHOFER.format(i))
+            perfil = PerfilTrabajador.objects.create(usuario=usuario, puede_recargar_combustible=True, puede_hacer_traspasos=True)
+            # Cada chofer opera 2 camiones (compartidos con otros choferes si hay menos camiones que choferes)
+            camiones = [self.camiones[(2 * i) % len(self.camiones)], self.camiones[(2 * i + 1) % len(self.camiones)]]
+            perfil.camiones_asignados.add(*camiones)
+            perfil.camiones_traspaso.add(*camiones)
+            perfil.clientes_asignados.add(*rnd.sample(self.clientes, min(10, len(self.clientes))))
+            self.choferes.append(usuario)
+        for i in range(options['bomberos']):
+            usuario = self._usuario(USUARIO_BOMBERO.format(i))
+            PerfilTrabajador.objects.create(usuario=usuario, punto_de_venta_asignado=self.pdvs[i % len(self.pdvs)])
+            self.bomberos.append(usuario)
+        self.stdout.write(f"Maestros: {len(self.clientes)} clientes, {len(self.camiones)} camiones, {len(self.pdvs)} PDV con "
+                          f"{len(self.bombas)} bombas, {len(self.choferes)} choferes y {len(self.bomberos)} bomberos.")
+
+    def _usuario(self, username):
+        if not hasattr(self, 'hash_password'): # Un solo hash para todos (PBKDF2 tarda ~0.3s por usuario)
+            self.hash_password = make_password(PASSWORD)
+        return User.objects.create(username=username, password=self.hash_password)
+
+    # --- HISTÓRICO ---
+
+    def sembrar_historico(self, options):
+        rnd = self.rnd
+        ahora = timezone.now()
+        segundos = options['dias'] * 86400
+        usuarios = self.choferes
+
+        def fecha_al_azar():
+            return ahora - timedelta(seconds=rnd.randint(3600, segundos))
+
+        self.stdout.write(f"Sembrando {options['ventas']} ventas de camión...")
+        # fecha_hora es auto_now_add: se desactiva mientras se siembra para repartir las ventas en el histórico
+        campo_fecha = ReporteVenta._meta.get_field('fecha_hora')
+        campo_fecha.auto_now_add = False
+        try:
+            self._insertar_en_lotes(ReporteVenta, (
+                ReporteVenta(
+                    trabajador=rnd.choice(usuarios), cliente=cliente, camion=rnd.choice(self.camiones), litros_vendidos=litros,
+                    monto_combustible_clp=litros * cliente.precio_litro_clp, costo_flete_clp=cliente.costo_flete_clp,
+                    monto_total_clp=litros * cliente.precio_litro_clp + cliente.costo_flete_clp, fecha_hora=fecha_al_azar(),
+                ) for litros, cliente in ((Decimal(rnd.randint(10, 5000)), rnd.choice(self.clientes)) for _ in range(options['ventas']))
+            ))
+        finally:
+            campo_fecha.auto_now_add = True
+
+        if not options['ventas_bomba']:
+            return
+        # Turnos cerrados de ~50 ventas, cada uno con una lectura por bomba de su punto de venta
+        n_turnos = max(options['ventas_bomba'] // 50, 1)
+        self.stdout.write(f"Sembrando {n_turnos} turnos cerrados y {options['ventas_bomba']} ventas de bomba...")
+        turnos = [(rnd.choice(self.turnos), fecha_al_azar()) for _ in range(n_turnos)]
+        reportes = ReporteTurno.objects.bulk_create([
+            ReporteTurno(trabajador=rnd.choice(self.bomberos), turno=turno, fecha_inicio=fecha, fecha_fin=fecha + timedelta(hours=8), esta_abierto=False)
+            for turno, fecha in turnos
+        ], batch_size=5000)
+        bombas_por_pdv = {}
+        for bomba in self.bombas:
+            bombas_por_pdv.setdefault(bomba.punto_de_venta_id, []).append(bomba)
+        lecturas = LecturaBomba.objects.bulk_create([
+            LecturaBomba(reporte_turno=reporte, bomba=bomba, contador_inicial=0, contador_final=0)
+            for reporte, (turno, _) in zip(reportes, turnos) for bomba in bombas_por_pdv[turno.punto_de_venta_id]
+        ], batch_size=5000)
+        fechas = {reporte.pk: fecha for reporte, (_, fecha) in zip(reportes, turnos)}
+        precios = {bomba.pk: bomba.precio_litro_clp for bomba in self.bombas}
+        self._insertar_en_lotes(RegistroVentaIndividualBomba, (
+            RegistroVentaIndividualBomba(
+                lectura_bomba=lectura, numero_maquina=str(rnd.randint(1, 500)), socio_propietario=f"{PREFIJO} Socio {rnd.randint(1, 200)}",
+                litros_vendidos=litros, precio_litro_venta=precios[lectura.bomba_id], ingreso_registro=litros * precios[lectura.bomba_id],
+                fecha_registro=fechas[lectura.reporte_turno_id] + timedelta(seconds=rnd.randint(0, 8 * 3600)),
+            ) for lectura, litros in ((rnd.choice(lecturas), Decimal(rnd.randint(5, 200))) for _ in range(options['ventas_bomba']))
+        ))
+        # Totales corrientes de lecturas/turnos: se recalculan con la misma reparación que usa verificar_contadores_turno
+        self.stdout.write("Recalculando totales corrientes de los turnos sembrados...")
+        resumenes.reparar_contadores_turno(LecturaBomba, LecturaBomba.objects.filter(bomba__in=self.bombas).values('pk'))
+        resumenes.reparar_contadores_turno(ReporteTurno, ReporteTurno.objects.filter(turno__in=self.turnos).values('pk'))
+
+    def _insertar_en_lotes(self, modelo, objetos, tamano=5000):
+        # bulk_create convierte todo a lista: se le pasan lotes para no tener millones de instancias en memoria
+        total = 0
+        while lote := list(itertools.islice(objetos, tamano)):
+            modelo.objects.bulk_create(lote)
+            total += len(lote)
+            if total % 100_000 < tamano:
+                self.stdout.write(f"  {total} filas...")
+
+    # --- LIMPIEZA ---
+
+    def limpiar(self):
+        usuarios = User.objects.filter(username__startswith='carga-')
+        camiones = Camion.objects.filter(patente__startswith=PREFIJO)
+        pdvs = PuntoDeVenta.objects.filter(nombre__startswith=PREFIJO)
+        bombas = Bomba.objects.filter(punto_de_venta__in=pdvs)
+        with transaction.atomic():
+            # El libro es append-only a nivel de modelo; para limpiar se borra con el queryset
+            MovimientoCombustible.objects.filter(camion__in=camiones).delete()
+            MovimientoCombustible.objects.filter(bomba__in=bombas).delete()
+            # Millones de ventas: DELETE directo, sin señales por fila (los resúmenes se reconstruyen al final)
+            ReporteVenta.objects.filter(camion__in=camiones)._raw_delete(ReporteVenta.objects.db)
+            RegistroVentaIndividualBomba.objects.filter(lectura_bomba__bomba__in=bombas)._raw_delete(RegistroVentaIndividualBomba.objects.db)
+            Traspaso.objects.filter(trabajador__in=usuarios).delete()
+            ReporteTurno.objects.filter(turno__punto_de_venta__in=pdvs).delete() # Lecturas en cascada
+            TrabajoExportacion.objects.filter(solicitado_por__in=usuarios).delete()
+            borrados = { # delete() cuenta también las cascadas: se informa solo el modelo principal
+                'usuarios': usuarios.delete()[1].get('auth.User', 0),
+                'camiones': camiones.delete()[1].get('nembus_app.Camion', 0),
+                'puntos de venta': pdvs.delete()[1].get('nembus_app.PuntoDeVenta', 0),
+                'clientes': Cliente.objects.filter(nombre__startswith=PREFIJO).delete()[1].get('nembus_app.Cliente', 0),
+            }
+        self.stdout.write("Reconstruyendo resúmenes del dashboard...")
+        resumenes.reconstruir()
+        self.stdout.write(self.style.SUCCESS("Datos de carga borrados: " + ", ".join(f"{n} ({k})" for k, n in borrados.items())))
@@ -0,0 +1,42 @@
+# nembus_app/management/commands/snapshot_saldos.py
+
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from nembus_app.models import Camion, Bomba
+from nembus_app import inventario
+
+class Command(BaseCommand):
+    help = ('Crea un snapshot del saldo de cada camión y bomba a partir del libro de movimientos '
+            '(pensado para cron, ej. cada noche). También inicializa el libro y verifica descuadres.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--inicializar', action='store_true',
+                            help='Registra un AJUSTE de saldo inicial para los estanques que aún no tienen movimientos.')
+        parser.add_argument('--verificar', action='store_true',
+                            help='Compara litros_actuales con la suma del libro y lista los descuadres (no crea snapshots).')
+        parser.add_argument('--margen-minutos', type=int, default=5,
+                            help='El snapshot se toma a now - margen, para no cortar transacciones en curso.')
+
+    def handle(self, *args, **options):
+        if options['inicializar']:
+            with transaction.atomic():
+                creados = 0
+                for estanque in [*Camion.objects.filter(movimientos__isnull=True), *Bomba.objects.filter(movimientos__isnull=True)]:
+                    if estanque.litros_actuales:
+                        inventario.registrar_ajuste(estanque, estanque.litros_actuales, nota="Saldo inicial del libro")
+                        creados += 1
+            self.stdout.write(self.style.SUCCESS(f"{creados} saldo(s) inicial(es) registrados en el libro."))
+
+        if options['verificar']:
+            descuadres = inventario.saldos_descuadrados()
+            for estanque, cache, libro in descuadres:
+                self.stdout.write(self.style.ERROR(f"  {estanque}: litros_actuales {cache} L, libro {libro} L"))
+            if descuadres:
+                self.stdout.write(self.style.ERROR(f"{len(descuadres)} estanque(s) descuadrados."))
+            else:
+                self.stdout.write(self.style.SUCCESS("Libro y saldos cuadrados."))
+            return
+
+        snapshots = inventario.crear_snapshots(margen=timedelta(minutes=options['margen_minutos']))
+        self.stdout.write(self.style.SUCCESS(f"{len(snapshots)} snapshot(s) creados."))
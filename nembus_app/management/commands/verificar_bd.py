@@ -0,0 +1,63 @@
+# nembus_app/management/commands/verificar_bd.py
+
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.utils import Error as ErrorBD
+from nembus_app import telemetria
+
+class Command(BaseCommand):
+    help = ('Chequeo de salud de la BD: driver (psycopg 3 o psycopg2), modo de conexión (persistente o pool), latencia '
+            'de un SELECT 1 y, en PostgreSQL, conexiones usadas frente a max_connections. Sale con error si no conecta '
+            '(sirve como health check del despliegue).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='Alias de la BD a verificar.')
+        parser.add_argument('--repeticiones', type=int, default=5, help='SELECT 1 a medir.')
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        if alias not in connections:
+            raise CommandError(f"No existe la BD '{alias}'.")
+        conexion = connections[alias]
+        ajustes = conexion.settings_dict
+        pool = ajustes.get('OPTIONS', {}).get('pool')
+        self.stdout.write(f"Motor: {conexion.vendor}  Driver: {self.driver(conexion)}")
+        if pool:
+            self.stdout.write(f"Modo: pool {pool if isinstance(pool, dict) else '(valores por defecto)'}")
+        else:
+            self.stdout.write(f"Modo: conexión persistente por hilo (CONN_MAX_AGE={ajustes['CONN_MAX_AGE']})")
+        self.stdout.write(f"Chequeo de salud: {'sí' if ajustes['CONN_HEALTH_CHECKS'] else 'no'}  "
+                          f"Sentencias preparadas (prepare_threshold): {ajustes.get('OPTIONS', {}).get('prepare_threshold', '-')}")
+
+        tiempos = []
+        try:
+            for _ in range(options['repeticiones']):
+                inicio = time.perf_counter()
+                with conexion.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                    cursor.fetchone()
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+            if conexion.vendor == 'postgresql':
+                with conexion.cursor() as cursor:
+                    cursor.execute("SELECT current_setting('max_connections')::int, "
+                                   "(SELECT count(*) FROM pg_stat_activity WHERE datname = current_database())")
+                    maximo, usadas = cursor.fetchone()
+                self.stdout.write(f"Conexiones a esta BD: {usadas} de max_connections={maximo} (todo el servidor)")
+        except ErrorBD as e:
+            raise CommandError(f"No se pudo consultar la BD '{alias}': {e}")
+        finally:
+            conexion.close() # Con pool, la devuelve
+        self.stdout.write(f"SELECT 1: primera {tiempos[0]:.1f} ms (incluye conectar), "
+                          f"siguientes {min(tiempos[1:] or tiempos):.1f}-{max(tiempos[1:] or tiempos):.1f} ms")
+
+        estadisticas = telemetria.estadisticas_pool().get(alias)
+        if estadisticas is not None:
+            self.stdout.write("Pool: " + ", ".join(f"{clave}={valor}" for clave, valor in sorted(estadisticas.items())))
+        self.stdout.write(self.style.SUCCESS("BD OK."))
+
+    def driver(self, conexion):
+        modulo = getattr(conexion, 'Database', None)
+        if conexion.vendor != 'postgresql' or modulo is None:
+            return getattr(modulo, '__name__', '-')
+        return f"{modulo.__name__} {getattr(modulo, '__version__', '')}".strip()
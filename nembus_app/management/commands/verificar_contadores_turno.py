@@ -0,0 +1,32 @@
+# nembus_app/management/commands/verificar_contadores_turno.py
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from nembus_app import resumenes
+
+class Command(BaseCommand):
+    help = ('Compara los totales corrientes (ventas, litros, ingreso) de cada lectura de bomba y turno con la suma '
+            'real de sus ventas y lista los desvíos. Con --reparar los recalcula desde las ventas.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reparar', action='store_true', help='Recalcula los totales de las lecturas/turnos descuadrados.')
+
+    def handle(self, *args, **options):
+        descuadres = resumenes.contadores_turno_descuadrados()
+        for modelo, pk, guardado, real in descuadres:
+            self.stdout.write(self.style.ERROR(
+                f"  {modelo._meta.verbose_name} {pk}: guardado (ventas, litros, ingreso) = {guardado}, real = {real}"
+            ))
+        if not descuadres:
+            self.stdout.write(self.style.SUCCESS("Totales corrientes de turnos cuadrados."))
+            return
+        self.stdout.write(self.style.ERROR(f"{len(descuadres)} total(es) descuadrado(s)."))
+
+        if options['reparar']:
+            with transaction.atomic():
+                reparados = 0
+                for modelo in resumenes.CAMPOS_CONTADOR:
+                    pks = [pk for m, pk, _, _ in descuadres if m is modelo]
+                    if pks:
+                        reparados += resumenes.reparar_contadores_turno(modelo, pks)
+            self.stdout.write(self.style.SUCCESS(f"{reparados} total(es) recalculado(s) desde las ventas."))
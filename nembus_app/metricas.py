@@ -0,0 +1,279 @@
+# nembus_app/metricas.py
+# Paneles del dashboard de gerencia como datos JSON; los sirve la API /api/v1/metrics/<division>/<periodo>/<panel>/
+# (views.api_metricas) y el template los pide en paralelo al cargar la página.
+# Cada panel tiene dos pasos:
+# - agregar(desde, hasta): totales SUMABLES de un rango de fechas, leídos de las tablas de resumen
+#   (números, o dicts de números por patente/hora/día/...).
+# - presentar(agregado): ordena, calcula promedios y top N, y convierte a JSON.
+# Un período se parte en días cerrados + día en curso (periodos.particionar); cada parte se agrega y cachea
+# por separado y las partes se suman con combinar(), así el día en curso no obliga a releer todo el período.
+# adatos_panel() (vistas async) calcula las particiones a la vez, cada una en su propia conexión.
+from collections import namedtuple
+from datetime import date, timedelta
+from decimal import Decimal
+from django.db.models import Sum
+from django.utils import timezone
+from . import asincrono, cache_dashboard
+from .models import Camion, ReporteTurno, ResumenVentaCamionHora, ResumenVentaBombaDia
+from .periodos import a_medianoche, particionar
+
+VERSION_API = 1
+CERO = Decimal('0.00')
+
+
+def combinar(a, b):
+    """Suma dos agregados: los números se suman y los dicts se combinan clave a clave."""
+    total = dict(a)
+    for clave, valor in b.items():
+        if clave not in total:
+            total[clave] = valor
+        elif isinstance(valor, dict):
+            total[clave] = combinar(total[clave], valor)
+        else:
+            total[clave] += valor
+    return total
+
+def _sumar(destino, clave, valores):
+    """Acumula un dict de valores en destino[clave] (para agrupar filas que comparten clave, p. ej. nombre None)."""
+    destino[clave] = combinar(destino.get(clave, {}), valores)
+
+def _promedio(total, cantidad):
+    return float(total / cantidad) if cantidad else 0.0
+
+
+def _camiones(desde, hasta):
+    return ResumenVentaCamionHora.objects.filter(fecha__gte=desde, fecha__lt=hasta)
+
+def _bombas(desde, hasta):
+    return ResumenVentaBombaDia.objects.filter(fecha__gte=desde, fecha__lt=hasta)
+
+def _totales_camiones(desde, hasta):
+    t = _camiones(desde, hasta).aggregate(
+        litros=Sum('litros_vendidos'), ingreso=Sum('monto_total_clp'), combustible=Sum('monto_combustible_clp'),
+        flete=Sum('costo_flete_clp'), viajes=Sum('num_ventas')
+    )
+    return {clave: valor or (0 if clave == 'viajes' else CERO) for clave, valor in t.items()}
+
+def _totales_bombas(desde, hasta):
+    t = _bombas(desde, hasta).aggregate(litros=Sum('litros_vendidos'), ingreso=Sum('ingreso'))
+    return {clave: valor or CERO for clave, valor in t.items()}
+
+def _choferes(desde, hasta):
+    filas = _camiones(desde, hasta).filter(trabajador__isnull=False).values('trabajador__username').annotate(
+        viajes=Sum('num_ventas'), ingreso=Sum('monto_total_clp')
+    )
+    return {f['trabajador__username']: {'viajes': f['viajes'] or 0, 'ingreso': f['ingreso'] or CERO} for f in filas}
+
+
+# --- CAMIONES ---
+
+def camiones_kpis(desde, hasta):
+    return _totales_camiones(desde, hasta)
+
+def presentar_camiones_kpis(t):
+    viajes = t.get('viajes', 0)
+    return {
+        'litros_vendidos': float(t.get('litros', CERO)), 'ingresos_totales': float(t.get('ingreso', CERO)),
+        'ingresos_combustible': float(t.get('combustible', CERO)), 'ingresos_flete': float(t.get('flete', CERO)),
+        'numero_viajes': viajes, 'promedio_litros_viaje': _promedio(t.get('litros', CERO), viajes),
+    }
+
+def camiones_inventario(desde, hasta):
+    # Inventario actual (no depende del período); solo camiones con capacidad definida
+    return {'camiones': [
+        {'patente': c.patente, 'litros_actuales': float(c.litros_actuales or 0), 'capacidad_total': float(c.capacidad_total),
+         'porcentaje': float((c.litros_actuales or 0) / c.capacidad_total * 100)}
+        for c in Camion.objects.filter(capacidad_total__gt=0).order_by('patente')
+    ]}
+
+def presentar_camiones_inventario(agregado):
+    return {'camiones': agregado.get('camiones', [])}
+
+def camiones_ventas_hora(desde, hasta):
+    filas = _camiones(desde, hasta).values('hora').annotate(litros=Sum('litros_vendidos'))
+    return {'horas': {f['hora']: f['litros'] or CERO for f in filas}}
+
+def presentar_camiones_ventas_hora(agregado):
+    horas = sorted(agregado.get('horas', {}).items())
+    return {'labels': [f"{hora:02d}:00" for hora, _ in horas], 'data': [float(litros) for _, litros in horas]}
+
+def camiones_eficiencia_flota(desde, hasta):
+    filas = _camiones(desde, hasta).values('camion__patente').annotate(
+        viajes=Sum('num_ventas'), litros=Sum('litros_vendidos'), ingreso=Sum('monto_total_clp')
+    )
+    return {'camiones': {f['camion__patente']: {'viajes': f['viajes'] or 0, 'litros': f['litros'] or CERO, 'ingreso': f['ingreso'] or CERO}
+                         for f in filas}}
+
+def presentar_camiones_eficiencia_flota(agregado):
+    camiones = sorted(agregado.get('camiones', {}).items(), key=lambda c: c[1]['ingreso'], reverse=True)
+    return {'filas': [
+        {'patente': patente, 'num_viajes': t['viajes'], 'total_ingresos': float(t['ingreso']),
+         'promedio_litros_viaje': _promedio(t['litros'], t['viajes'])}
+        for patente, t in camiones
+    ]}
+
+def camiones_tendencia(desde, hasta):
+    filas = _camiones(desde, hasta).values('fecha').annotate(litros=Sum('litros_vendidos'))
+    return {'dias': {f['fecha'].isoformat(): f['litros'] or CERO for f in filas}}
+
+def presentar_camiones_tendencia(agregado):
+    dias = sorted(agregado.get('dias', {}).items())
+    return {'labels': [date.fromisoformat(dia).strftime('%d/%m') for dia, _ in dias], 'data': [float(litros) for _, litros in dias]}
+
+
+# --- BOMBAS ---
+
+def bombas_kpis(desde, hasta):
+    return {
+        **_totales_bombas(desde, hasta),
+        # Turnos que INICIARON en el rango
+        'turnos': ReporteTurno.objects.filter(fecha_inicio__gte=a_medianoche(desde), fecha_inicio__lt=a_medianoche(hasta)).count(),
+    }
+
+def presentar_bombas_kpis(t):
+    return {'litros_vendidos': float(t.get('litros', CERO)), 'ingresos_totales': float(t.get('ingreso', CERO)),
+            'turnos_reportados': t.get('turnos', 0)}
+
+def bombas_pdv(desde, hasta):
+    # UNA consulta agrupada por (PDV, bomba, turno), pivoteada en Python: {pdv: {'bombas': {..}, 'turnos': {..}}}
+    filas = _bombas(desde, hasta).values('punto_de_venta__nombre', 'bomba__nombre', 'turno__nombre').annotate(
+        litros=Sum('litros_vendidos')
+    )
+    por_pdv = {}
+    for f in filas:
+        litros = f['litros'] or CERO
+        _sumar(por_pdv, f['punto_de_venta__nombre'] or 'N/A', {
+            'bombas': {f['bomba__nombre'] or 'N/A': litros}, 'turnos': {f['turno__nombre'] or 'N/A': litros},
+        })
+    return {'pdv': por_pdv}
+
+def presentar_bombas_pdv(agregado):
+    def _serie(totales):
+        ordenados = sorted(totales.items(), key=lambda t: t[1], reverse=True)
+        return [nombre for nombre, _ in ordenados], [float(litros) for _, litros in ordenados]
+
+    puntos = []
+    for pdv_nombre, t in sorted(agregado.get('pdv', {}).items()):
+        (bombas_labels, bombas_data), (turnos_labels, turnos_data) = _serie(t['bombas']), _serie(t['turnos'])
+        puntos.append({'pdv_nombre': pdv_nombre, 'bombas_labels': bombas_labels, 'bombas_data': bombas_data,
+                       'turnos_labels': turnos_labels, 'turnos_data': turnos_data})
+    return {'puntos_de_venta': puntos}
+
+
+# --- RELACIONES ---
+
+def relaciones_kpis(desde, hasta):
+    return {'camiones': _totales_camiones(desde, hasta), 'bombas': _totales_bombas(desde, hasta), 'choferes': _choferes(desde, hasta)}
+
+def presentar_relaciones_kpis(agregado):
+    camiones, bombas, choferes = agregado.get('camiones', {}), agregado.get('bombas', {}), agregado.get('choferes', {})
+    rentable = max(sorted(choferes.items()), key=lambda c: c[1]['ingreso'], default=None)
+    return {
+        'ingresos_totales': float(camiones.get('ingreso', CERO) + bombas.get('ingreso', CERO)),
+        'litros_vendidos_totales': float(camiones.get('litros', CERO) + bombas.get('litros', CERO)),
+        'chofer_rentable': {'nombre': rentable[0], 'total_ingresos': float(rentable[1]['ingreso'])} if rentable else None,
+    }
+
+def relaciones_ingresos_desglose(desde, hasta):
+    camiones = _totales_camiones(desde, hasta)
+    return {'combustible': camiones['combustible'], 'flete': camiones['flete'], 'bombas': _totales_bombas(desde, hasta)['ingreso']}
+
+def presentar_relaciones_ingresos_desglose(t):
+    return {'labels': ['Ing. Comb. Camión', 'Ing. Flete Camión', 'Ing. Bombas'],
+            'data': [float(t.get('combustible', CERO)), float(t.get('flete', CERO)), float(t.get('bombas', CERO))]}
+
+def relaciones_viajes_chofer(desde, hasta):
+    return {'choferes': _choferes(desde, hasta)}
+
+def presentar_relaciones_viajes_chofer(agregado):
+    choferes = sorted(agregado.get('choferes', {}).items(), key=lambda c: (-c[1]['viajes'], c[0]))
+    return {'labels': [nombre for nombre, _ in choferes], 'data': [t['viajes'] for _, t in choferes]}
+
+def relaciones_clientes(desde, hasta):
+    filas = _camiones(desde, hasta).values('cliente__nombre').annotate(litros=Sum('litros_vendidos'), monto=Sum('monto_total_clp'))
+    clientes = {}
+    for f in filas:
+        _sumar(clientes, f['cliente__nombre'] or 'N/A', {'litros': f['litros'] or CERO, 'monto': f['monto'] or CERO})
+    return {'clientes': clientes}
+
+def presentar_relaciones_clientes(agregado):
+    top = sorted(agregado.get('clientes', {}).items(), key=lambda c: c[1]['monto'], reverse=True)[:5] # Top 5
+    return {'labels': [nombre for nombre, _ in top],
+            'litros': [float(t['litros']) for _, t in top], 'monto': [float(t['monto']) for _, t in top]}
+
+
+# --- REGISTRO DE PANELES ---
+# visible(periodo): si el template lo muestra; comparable: la API también lo calcula para el período de
+# comparación (?comparar=); actual: muestra el estado actual, no depende del período ni se compara.
+Panel = namedtuple('Panel', 'agregar presentar visible comparable actual', defaults=(False, False))
+
+def _siempre(periodo): return True
+def _un_dia(periodo): return periodo.dias == 1
+def _varios_dias(periodo): return periodo.dias > 1
+def _largo(periodo): return periodo.dias > 7
+
+# {division: {panel: Panel}}; el orden es el de la página
+PANELES = {
+    'camiones': {
+        'kpis': Panel(camiones_kpis, presentar_camiones_kpis, _siempre, comparable=True),
+        'inventario': Panel(camiones_inventario, presentar_camiones_inventario, lambda p: p.clave == 'dia', actual=True),
+        'ventas_hora': Panel(camiones_ventas_hora, presentar_camiones_ventas_hora, _un_dia),
+        'eficiencia_flota': Panel(camiones_eficiencia_flota, presentar_camiones_eficiencia_flota, _varios_dias),
+        'tendencia': Panel(camiones_tendencia, presentar_camiones_tendencia, _largo),
+    },
+    'bombas': {
+        'kpis': Panel(bombas_kpis, presentar_bombas_kpis, _siempre, comparable=True),
+        'pdv': Panel(bombas_pdv, presentar_bombas_pdv, _siempre),
+    },
+    'relaciones': {
+        'kpis': Panel(relaciones_kpis, presentar_relaciones_kpis, _siempre, comparable=True),
+        'ingresos_desglose': Panel(relaciones_ingresos_desglose, presentar_relaciones_ingresos_desglose, _siempre),
+        'viajes_chofer': Panel(relaciones_viajes_chofer, presentar_relaciones_viajes_chofer, _siempre),
+        'clientes': Panel(relaciones_clientes, presentar_relaciones_clientes, _siempre),
+    },
+}
+
+def existe_panel(division, panel):
+    return panel in PANELES.get(division, {})
+
+def es_comparable(division, panel):
+    return PANELES[division][panel].comparable
+
+def paneles_visibles(division, periodo):
+    return [nombre for nombre, panel in PANELES.get(division, {}).items() if panel.visible(periodo)]
+
+def particiones(division, panel, periodo, hoy=None):
+    """Rangos (desde, hasta) en que se agrega el panel para el período (ver periodos.particionar)."""
+    hoy = hoy or timezone.localdate()
+    if PANELES[division][panel].actual:
+        return [(hoy, hoy + timedelta(days=1))]
+    return particionar(periodo, hoy)
+
+def datos_panel(division, panel, periodo, hoy=None):
+    """Devuelve (datos, acierto): el panel del período, sumando las particiones (cada una desde la caché si
+    está). acierto es True solo si todas las particiones salieron de la caché."""
+    definicion = PANELES[division][panel]
+    agregado, aciertos = {}, True
+    for desde, hasta in particiones(division, panel, periodo, hoy):
+        parte, acierto = cache_dashboard.obtener(f'{division}:{panel}', desde, hasta, lambda: definicion.agregar(desde, hasta))
+        agregado = combinar(agregado, parte)
+        aciertos = aciertos and acierto
+    return definicion.presentar(agregado), aciertos
+
+async def adatos_panel(division, panel, periodos, hoy=None):
+    """Como datos_panel para varios períodos (ej. actual y comparado) a la vez: las particiones de todos
+    se calculan en paralelo (asincrono.en_paralelo). Devuelve [(datos, acierto), ...] en el orden de periodos."""
+    definicion = PANELES[division][panel]
+    def _parte(desde, hasta):
+        return lambda: cache_dashboard.obtener(f'{division}:{panel}', desde, hasta, lambda: definicion.agregar(desde, hasta))
+    rangos = [particiones(division, panel, periodo, hoy) for periodo in periodos]
+    partes = iter(await asincrono.en_paralelo(*(_parte(desde, hasta) for rango in rangos for desde, hasta in rango)))
+    resultados = []
+    for rango in rangos:
+        agregado, aciertos = {}, True
+        for _ in rango:
+            parte, acierto = next(partes)
+            agregado = combinar(agregado, parte)
+            aciertos = aciertos and acierto
+        resultados.append((definicion.presentar(agregado), aciertos))
+    return resultados
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nembus_app', '0010_remove_lecturabomba_litros_vendidos_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='camion',
+            options={'verbose_name': 'Camión', 'verbose_name_plural': 'Camiones'},
+        ),
+        migrations.CreateModel(
+            name='ResumenVentaBombaDia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('num_ventas', models.IntegerField(default=0)),
+                ('litros_vendidos', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('ingreso', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('bomba', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='nembus_app.bomba')),
+                ('punto_de_venta', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='nembus_app.puntodeventa')),
+                ('turno', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='nembus_app.turno')),
+            ],
+            options={
+                'verbose_name': 'Resumen Venta Bomba (Día)',
+                'verbose_name_plural': 'Resúmenes Venta Bomba (Día)',
+                'unique_together': {('fecha', 'bomba', 'turno')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ResumenVentaCamionHora',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('hora', models.PositiveSmallIntegerField()),
+                ('num_ventas', models.IntegerField(default=0)),
+                ('litros_vendidos', models.DecimalField(decimal_places=4, default=0, max_digits=16)),
+                ('monto_combustible_clp', models.DecimalField(decimal_places=4, default=0, max_digits=18)),
+                ('costo_flete_clp', models.DecimalField(decimal_places=4, default=0, max_digits=18)),
+                ('monto_total_clp', models.DecimalField(decimal_places=4, default=0, max_digits=18)),
+                ('camion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='nembus_app.camion')),
+                ('cliente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='nembus_app.cliente')),
+                ('trabajador', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Resumen Venta Camión (Hora)',
+                'verbose_name_plural': 'Resúmenes Venta Camión (Hora)',
+                'unique_together': {('fecha', 'hora', 'camion', 'cliente', 'trabajador')},
+            },
+        ),
+    ]
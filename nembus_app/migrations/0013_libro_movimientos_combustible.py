@@ -0,0 +1,54 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:57
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nembus_app', '0012_trabajoexportacion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovimientoCombustible',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha_hora', models.DateTimeField(default=django.utils.timezone.now)),
+                ('tipo', models.CharField(choices=[('venta', 'Venta Camión'), ('recarga', 'Recarga Camión'), ('traspaso_salida', 'Traspaso (salida)'), ('traspaso_entrada', 'Traspaso (entrada)'), ('cierre_turno', 'Cierre de Turno (bomba)'), ('ajuste', 'Ajuste')], max_length=20)),
+                ('litros', models.DecimalField(decimal_places=4, max_digits=12)),
+                ('nota', models.CharField(blank=True, max_length=255)),
+                ('bomba', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='movimientos', to='nembus_app.bomba')),
+                ('camion', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='movimientos', to='nembus_app.camion')),
+                ('lectura_bomba', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movimientos', to='nembus_app.lecturabomba')),
+                ('reporte_venta', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movimientos', to='nembus_app.reporteventa')),
+                ('trabajador', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('traspaso', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movimientos', to='nembus_app.traspaso')),
+            ],
+            options={
+                'verbose_name': 'Movimiento de Combustible',
+                'verbose_name_plural': 'Movimientos de Combustible',
+                'indexes': [models.Index(fields=['camion', 'fecha_hora'], name='mov_camion_fecha_idx'), models.Index(fields=['bomba', 'fecha_hora'], name='mov_bomba_fecha_idx')],
+                'constraints': [models.CheckConstraint(condition=models.Q(models.Q(('bomba__isnull', True), ('camion__isnull', False)), models.Q(('bomba__isnull', False), ('camion__isnull', True)), _connector='OR'), name='movimiento_un_solo_estanque')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SnapshotSaldo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha_hora', models.DateTimeField()),
+                ('litros', models.DecimalField(decimal_places=4, max_digits=14)),
+                ('bomba', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='snapshots_saldo', to='nembus_app.bomba')),
+                ('camion', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='snapshots_saldo', to='nembus_app.camion')),
+            ],
+            options={
+                'verbose_name': 'Snapshot de Saldo',
+                'verbose_name_plural': 'Snapshots de Saldo',
+                'indexes': [models.Index(fields=['camion', 'fecha_hora'], name='snap_camion_fecha_idx'), models.Index(fields=['bomba', 'fecha_hora'], name='snap_bomba_fecha_idx')],
+            },
+        ),
+    ]
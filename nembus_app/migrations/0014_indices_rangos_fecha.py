@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nembus_app', '0013_libro_movimientos_combustible'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='registroventaindividualbomba',
+            index=models.Index(fields=['fecha_registro', 'lectura_bomba'], name='rvb_fecha_lectura_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reporteturno',
+            index=models.Index(fields=['fecha_inicio'], name='rt_fecha_inicio_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reporteturno',
+            index=models.Index(condition=models.Q(('esta_abierto', True)), fields=['trabajador'], name='rt_abierto_trabajador_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reporteventa',
+            index=models.Index(fields=['fecha_hora', 'camion'], name='rv_fecha_camion_idx'),
+        ),
+    ]
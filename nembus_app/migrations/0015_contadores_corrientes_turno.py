@@ -0,0 +1,64 @@
+# Generated by Django 5.2.7 on 2026-10-17 20:11
+
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def calcular_contadores(apps, schema_editor):
+    # Totales iniciales desde las ventas existentes (después se mantienen en cada escritura)
+    LecturaBomba = apps.get_model('nembus_app', 'LecturaBomba')
+    ReporteTurno = apps.get_model('nembus_app', 'ReporteTurno')
+    Venta = apps.get_model('nembus_app', 'RegistroVentaIndividualBomba')
+
+    def total(filtro, expr, campo):
+        qs = Venta.objects.filter(**{filtro: OuterRef('pk')}).order_by().values(filtro).annotate(t=expr).values('t')
+        return Coalesce(Subquery(qs, output_field=campo), Value(0), output_field=campo)
+
+    decimal, entero = DecimalField(max_digits=16, decimal_places=4), IntegerField()
+    LecturaBomba.objects.update(
+        num_ventas_turno=total('lectura_bomba', Count('id'), entero),
+        litros_vendidos_turno=total('lectura_bomba', Sum('litros_vendidos'), decimal),
+        ingreso_turno=total('lectura_bomba', Sum('ingreso_registro'), decimal),
+    )
+    ReporteTurno.objects.update(
+        num_ventas=total('lectura_bomba__reporte_turno', Count('id'), entero),
+        total_litros=total('lectura_bomba__reporte_turno', Sum('litros_vendidos'), decimal),
+        total_ingreso=total('lectura_bomba__reporte_turno', Sum('ingreso_registro'), decimal),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nembus_app', '0014_indices_rangos_fecha'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lecturabomba',
+            name='ingreso_turno',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='lecturabomba',
+            name='num_ventas_turno',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='reporteturno',
+            name='num_ventas',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='reporteturno',
+            name='total_ingreso',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=16),
+        ),
+        migrations.AddField(
+            model_name='reporteturno',
+            name='total_litros',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=14),
+        ),
+        migrations.RunPython(calcular_contadores, migrations.RunPython.noop),
+    ]
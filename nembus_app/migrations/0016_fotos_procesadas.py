@@ -0,0 +1,36 @@
+# Generated by Django 5.2.7 on 2026-10-17 20:28
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def encolar_fotos_existentes(apps, schema_editor):
+    # Las fotos subidas antes del pipeline quedan en la cola del worker (procesar_fotos) para tener miniatura
+    ReporteVenta = apps.get_model('nembus_app', 'ReporteVenta')
+    ReporteVenta.objects.exclude(foto_evidencia='').exclude(foto_evidencia__isnull=True).update(foto_estado='pendiente')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nembus_app', '0015_contadores_corrientes_turno'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reporteventa',
+            name='foto_estado',
+            field=models.CharField(blank=True, choices=[('pendiente', 'Pendiente'), ('procesada', 'Procesada'), ('error', 'Error')], default='', editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='reporteventa',
+            name='foto_miniatura',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='evidencias/miniaturas/'),
+        ),
+        migrations.AddIndex(
+            model_name='reporteventa',
+            index=models.Index(condition=models.Q(('foto_estado', 'pendiente')), fields=['id'], name='rv_foto_pendiente_idx'),
+        ),
+        migrations.RunPython(encolar_fotos_existentes, migrations.RunPython.noop),
+    ]
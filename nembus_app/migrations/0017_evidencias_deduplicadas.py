@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-17 20:31
+
+import nembus_app.almacenamiento
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nembus_app', '0016_fotos_procesadas'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='reporteventa',
+            name='foto_evidencia',
+            field=models.ImageField(blank=True, null=True, storage=nembus_app.almacenamiento.evidencias, upload_to='evidencias/'),
+        ),
+        migrations.AlterField(
+            model_name='reporteventa',
+            name='foto_miniatura',
+            field=models.ImageField(blank=True, editable=False, null=True, storage=nembus_app.almacenamiento.evidencias, upload_to='evidencias/miniaturas/'),
+        ),
+    ]
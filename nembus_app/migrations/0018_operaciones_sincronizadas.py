@@ -0,0 +1,36 @@
+# Generated by Django 5.2.7 on 2026-10-17 20:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nembus_app', '0017_evidencias_deduplicadas'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OperacionSincronizada',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(max_length=64)),
+                ('tipo', models.CharField(choices=[('venta', 'Venta Camión'), ('recarga', 'Recarga Camión'), ('traspaso', 'Traspaso')], max_length=20)),
+                ('resultado', models.JSONField(default=dict)),
+                ('fecha_cliente', models.DateTimeField(blank=True, null=True)),
+                ('fecha_aplicada', models.DateTimeField(auto_now_add=True)),
+                ('movimiento', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='nembus_app.movimientocombustible')),
+                ('reporte_venta', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='nembus_app.reporteventa')),
+                ('traspaso', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='nembus_app.traspaso')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='operaciones_sincronizadas', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Operación Sincronizada',
+                'verbose_name_plural': 'Operaciones Sincronizadas',
+                'constraints': [models.UniqueConstraint(fields=('usuario', 'clave'), name='opsinc_usuario_clave_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-17 21:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nembus_app', '0019_exportaciones_latido'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivoEvidencia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=255, unique=True)),
+            ],
+            options={
+                'verbose_name': 'Archivo de Evidencia',
+                'verbose_name_plural': 'Archivos de Evidencia',
+            },
+        ),
+    ]
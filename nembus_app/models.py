@@ -2,7 +2,10 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 from decimal import Decimal # Importar Decimal
-from django.db.models import Sum # Importar Sum
+import logging
+from .almacenamiento import evidencias
+
+logger = logging.getLogger(__name__)
 
 # --- MODELOS DE ENTIDADES PRINCIPALES ---
 
@@ -61,10 +64,39 @@ class ReporteVenta(models.Model):
     monto_combustible_clp = models.DecimalField(max_digits=12, decimal_places=4, default=0)
     costo_flete_clp = models.DecimalField(max_digits=12, decimal_places=4, default=0)
     monto_total_clp = models.DecimalField(max_digits=12, decimal_places=4, default=0)
-    foto_evidencia = models.ImageField(upload_to='evidencias/', blank=True, null=True)
+    # Estado del procesamiento de la foto (ver fotos.py): la vista la guarda tal cual y el worker la normaliza
+    FOTO_PENDIENTE = 'pendiente'
+    FOTO_PROCESADA = 'procesada'
+    FOTO_ERROR = 'error'
+    ESTADOS_FOTO = [(FOTO_PENDIENTE, 'Pendiente'), (FOTO_PROCESADA, 'Procesada'), (FOTO_ERROR, 'Error')]
+
+    # Almacenamiento direccionado por contenido (almacenamiento.py): fotos idénticas comparten archivo
+    foto_evidencia = models.ImageField(upload_to='evidencias/', storage=evidencias, blank=True, null=True)
+    foto_miniatura = models.ImageField(upload_to='evidencias/miniaturas/', storage=evidencias, blank=True, null=True, editable=False)
+    foto_estado = models.CharField(max_length=10, choices=ESTADOS_FOTO, blank=True, default='', editable=False)
     fecha_hora = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Rangos de fecha del CSV de ventas y de reconstruir_resumenes
+            models.Index(fields=['fecha_hora', 'camion'], name='rv_fecha_camion_idx'),
+            # Cola del worker de fotos (solo las pendientes, el índice queda chico)
+            models.Index(fields=['id'], name='rv_foto_pendiente_idx', condition=models.Q(foto_estado='pendiente')),
+        ]
+
     def __str__(self): return f"Venta Camión: {self.litros_vendidos}L a {self.cliente.nombre}"
 
+# Un archivo de evidencia (por nombre, ver almacenamiento.py). Su fila es el bloqueo que comparten el guardado
+# deduplicado y el borrado de archivos sin uso: quien borra espera a que confirme quien acaba de reutilizarlo
+class ArchivoEvidencia(models.Model):
+    nombre = models.CharField(max_length=255, unique=True)
+
+    class Meta:
+        verbose_name = "Archivo de Evidencia"
+        verbose_name_plural = "Archivos de Evidencia"
+
+    def __str__(self): return self.nombre
+
 # Modelo para TRASPASOS entre CAMIONES (realizados por choferes)
 class Traspaso(models.Model):
     trabajador = models.ForeignKey(User, on_delete=models.PROTECT)
@@ -83,6 +115,17 @@ class ReporteTurno(models.Model):
     fecha_inicio = models.DateTimeField(default=timezone.now) # Fecha/Hora de inicio del turno
     fecha_fin = models.DateTimeField(null=True, blank=True) # Se establece al finalizar
     esta_abierto = models.BooleanField(default=True) # Indica si el turno está activo
+    # Totales corrientes de todas sus ventas de bomba (se mantienen al crear/editar/borrar cada venta)
+    num_ventas = models.PositiveIntegerField(default=0, editable=False)
+    total_litros = models.DecimalField(max_digits=14, decimal_places=2, default=0, editable=False)
+    total_ingreso = models.DecimalField(max_digits=16, decimal_places=2, default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['fecha_inicio'], name='rt_fecha_inicio_idx'), # Turnos reportados en el dashboard
+            # Índice parcial: solo los turnos abiertos (pocos), consultados en cada carga del panel del bombero
+            models.Index(fields=['trabajador'], condition=models.Q(esta_abierto=True), name='rt_abierto_trabajador_idx'),
+        ]
 
     def __str__(self):
         estado = "Abierto" if self.esta_abierto else "Cerrado"
@@ -95,26 +138,26 @@ class LecturaBomba(models.Model):
     bomba = models.ForeignKey(Bomba, on_delete=models.PROTECT)
     contador_inicial = models.DecimalField(max_digits=12, decimal_places=4) # Se ingresa al iniciar turno
     contador_final = models.DecimalField(max_digits=12, decimal_places=4, null=True, blank=True) # Se calcula/ingresa al finalizar
-    litros_vendidos_turno = models.DecimalField(max_digits=12, decimal_places=4, default=0, editable=False) # Total calculado
+    # Totales corrientes de sus ventas individuales (se mantienen al crear/editar/borrar cada venta, ver resumenes.py)
+    litros_vendidos_turno = models.DecimalField(max_digits=12, decimal_places=4, default=0, editable=False)
+    num_ventas_turno = models.PositiveIntegerField(default=0, editable=False)
+    ingreso_turno = models.DecimalField(max_digits=14, decimal_places=2, default=0, editable=False)
 
-    # Calcula el contador final y litros totales basado en ventas individuales
+    # Calcula el contador final a partir del total corriente de litros (sin volver a sumar las ventas)
     def calcular_y_guardar_final(self):
-        # Asegurarse que related_name='ventas_individuales' existe en RegistroVentaIndividualBomba.lectura_bomba
-        total_litros_ventas = self.ventas_individuales.aggregate(Sum('litros_vendidos'))['litros_vendidos__sum'] or Decimal('0.00')
-        self.contador_final = self.contador_inicial + total_litros_ventas
-        self.litros_vendidos_turno = total_litros_ventas
-        self.save(update_fields=['contador_final', 'litros_vendidos_turno'])
+        self.refresh_from_db(fields=['litros_vendidos_turno']) # El total pudo cambiar por UPDATE con F() desde que se cargó
+        self.contador_final = self.contador_inicial + self.litros_vendidos_turno
+        self.save(update_fields=['contador_final'])
 
         # Actualizar inventario de la bomba al finalizar el turno
         try:
-            bomba_obj = self.bomba
-            # Usar Decimal para la resta
-            bomba_obj.litros_actuales -= Decimal(self.litros_vendidos_turno)
+            # UPDATE atómico con F() + movimiento en el libro (ver inventario.descontar_bomba)
             # Podrías añadir validación aquí si prefieres (ej. no permitir negativos)
-            bomba_obj.save(update_fields=['litros_actuales'])
-        except Exception as e:
+            from .inventario import descontar_bomba # Import local: inventario importa este módulo
+            descontar_bomba(self, Decimal(self.litros_vendidos_turno), trabajador=self.reporte_turno.trabajador)
+        except Exception:
             # Manejar error si no se pudo actualizar el inventario (loggear, etc.)
-            print(f"Error actualizando inventario bomba {self.bomba.id}: {e}")
+            logger.exception("inventario_bomba_error bomba=%s lectura=%s", self.bomba_id, self.pk)
             # Considera si deberías detener el proceso o solo advertir
 
     def __str__(self):
@@ -133,7 +176,14 @@ class RegistroVentaIndividualBomba(models.Model):
     ingreso_registro = models.DecimalField(max_digits=12, decimal_places=2, editable=False, default=0) # Ingreso de esta venta
     fecha_registro = models.DateTimeField(default=timezone.now) # Momento exacto del registro
 
-    def save(self, *args, **kwargs):
+    class Meta:
+        indexes = [
+            # Rangos de fecha del Excel de bombas y de reconstruir_resumenes
+            models.Index(fields=['fecha_registro', 'lectura_bomba'], name='rvb_fecha_lectura_idx'),
+        ]
+
+    # Precio e ingreso calculados (también lo usa el guardado en lote de turnos.py, que no pasa por save())
+    def calcular_ingreso(self):
         # Tomar precio de la bomba si no se ha asignado antes
         if self.precio_litro_venta is None and self.lectura_bomba and self.lectura_bomba.bomba:
             self.precio_litro_venta = self.lectura_bomba.bomba.precio_litro_clp
@@ -147,8 +197,208 @@ class RegistroVentaIndividualBomba(models.Model):
         else:
             self.ingreso_registro = Decimal('0.00')
 
+    def save(self, *args, **kwargs):
+        self.calcular_ingreso()
         super().save(*args, **kwargs) # Guardar el registro
 
     def __str__(self):
         fecha_str = self.fecha_registro.strftime('%d/%m %H:%M') if self.fecha_registro else 'N/A'
-        return f"{self.litros_vendidos}L a Máq:{self.numero_maquina} ({fecha_str})"
\ No newline at end of file
+        return f"{self.litros_vendidos}L a Máq:{self.numero_maquina} ({fecha_str})"
+
+# --- MODELOS DE RESUMEN (ROLLUPS) PARA EL DASHBOARD DE GERENCIA ---
+# Se mantienen de forma incremental al escribir ventas (ver resumenes.py / signals.py)
+# y se pueden reconstruir con: python manage.py reconstruir_resumenes
+
+# Totales de ventas de CAMIONES por día/hora local x camión x cliente x trabajador
+class ResumenVentaCamionHora(models.Model):
+    fecha = models.DateField() # Fecha local (America/Santiago)
+    hora = models.PositiveSmallIntegerField() # Hora local 0-23
+    camion = models.ForeignKey(Camion, on_delete=models.CASCADE, related_name='+')
+    cliente = models.ForeignKey(Cliente, on_delete=models.CASCADE, related_name='+')
+    trabajador = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    num_ventas = models.IntegerField(default=0)
+    litros_vendidos = models.DecimalField(max_digits=16, decimal_places=4, default=0)
+    monto_combustible_clp = models.DecimalField(max_digits=18, decimal_places=4, default=0)
+    costo_flete_clp = models.DecimalField(max_digits=18, decimal_places=4, default=0)
+    monto_total_clp = models.DecimalField(max_digits=18, decimal_places=4, default=0)
+
+    class Meta:
+        unique_together = ('fecha', 'hora', 'camion', 'cliente', 'trabajador')
+        verbose_name = "Resumen Venta Camión (Hora)"
+        verbose_name_plural = "Resúmenes Venta Camión (Hora)"
+
+    def __str__(self): return f"{self.fecha} {self.hora:02d}h - Camión {self.camion_id}: {self.litros_vendidos}L"
+
+# Totales de ventas de BOMBAS por día local x bomba x turno (punto de venta desnormalizado)
+class ResumenVentaBombaDia(models.Model):
+    fecha = models.DateField() # Fecha local de fecha_registro
+    bomba = models.ForeignKey(Bomba, on_delete=models.CASCADE, related_name='+')
+    turno = models.ForeignKey(Turno, on_delete=models.CASCADE, related_name='+')
+    punto_de_venta = models.ForeignKey(PuntoDeVenta, on_delete=models.CASCADE, related_name='+')
+    num_ventas = models.IntegerField(default=0)
+    litros_vendidos = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    ingreso = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('fecha', 'bomba', 'turno')
+        verbose_name = "Resumen Venta Bomba (Día)"
+        verbose_name_plural = "Resúmenes Venta Bomba (Día)"
+
+    def __str__(self): return f"{self.fecha} - Bomba {self.bomba_id} / Turno {self.turno_id}: {self.litros_vendidos}L"
+
+
+# --- COLA DE EXPORTACIONES EN SEGUNDO PLANO ---
+# Las exportaciones grandes se encolan aquí y las procesa: python manage.py procesar_exportaciones
+
+class TrabajoExportacion(models.Model):
+    TIPO_CSV_CAMIONES = 'csv_camiones'
+    TIPO_XLSX_BOMBAS = 'xlsx_bombas'
+    TIPOS = [
+        (TIPO_CSV_CAMIONES, 'Ventas Camión (CSV)'),
+        (TIPO_XLSX_BOMBAS, 'Ventas Bomba (Excel)'),
+    ]
+    PENDIENTE = 'pendiente'
+    EN_PROCESO = 'en_proceso'
+    COMPLETADO = 'completado'
+    ERROR = 'error'
+    ESTADOS = [
+        (PENDIENTE, 'Pendiente'),
+        (EN_PROCESO, 'En proceso'),
+        (COMPLETADO, 'Completado'),
+        (ERROR, 'Error'),
+    ]
+
+    tipo = models.CharField(max_length=20, choices=TIPOS)
+    parametros = models.JSONField(default=dict) # Filtros ya resueltos (fechas ISO, punto de venta, textos)
+    nombre_archivo = models.CharField(max_length=255)
+    estado = models.CharField(max_length=20, choices=ESTADOS, default=PENDIENTE)
+    solicitado_por = models.ForeignKey(User, on_delete=models.CASCADE, related_name='exportaciones')
+    filas_estimadas = models.PositiveIntegerField(default=0)
+    filas_exportadas = models.PositiveIntegerField(null=True, blank=True)
+    archivo = models.FileField(upload_to='exportaciones/', blank=True, null=True)
+    mensaje_error = models.TextField(blank=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_inicio = models.DateTimeField(null=True, blank=True)
+    fecha_latido = models.DateTimeField(null=True, blank=True) # Última señal de vida del worker que lo procesa
+    fecha_fin = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Trabajo de Exportación"
+        verbose_name_plural = "Trabajos de Exportación"
+        ordering = ('-fecha_creacion',)
+
+    def __str__(self): return f"{self.get_tipo_display()} #{self.pk} ({self.get_estado_display()})"
+
+
+# --- LIBRO DE MOVIMIENTOS DE COMBUSTIBLE (APPEND-ONLY) ---
+# Cada venta, recarga, traspaso y cierre de turno queda como un movimiento con signo sobre un
+# estanque (camión o bomba). Camion.litros_actuales y Bomba.litros_actuales son la materialización
+# (caché) de la suma de movimientos, y se actualizan en la misma transacción (ver inventario.py).
+
+class MovimientoCombustible(models.Model):
+    VENTA = 'venta'
+    RECARGA = 'recarga'
+    TRASPASO_SALIDA = 'traspaso_salida'
+    TRASPASO_ENTRADA = 'traspaso_entrada'
+    CIERRE_TURNO = 'cierre_turno'
+    AJUSTE = 'ajuste' # Saldo inicial del libro o corrección manual desde el admin
+    TIPOS = [
+        (VENTA, 'Venta Camión'),
+        (RECARGA, 'Recarga Camión'),
+        (TRASPASO_SALIDA, 'Traspaso (salida)'),
+        (TRASPASO_ENTRADA, 'Traspaso (entrada)'),
+        (CIERRE_TURNO, 'Cierre de Turno (bomba)'),
+        (AJUSTE, 'Ajuste'),
+    ]
+
+    fecha_hora = models.DateTimeField(default=timezone.now)
+    tipo = models.CharField(max_length=20, choices=TIPOS)
+    # Exactamente uno de los dos estanques
+    camion = models.ForeignKey(Camion, on_delete=models.PROTECT, null=True, blank=True, related_name='movimientos')
+    bomba = models.ForeignKey(Bomba, on_delete=models.PROTECT, null=True, blank=True, related_name='movimientos')
+    litros = models.DecimalField(max_digits=12, decimal_places=4) # Positivo = entra, negativo = sale
+    trabajador = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    # Operación que originó el movimiento (si corresponde)
+    reporte_venta = models.ForeignKey(ReporteVenta, on_delete=models.SET_NULL, null=True, blank=True, related_name='movimientos')
+    traspaso = models.ForeignKey(Traspaso, on_delete=models.SET_NULL, null=True, blank=True, related_name='movimientos')
+    lectura_bomba = models.ForeignKey(LecturaBomba, on_delete=models.SET_NULL, null=True, blank=True, related_name='movimientos')
+    nota = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        verbose_name = "Movimiento de Combustible"
+        verbose_name_plural = "Movimientos de Combustible"
+        indexes = [
+            models.Index(fields=['camion', 'fecha_hora'], name='mov_camion_fecha_idx'),
+            models.Index(fields=['bomba', 'fecha_hora'], name='mov_bomba_fecha_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                condition=(models.Q(camion__isnull=False, bomba__isnull=True) | models.Q(camion__isnull=True, bomba__isnull=False)),
+                name='movimiento_un_solo_estanque',
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Los movimientos de combustible no se modifican: registra un ajuste.")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Los movimientos de combustible no se borran: registra un ajuste.")
+
+    def __str__(self):
+        estanque = self.camion or self.bomba
+        return f"{self.get_tipo_display()} {self.litros:+}L - {estanque}"
+
+# Saldo de un estanque en un instante (checkpoint). El saldo "al momento T" se calcula como
+# el último snapshot <= T más los movimientos entre ese snapshot y T (ver inventario.saldo_en).
+class SnapshotSaldo(models.Model):
+    fecha_hora = models.DateTimeField()
+    camion = models.ForeignKey(Camion, on_delete=models.CASCADE, null=True, blank=True, related_name='snapshots_saldo')
+    bomba = models.ForeignKey(Bomba, on_delete=models.CASCADE, null=True, blank=True, related_name='snapshots_saldo')
+    litros = models.DecimalField(max_digits=14, decimal_places=4)
+
+    class Meta:
+        verbose_name = "Snapshot de Saldo"
+        verbose_name_plural = "Snapshots de Saldo"
+        indexes = [
+            models.Index(fields=['camion', 'fecha_hora'], name='snap_camion_fecha_idx'),
+            models.Index(fields=['bomba', 'fecha_hora'], name='snap_bomba_fecha_idx'),
+        ]
+
+    def __str__(self): return f"Saldo {self.camion or self.bomba} al {self.fecha_hora:%d/%m/%Y %H:%M}: {self.litros}L"
+
+
+# --- SINCRONIZACIÓN DE CHOFERES SIN CONEXIÓN ---
+# Cada operación aplicada por api_sincronizar (ver sincronizacion.py) queda aquí con la clave que generó el
+# dispositivo: el índice único (usuario, clave) hace que un reenvío del lote no la aplique dos veces.
+
+class OperacionSincronizada(models.Model):
+    VENTA = 'venta'
+    RECARGA = 'recarga'
+    TRASPASO = 'traspaso'
+    TIPOS = [
+        (VENTA, 'Venta Camión'),
+        (RECARGA, 'Recarga Camión'),
+        (TRASPASO, 'Traspaso'),
+    ]
+
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='operaciones_sincronizadas')
+    clave = models.CharField(max_length=64) # Generada por el dispositivo (ej. UUID), única por usuario
+    tipo = models.CharField(max_length=20, choices=TIPOS)
+    resultado = models.JSONField(default=dict) # Lo que se respondió al aplicarla; se repite en cada reenvío
+    fecha_cliente = models.DateTimeField(null=True, blank=True) # Cuándo se registró en el dispositivo
+    fecha_aplicada = models.DateTimeField(auto_now_add=True)
+    # Registro creado (según el tipo)
+    reporte_venta = models.ForeignKey(ReporteVenta, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    traspaso = models.ForeignKey(Traspaso, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    movimiento = models.ForeignKey(MovimientoCombustible, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        verbose_name = "Operación Sincronizada"
+        verbose_name_plural = "Operaciones Sincronizadas"
+        constraints = [
+            models.UniqueConstraint(fields=['usuario', 'clave'], name='opsinc_usuario_clave_uniq'),
+        ]
+
+    def __str__(self): return f"{self.get_tipo_display()} {self.clave} ({self.usuario_id})"
@@ -0,0 +1,152 @@
+# nembus_app/periodos.py
+# Motor de períodos del dashboard y las exportaciones. Un período es un rango de fechas locales
+# [desde, hasta) (hasta exclusiva): relativo a hoy (dia, semana, mes, trimestre, ...) o arbitrario
+# ('rango' con desde/hasta inclusivas). También calcula el período de comparación (anterior o
+# año contra año) y parte un período en días ya cerrados + el día en curso, para que los días
+# cerrados se lean una vez desde los resúmenes y queden en caché (ver cache_dashboard.py).
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from django.utils import timezone
+
+MESES = ['Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio', 'Julio', 'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre']
+
+# Períodos relativos a hoy, en el orden en que se ofrecen en el dashboard: {clave: título}
+RELATIVOS = {
+    'dia': 'Hoy', 'ayer': 'Ayer',
+    'semana': 'Esta Semana', 'semana_anterior': 'Semana Anterior',
+    'mes': 'Este Mes', 'mes_anterior': 'Mes Anterior',
+    'trimestre': 'Este Trimestre', 'trimestre_anterior': 'Trimestre Anterior',
+    'anio': 'Este Año', 'ultimos_7': 'Últimos 7 días', 'ultimos_30': 'Últimos 30 días',
+}
+COMPARACIONES = {'anterior': 'período anterior', 'anio': 'mismo período del año anterior'}
+
+
+class Periodo(namedtuple('Periodo', 'clave desde hasta titulo')):
+    """Rango [desde, hasta) de fechas locales. inicio/fin son los mismos límites como datetimes con timezone."""
+    __slots__ = ()
+
+    @property
+    def inicio(self): return a_medianoche(self.desde)
+
+    @property
+    def fin(self): return a_medianoche(self.hasta)
+
+    @property
+    def dias(self): return (self.hasta - self.desde).days
+
+    def parametros(self):
+        """Parámetros GET que reproducen este período (vacío para los relativos: basta la clave)."""
+        if self.clave != 'rango':
+            return {}
+        return {'desde': self.desde.isoformat(), 'hasta': (self.hasta - timedelta(days=1)).isoformat()}
+
+    def texto_fechas(self):
+        """Fechas del período para encabezados de informes: 'Octubre 2026', 'Semana del 12/10/2026 al 18/10/2026', ..."""
+        if self.clave in ('mes', 'mes_anterior'):
+            return f"{MESES[self.desde.month - 1]} {self.desde.year}"
+        if self.clave in ('semana', 'semana_anterior'):
+            return f"Semana del {_texto_rango(self.desde, self.hasta)}"
+        return _texto_rango(self.desde, self.hasta)
+
+
+def a_medianoche(fecha):
+    return timezone.make_aware(datetime.combine(fecha, datetime.min.time()))
+
+def _sumar_meses(fecha, meses):
+    """Mismo día `meses` meses después (o antes); si el día no existe, el último del mes (31/03 - 1 mes = 28/02)."""
+    total = fecha.year * 12 + fecha.month - 1 + meses
+    anio, mes = divmod(total, 12)
+    siguiente = date(anio + (mes + 1) // 12, (mes + 1) % 12 + 1, 1)
+    return date(anio, mes + 1, min(fecha.day, (siguiente - timedelta(days=1)).day))
+
+def _texto_rango(desde, hasta):
+    ultimo = hasta - timedelta(days=1)
+    if desde == ultimo:
+        return desde.strftime('%d/%m/%Y')
+    return f"{desde.strftime('%d/%m/%Y')} al {ultimo.strftime('%d/%m/%Y')}"
+
+
+def relativo(clave, hoy=None):
+    """Período relativo a hoy (fecha local). Una clave desconocida se trata como 'dia'."""
+    hoy = hoy or timezone.localdate()
+    if clave not in RELATIVOS:
+        clave = 'dia'
+    lunes = hoy - timedelta(days=hoy.weekday())
+    primero_mes = hoy.replace(day=1)
+    primero_trimestre = hoy.replace(month=(hoy.month - 1) // 3 * 3 + 1, day=1)
+    desde, hasta = {
+        'dia': (hoy, hoy + timedelta(days=1)),
+        'ayer': (hoy - timedelta(days=1), hoy),
+        'semana': (lunes, lunes + timedelta(days=7)),
+        'semana_anterior': (lunes - timedelta(days=7), lunes),
+        'mes': (primero_mes, _sumar_meses(primero_mes, 1)),
+        'mes_anterior': (_sumar_meses(primero_mes, -1), primero_mes),
+        'trimestre': (primero_trimestre, _sumar_meses(primero_trimestre, 3)),
+        'trimestre_anterior': (_sumar_meses(primero_trimestre, -3), primero_trimestre),
+        'anio': (hoy.replace(month=1, day=1), hoy.replace(year=hoy.year + 1, month=1, day=1)),
+        'ultimos_7': (hoy - timedelta(days=6), hoy + timedelta(days=1)),
+        'ultimos_30': (hoy - timedelta(days=29), hoy + timedelta(days=1)),
+    }[clave]
+    titulo = RELATIVOS[clave]
+    if clave == 'mes_anterior':
+        titulo = f"{MESES[desde.month - 1]} {desde.year}"
+    elif clave == 'trimestre_anterior':
+        titulo = f"T{(desde.month - 1) // 3 + 1} {desde.year}"
+    return Periodo(clave, desde, hasta, titulo)
+
+def rango(desde_str, hasta_str=None):
+    """Período arbitrario desde 'YYYY-MM-DD' hasta 'YYYY-MM-DD' (ambas inclusivas). Lanza ValueError si es inválido."""
+    desde = date.fromisoformat(desde_str)
+    hasta = date.fromisoformat(hasta_str) if hasta_str else desde
+    if hasta < desde:
+        raise ValueError("La fecha 'hasta' no puede ser anterior a 'desde'.")
+    return Periodo('rango', desde, hasta + timedelta(days=1), _texto_rango(desde, hasta + timedelta(days=1)))
+
+def resolver(clave, desde=None, hasta=None, hoy=None):
+    """Período a partir de la URL: clave relativa, o 'rango' (o cualquier clave) con ?desde=&hasta=."""
+    if desde or clave == 'rango':
+        if not desde:
+            raise ValueError("Falta la fecha 'desde' del rango.")
+        return rango(desde, hasta)
+    return relativo(clave, hoy)
+
+def desde_request(clave, request):
+    """resolver() con los parámetros GET del request (desde, hasta)."""
+    return resolver(clave, request.GET.get('desde'), request.GET.get('hasta'))
+
+
+# --- COMPARACIÓN ---
+
+def comparacion(periodo, modo, hoy=None):
+    """Período con el que comparar: 'anterior' (la unidad de calendario o el mismo largo justo antes) o 'anio'
+    (mismas fechas un año antes). Si el período aún no termina se compara "a la fecha": solo hasta hoy."""
+    if modo not in COMPARACIONES:
+        return None
+    hoy = hoy or timezone.localdate()
+    hasta = min(periodo.hasta, hoy + timedelta(days=1))
+    if hasta <= periodo.desde: # Período completamente futuro: nada que comparar
+        return None
+    # Meses de calendario para mes/trimestre/año; si no, se corre el largo completo del período (la semana
+    # en curso se compara lunes a lunes con la anterior, no con los 7 días previos)
+    meses = 12 if modo == 'anio' else {'mes': 1, 'mes_anterior': 1, 'trimestre': 3, 'trimestre_anterior': 3, 'anio': 12}.get(periodo.clave)
+    if meses:
+        desde_c, hasta_c = _sumar_meses(periodo.desde, -meses), _sumar_meses(hasta, -meses)
+    else:
+        largo = periodo.hasta - periodo.desde
+        desde_c, hasta_c = periodo.desde - largo, hasta - largo
+    return Periodo('rango', desde_c, hasta_c, _texto_rango(desde_c, hasta_c))
+
+
+# --- PARTICIÓN EN DÍAS CERRADOS + DÍA EN CURSO ---
+
+def particionar(periodo, hoy=None):
+    """Lista de rangos (desde, hasta) que cubren el período hasta hoy: los días ya cerrados (no cambian salvo
+    correcciones, se cachean por más tiempo) y el día en curso (se invalida con cada venta). Los días futuros
+    no tienen ventas y se omiten."""
+    hoy = hoy or timezone.localdate()
+    partes = []
+    if periodo.desde < hoy:
+        partes.append((periodo.desde, min(periodo.hasta, hoy)))
+    if periodo.desde <= hoy < periodo.hasta:
+        partes.append((hoy, hoy + timedelta(days=1)))
+    return partes
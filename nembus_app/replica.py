@@ -0,0 +1,243 @@
+# nembus_app/replica.py
+# Réplica de lectura para el dashboard de gerencia y las exportaciones (DATABASE_REPLICA_URL, ver settings).
+# - ReplicaRouter (DATABASE_ROUTERS) manda a la réplica SOLO las lecturas de modelos de nembus_app hechas dentro
+#   de una vista o bloque analítico (@lectura_analitica, usar_replica()). Todo lo demás va al primario: las
+#   escrituras, los flujos de choferes y bomberos (que releen lo que acaban de escribir), las sesiones y usuarios
+#   (un login recién hecho podría no estar aún en la réplica) y cualquier lectura dentro de una transacción.
+# - Lee-lo-que-escribiste: si un request escribe en nembus_app, ReplicaMiddleware deja una cookie por
+#   REPLICA_PEGAR_SEGUNDOS y los requests siguientes de ese navegador leen del primario.
+# - Retraso: se mide cada REPLICA_LAG_INTERVALO segundos (por proceso); si supera REPLICA_LAG_MAX o no se puede
+#   medir (réplica caída), las lecturas vuelven al primario hasta la próxima medición. La caché del dashboard
+#   además no guarda un cálculo hecho en la réplica si la última invalidación es más nueva que lo que la
+#   réplica ya tiene (incluye()).
+# Sin DATABASE_REPLICA_URL el router no hace nada (salvo en los tests, con una réplica espejo: ver settings_test).
+import asyncio
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import Error as ErrorBD
+
+logger = logging.getLogger(__name__)
+
+APP = 'nembus_app'
+
+_analitica = ContextVar('nembus_lectura_analitica', default=False)
+_peticion = ContextVar('nembus_replica_peticion', default=None) # {'primario', 'escribio'} del request en curso
+
+# Última medición del retraso (por proceso)
+_lag_lock = threading.Lock()
+_lag = {'vence': 0.0, 'medido': None, 'segundos': None, 'al_dia': False}
+
+# En PostgreSQL: 0 si no es una réplica o si ya aplicó todo lo recibido (sin escrituras en el primario,
+# pg_last_xact_replay_timestamp() envejece aunque la réplica esté al día)
+SQL_RETRASO_POSTGRES = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+def configurada():
+    return settings.REPLICA_ALIAS in settings.DATABASES
+
+
+# --- MARCAR LECTURAS ANALÍTICAS ---
+
+@contextmanager
+def usar_replica():
+    """Las lecturas de nembus_app dentro del bloque pueden ir a la réplica (si está al día)."""
+    token = _analitica.set(True)
+    try:
+        yield
+    finally:
+        _analitica.reset(token)
+
+
+@contextmanager
+def usar_primario():
+    """Fuerza el primario dentro del bloque, aunque se esté en una vista analítica."""
+    token = _analitica.set(False)
+    try:
+        yield
+    finally:
+        _analitica.reset(token)
+
+
+def lectura_analitica(vista):
+    """Decorador de vistas (síncronas o async) de solo lectura que toleran unos segundos de retraso."""
+    if iscoroutinefunction(vista):
+        @wraps(vista)
+        async def envoltura(request, *args, **kwargs):
+            with usar_replica():
+                return await vista(request, *args, **kwargs)
+    else:
+        @wraps(vista)
+        def envoltura(request, *args, **kwargs):
+            with usar_replica():
+                return vista(request, *args, **kwargs)
+    return envoltura
+
+
+def en_replica(lineas):
+    """Contenido de un StreamingHttpResponse síncrono que lee de la réplica: se genera después de que la vista
+    (y su usar_replica) terminó."""
+    with usar_replica():
+        yield from lineas
+
+
+async def aen_replica(lineas):
+    """Igual que en_replica() para un generador async."""
+    with usar_replica():
+        async for linea in lineas:
+            yield linea
+
+
+# --- RETRASO ---
+
+def _en_event_loop():
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def medir_retraso():
+    """Segundos de retraso de la réplica respecto del primario, o None si no se pudo medir."""
+    conexion = connections[settings.REPLICA_ALIAS]
+    try:
+        if conexion.vendor == 'postgresql':
+            with conexion.cursor() as cursor:
+                cursor.execute(SQL_RETRASO_POSTGRES)
+                return float(cursor.fetchone()[0])
+        if conexion.vendor == 'sqlite':
+            # Entorno local con dos archivos: la réplica es una copia del archivo del primario; lleva de retraso lo
+            # que el primario se modificó después de la última copia. En los tests es la misma BD (TEST MIRROR)
+            primario = connections[DEFAULT_DB_ALIAS].settings_dict['NAME']
+            if conexion.settings_dict['NAME'] == primario:
+                return 0.0
+            return max(0.0, os.path.getmtime(primario) - os.path.getmtime(conexion.settings_dict['NAME']))
+        return 0.0 # Otros motores: sin forma genérica de medirlo
+    except (ErrorBD, OSError) as e:
+        logger.warning("replica_sin_medicion alias=%s error=%s", settings.REPLICA_ALIAS, str(e).strip()[:200])
+        return None
+
+
+def al_dia():
+    """True si la réplica se puede usar: última medición (vigente REPLICA_LAG_INTERVALO segundos) bajo REPLICA_LAG_MAX."""
+    if time.monotonic() < _lag['vence'] or _en_event_loop(): # Desde el event loop no se consulta: vale la última
+        return _lag['al_dia']
+    with _lag_lock:
+        if time.monotonic() < _lag['vence']: # Otro hilo midió mientras se esperaba el lock
+            return _lag['al_dia']
+        segundos = medir_retraso()
+        estaba = _lag['al_dia']
+        ok = segundos is not None and segundos <= settings.REPLICA_LAG_MAX
+        _lag.update(vence=time.monotonic() + settings.REPLICA_LAG_INTERVALO, medido=time.time(), segundos=segundos, al_dia=ok)
+        if estaba and not ok:
+            logger.warning("replica_atrasada retraso=%s max=%s: lecturas al primario", segundos, settings.REPLICA_LAG_MAX)
+        elif ok and not estaba:
+            logger.info("replica_al_dia retraso=%.1f", segundos)
+    return ok
+
+
+def incluye(instante):
+    """True si la réplica ya tiene lo confirmado en el primario hasta `instante` (epoch), según la última medición."""
+    if not configurada() or not _analitica.get(): # Fuera de un bloque analítico ya se lee del primario
+        return True
+    if not al_dia():
+        return False
+    return _lag['medido'] - _lag['segundos'] >= instante
+
+
+def estado():
+    """Última medición del retraso (para /metrics), sin consultar."""
+    return {'al_dia': _lag['al_dia'], 'segundos': _lag['segundos'], 'medido': _lag['medido']}
+
+
+def reiniciar():
+    """Descarta la última medición (la próxima lectura analítica vuelve a medir)."""
+    with _lag_lock:
+        _lag.update(vence=0.0, medido=None, segundos=None, al_dia=False)
+
+
+# --- ROUTER ---
+
+class ReplicaRouter:
+    """Lecturas analíticas de nembus_app a la réplica; todo lo demás (y toda escritura) al primario."""
+
+    def db_for_read(self, model, **hints):
+        if not _analitica.get() or model._meta.app_label != APP or not configurada():
+            return None
+        peticion = _peticion.get()
+        if peticion is not None and peticion['primario']:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block: # La transacción puede tener escrituras sin confirmar
+            return None
+        return settings.REPLICA_ALIAS if al_dia() else None
+
+    def db_for_write(self, model, **hints):
+        peticion = _peticion.get()
+        if peticion is not None and model._meta.app_label == APP:
+            peticion['primario'] = peticion['escribio'] = True # El resto del request (y la cookie) lee del primario
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Son los mismos datos: un objeto leído de la réplica se puede asignar a uno del primario
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # La réplica recibe el esquema por replicación (o copia, en la prueba local)
+        return db != settings.REPLICA_ALIAS
+
+
+# --- MIDDLEWARE ---
+
+class ReplicaMiddleware:
+    """Estado por request del router: lee la cookie de "escribiste hace poco" y la deja si el request escribió."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.asincrono = iscoroutinefunction(get_response)
+        if self.asincrono:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.asincrono:
+            return self.__acall__(request)
+        if not configurada():
+            return self.get_response(request)
+        peticion = {'primario': settings.REPLICA_COOKIE in request.COOKIES, 'escribio': False}
+        token = _peticion.set(peticion)
+        try:
+            response = self.get_response(request)
+        finally:
+            _peticion.reset(token)
+        return self._marcar(response, peticion)
+
+    async def __acall__(self, request):
+        if not configurada():
+            return await self.get_response(request)
+        peticion = {'primario': settings.REPLICA_COOKIE in request.COOKIES, 'escribio': False}
+        token = _peticion.set(peticion) # Las copias del contexto (sync_to_async, en_paralelo) comparten el dict
+        try:
+            response = await self.get_response(request)
+        finally:
+            _peticion.reset(token)
+        return self._marcar(response, peticion)
+
+    def _marcar(self, response, peticion):
+        if peticion['escribio'] and settings.REPLICA_PEGAR_SEGUNDOS > 0:
+            response.set_cookie(settings.REPLICA_COOKIE, '1', max_age=settings.REPLICA_PEGAR_SEGUNDOS,
+                                httponly=True, samesite='Lax', secure=settings.SESSION_COOKIE_SECURE)
+        return response
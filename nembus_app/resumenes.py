@@ -0,0 +1,214 @@
+# nembus_app/resumenes.py
+# Mantenimiento incremental de las tablas de resumen (rollups) que usa el dashboard de gerencia.
+# Cada venta se traduce en un "estado" = (claves del resumen, valores a sumar). Al crear se suma,
+# al borrar se resta y al editar se resta el estado anterior y se suma el nuevo.
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Sum, Count, F, OuterRef, Subquery, Value, DecimalField, IntegerField
+from django.db.models.functions import TruncDate, ExtractHour, Coalesce
+from django.utils import timezone
+from .models import (
+    ReporteVenta, RegistroVentaIndividualBomba, LecturaBomba, ReporteTurno,
+    ResumenVentaCamionHora, ResumenVentaBombaDia
+)
+from . import cache_dashboard
+
+CERO = Decimal('0')
+
+# --- ESTADOS (claves + valores) A PARTIR DE UNA VENTA ---
+
+def estado_venta_camion(reporte):
+    """Claves y valores de resumen para un ReporteVenta (o None si aún no tiene fecha)."""
+    if reporte.fecha_hora is None:
+        return None
+    local = timezone.localtime(reporte.fecha_hora)
+    claves = {
+        'fecha': local.date(), 'hora': local.hour,
+        'camion_id': reporte.camion_id, 'cliente_id': reporte.cliente_id, 'trabajador_id': reporte.trabajador_id,
+    }
+    valores = {
+        'num_ventas': 1,
+        'litros_vendidos': reporte.litros_vendidos or CERO,
+        'monto_combustible_clp': reporte.monto_combustible_clp or CERO,
+        'costo_flete_clp': reporte.costo_flete_clp or CERO,
+        'monto_total_clp': reporte.monto_total_clp or CERO,
+    }
+    return claves, valores
+
+def estado_venta_camion_en_bd(pk):
+    """Estado de un ReporteVenta tal como está guardado en la BD (antes de editarlo/borrarlo)."""
+    reporte = ReporteVenta.objects.filter(pk=pk).only(
+        'fecha_hora', 'camion_id', 'cliente_id', 'trabajador_id', 'litros_vendidos',
+        'monto_combustible_clp', 'costo_flete_clp', 'monto_total_clp'
+    ).first()
+    return estado_venta_camion(reporte) if reporte else None
+
+def _estado_de_fila_bomba(f):
+    claves = {
+        'fecha': timezone.localtime(f['fecha_registro']).date(),
+        'bomba_id': f['lectura_bomba__bomba_id'],
+        'turno_id': f['lectura_bomba__reporte_turno__turno_id'],
+        'punto_de_venta_id': f['lectura_bomba__bomba__punto_de_venta_id'],
+    }
+    valores = {
+        'num_ventas': 1,
+        'litros_vendidos': f['litros_vendidos'] or CERO,
+        'ingreso': f['ingreso_registro'] or CERO,
+    }
+    return claves, valores
+
+def ventas_bomba_en_bd(pks):
+    """Para cada venta de bomba: (estado del resumen, contador del turno), leídos en UNA consulta.
+    El contador es (lectura_id, reporte_turno_id, litros, ingreso) para los totales corrientes del turno."""
+    filas = RegistroVentaIndividualBomba.objects.filter(pk__in=pks).values(
+        'pk', 'fecha_registro', 'litros_vendidos', 'ingreso_registro', 'lectura_bomba_id', 'lectura_bomba__reporte_turno_id',
+        'lectura_bomba__bomba_id', 'lectura_bomba__bomba__punto_de_venta_id', 'lectura_bomba__reporte_turno__turno_id'
+    )
+    return {
+        f['pk']: (_estado_de_fila_bomba(f), (
+            f['lectura_bomba_id'], f['lectura_bomba__reporte_turno_id'], f['litros_vendidos'] or CERO, f['ingreso_registro'] or CERO
+        )) for f in filas
+    }
+
+def venta_bomba_en_bd(pk):
+    """(estado, contador) de una venta de bomba, o (None, None) si no existe."""
+    return ventas_bomba_en_bd([pk]).get(pk, (None, None))
+
+# --- APLICACIÓN DE DELTAS ---
+
+def _aplicar(modelo, estados, signo):
+    """Suma (signo=1) o resta (signo=-1) una lista de estados sobre la tabla de resumen."""
+    # Agrupar primero en memoria para emitir un UPDATE por clave distinta
+    acumulado = {}
+    for estado in estados:
+        if not estado: continue
+        claves, valores = estado
+        llave = tuple(sorted(claves.items()))
+        actual = acumulado.setdefault(llave, dict.fromkeys(valores, 0))
+        for campo, valor in valores.items():
+            actual[campo] += valor
+    restadas = []
+    for llave, valores in acumulado.items():
+        claves = dict(llave)
+        # Los campos que no son de la clave única (ej. punto_de_venta) van como defaults
+        unicos = {k: v for k, v in claves.items() if k != 'punto_de_venta_id'}
+        defaults = {k: v for k, v in claves.items() if k not in unicos}
+        fila, _ = modelo.objects.get_or_create(**unicos, defaults=defaults)
+        modelo.objects.filter(pk=fila.pk).update(**{
+            campo: F(campo) + (valor if signo > 0 else -valor) for campo, valor in valores.items()
+        })
+        restadas.append(fila.pk)
+    # Al restar, las filas que se quedan sin ventas se borran (un DELETE para todas) para que la tabla no
+    # acumule ceros que el dashboard tendría que leer y agrupar
+    if signo < 0 and restadas:
+        modelo.objects.filter(pk__in=restadas, num_ventas__lte=0).delete()
+
+def sumar_ventas_camion(estados): _aplicar(ResumenVentaCamionHora, estados, 1)
+def restar_ventas_camion(estados): _aplicar(ResumenVentaCamionHora, estados, -1)
+def sumar_ventas_bomba(estados): _aplicar(ResumenVentaBombaDia, estados, 1)
+def restar_ventas_bomba(estados): _aplicar(ResumenVentaBombaDia, estados, -1)
+
+# --- CONTADORES CORRIENTES DEL TURNO (LecturaBomba / ReporteTurno) ---
+# Totales de litros, ingreso y número de ventas mantenidos en cada escritura, para que cerrar o
+# listar turnos no tenga que agregar las ventas. El comando verificar_contadores_turno detecta y repara desvíos.
+
+def ajustar_contadores_turno(restar=(), sumar=()):
+    """Aplica contadores (lectura_id, reporte_turno_id, litros, ingreso): un UPDATE con F() por lectura y por turno."""
+    por_lectura, por_reporte = {}, {}
+    for signo, contadores in ((-1, restar), (1, sumar)):
+        for contador in contadores:
+            if not contador: continue
+            lectura_id, reporte_id, litros, ingreso = contador
+            for acumulado, llave in ((por_lectura, lectura_id), (por_reporte, reporte_id)):
+                n, l, i = acumulado.get(llave, (0, CERO, CERO))
+                acumulado[llave] = (n + signo, l + signo * litros, i + signo * ingreso)
+    for pk, (n, litros, ingreso) in por_lectura.items():
+        if n or litros or ingreso:
+            LecturaBomba.objects.filter(pk=pk).update(
+                num_ventas_turno=F('num_ventas_turno') + n, litros_vendidos_turno=F('litros_vendidos_turno') + litros,
+                ingreso_turno=F('ingreso_turno') + ingreso,
+            )
+    for pk, (n, litros, ingreso) in por_reporte.items():
+        if n or litros or ingreso:
+            ReporteTurno.objects.filter(pk=pk).update(
+                num_ventas=F('num_ventas') + n, total_litros=F('total_litros') + litros, total_ingreso=F('total_ingreso') + ingreso,
+            )
+
+CAMPOS_CONTADOR = {
+    LecturaBomba: ('lectura_bomba', ('num_ventas_turno', 'litros_vendidos_turno', 'ingreso_turno')),
+    ReporteTurno: ('lectura_bomba__reporte_turno', ('num_ventas', 'total_litros', 'total_ingreso')),
+}
+
+def contadores_turno_descuadrados():
+    """Lecturas y turnos cuyos totales corrientes no coinciden con sus ventas: [(modelo, pk, guardado, real)]."""
+    descuadres = []
+    for modelo, (relacion, campos) in CAMPOS_CONTADOR.items():
+        reales = {
+            f[relacion]: (f['n'], f['litros'], f['ingreso'])
+            for f in RegistroVentaIndividualBomba.objects.values(relacion).annotate(
+                n=Count('id'), litros=Sum('litros_vendidos'), ingreso=Sum('ingreso_registro')
+            ).order_by()
+        }
+        for pk, *guardado in modelo.objects.values_list('pk', *campos).iterator():
+            real = reales.get(pk, (0, CERO, CERO))
+            if tuple(guardado) != real:
+                descuadres.append((modelo, pk, tuple(guardado), real))
+    return descuadres
+
+def reparar_contadores_turno(modelo, pks):
+    """Recalcula desde las ventas los totales corrientes de esas lecturas/turnos (un UPDATE con subconsultas)."""
+    relacion, (campo_n, campo_litros, campo_ingreso) = CAMPOS_CONTADOR[modelo]
+
+    def total(expr, campo):
+        qs = RegistroVentaIndividualBomba.objects.filter(**{relacion: OuterRef('pk')}).order_by().values(relacion).annotate(t=expr).values('t')
+        return Coalesce(Subquery(qs, output_field=campo), Value(0), output_field=campo)
+
+    decimal = DecimalField(max_digits=16, decimal_places=4)
+    return modelo.objects.filter(pk__in=pks).update(**{
+        campo_n: total(Count('id'), IntegerField()),
+        campo_litros: total(Sum('litros_vendidos'), decimal),
+        campo_ingreso: total(Sum('ingreso_registro'), decimal),
+    })
+
+# --- RECONSTRUCCIÓN COMPLETA (O POR RANGO DE FECHAS) ---
+
+def reconstruir(desde=None, hasta=None, batch_size=1000):
+    """Recalcula los resúmenes desde las tablas crudas. desde/hasta son fechas locales inclusivas."""
+    def _rango(qs, campo='fecha'):
+        if desde: qs = qs.filter(**{f'{campo}__gte': desde})
+        if hasta: qs = qs.filter(**{f'{campo}__lte': hasta})
+        return qs
+
+    camiones = _rango(
+        ReporteVenta.objects.annotate(dia=TruncDate('fecha_hora'), h=ExtractHour('fecha_hora')), 'dia'
+    ).values('dia', 'h', 'camion_id', 'cliente_id', 'trabajador_id').annotate(
+        n=Count('id'), litros=Sum('litros_vendidos'), combustible=Sum('monto_combustible_clp'),
+        flete=Sum('costo_flete_clp'), total=Sum('monto_total_clp')
+    ).order_by()
+    bombas = _rango(
+        RegistroVentaIndividualBomba.objects.annotate(dia=TruncDate('fecha_registro')), 'dia'
+    ).values(
+        'dia', 'lectura_bomba__bomba_id', 'lectura_bomba__reporte_turno__turno_id', 'lectura_bomba__bomba__punto_de_venta_id'
+    ).annotate(n=Count('id'), litros=Sum('litros_vendidos'), ingreso=Sum('ingreso_registro')).order_by()
+
+    with transaction.atomic():
+        cache_dashboard.invalidar() # Al confirmar
+        _rango(ResumenVentaCamionHora.objects.all()).delete()
+        _rango(ResumenVentaBombaDia.objects.all()).delete()
+        filas_camion = ResumenVentaCamionHora.objects.bulk_create((
+            ResumenVentaCamionHora(
+                fecha=f['dia'], hora=f['h'], camion_id=f['camion_id'], cliente_id=f['cliente_id'],
+                trabajador_id=f['trabajador_id'], num_ventas=f['n'], litros_vendidos=f['litros'] or CERO,
+                monto_combustible_clp=f['combustible'] or CERO, costo_flete_clp=f['flete'] or CERO,
+                monto_total_clp=f['total'] or CERO,
+            ) for f in camiones.iterator()
+        ), batch_size=batch_size)
+        filas_bomba = ResumenVentaBombaDia.objects.bulk_create((
+            ResumenVentaBombaDia(
+                fecha=f['dia'], bomba_id=f['lectura_bomba__bomba_id'],
+                turno_id=f['lectura_bomba__reporte_turno__turno_id'],
+                punto_de_venta_id=f['lectura_bomba__bomba__punto_de_venta_id'],
+                num_ventas=f['n'], litros_vendidos=f['litros'] or CERO, ingreso=f['ingreso'] or CERO,
+            ) for f in bombas.iterator()
+        ), batch_size=batch_size)
+    return len(filas_camion), len(filas_bomba)
@@ -0,0 +1,137 @@
+# nembus_app/signals.py
+# Mantiene las tablas de resumen del dashboard sincronizadas con cada escritura de ventas,
+# e invalida la caché del dashboard (cache_dashboard.py) en cada escritura que lo afecta.
+# También invalida la foto de capacidades de los trabajadores (capacidades.py) cuando cambia su perfil.
+import threading
+from contextlib import contextmanager
+from django.contrib.auth.models import User
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+from .models import (
+    ReporteVenta, RegistroVentaIndividualBomba, Traspaso, ReporteTurno, MovimientoCombustible,
+    PerfilTrabajador, PuntoDeVenta,
+)
+from . import resumenes, cache_dashboard, capacidades
+
+# Guardados que no tocan ningún campo del resumen (ej. adjuntar la foto tras registrar la venta)
+CAMPOS_SIN_RESUMEN = {'foto_evidencia', 'foto_miniatura', 'foto_estado'}
+
+def _no_afecta_resumen(update_fields):
+    return update_fields is not None and set(update_fields) <= CAMPOS_SIN_RESUMEN
+
+# Escrituras en lote (turnos.py) aplican los deltas del resumen ellas mismas: mientras tanto
+# los receivers por fila de ventas de bomba no hacen nada (bulk_create/bulk_update ya no los disparan)
+_estado_hilo = threading.local()
+
+@contextmanager
+def resumenes_bomba_en_lote():
+    _estado_hilo.en_lote = True
+    try:
+        yield
+    finally:
+        _estado_hilo.en_lote = False
+
+def _en_lote(): return getattr(_estado_hilo, 'en_lote', False)
+
+# --- VENTAS DE CAMIÓN ---
+
+@receiver(pre_save, sender=ReporteVenta)
+def capturar_estado_previo_venta_camion(sender, instance, raw=False, update_fields=None, **kwargs):
+    if _no_afecta_resumen(update_fields): return
+    # Si es una edición, guardar el estado anterior para poder restarlo después
+    instance._estado_resumen_previo = None if raw or not instance.pk else resumenes.estado_venta_camion_en_bd(instance.pk)
+
+@receiver(post_save, sender=ReporteVenta)
+def actualizar_resumen_venta_camion(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw: return # Cargas de fixtures: usar reconstruir_resumenes
+    if _no_afecta_resumen(update_fields): return
+    resumenes.restar_ventas_camion([getattr(instance, '_estado_resumen_previo', None)])
+    resumenes.sumar_ventas_camion([resumenes.estado_venta_camion(instance)])
+
+@receiver(post_delete, sender=ReporteVenta)
+def descontar_resumen_venta_camion(sender, instance, **kwargs):
+    resumenes.restar_ventas_camion([resumenes.estado_venta_camion(instance)])
+
+# --- VENTAS DE BOMBA ---
+# Cada venta ajusta el resumen del dashboard y los totales corrientes de su lectura y su turno
+
+@receiver(pre_save, sender=RegistroVentaIndividualBomba)
+def capturar_estado_previo_venta_bomba(sender, instance, raw=False, **kwargs):
+    if _en_lote(): return
+    instance._estado_resumen_previo = (None, None) if raw or not instance.pk else resumenes.venta_bomba_en_bd(instance.pk)
+
+@receiver(post_save, sender=RegistroVentaIndividualBomba)
+def actualizar_resumen_venta_bomba(sender, instance, raw=False, **kwargs):
+    if raw or _en_lote(): return
+    estado_previo, contador_previo = getattr(instance, '_estado_resumen_previo', (None, None))
+    estado, contador = resumenes.venta_bomba_en_bd(instance.pk)
+    resumenes.restar_ventas_bomba([estado_previo])
+    resumenes.sumar_ventas_bomba([estado])
+    resumenes.ajustar_contadores_turno(restar=[contador_previo], sumar=[contador])
+
+@receiver(pre_delete, sender=RegistroVentaIndividualBomba)
+def capturar_estado_venta_bomba_a_borrar(sender, instance, **kwargs):
+    if _en_lote(): return
+    # Hay que leerlo ANTES del borrado (en un CASCADE la lectura/turno pueden desaparecer)
+    instance._estado_resumen_previo = resumenes.venta_bomba_en_bd(instance.pk)
+
+@receiver(post_delete, sender=RegistroVentaIndividualBomba)
+def descontar_resumen_venta_bomba(sender, instance, **kwargs):
+    if _en_lote(): return
+    estado_previo, contador_previo = getattr(instance, '_estado_resumen_previo', (None, None))
+    resumenes.restar_ventas_bomba([estado_previo])
+    resumenes.ajustar_contadores_turno(restar=[contador_previo])
+
+# --- CACHÉ DEL DASHBOARD ---
+# Fecha de cada escritura: si es anterior a hoy también se invalidan los períodos cerrados
+
+FECHA_DASHBOARD = {
+    ReporteVenta: 'fecha_hora', RegistroVentaIndividualBomba: 'fecha_registro', Traspaso: 'fecha_hora',
+    ReporteTurno: 'fecha_inicio', MovimientoCombustible: 'fecha_hora', # Movimientos: inventario de camiones/bombas
+}
+
+def invalidar_cache_dashboard(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or _no_afecta_resumen(update_fields): return
+    if sender is RegistroVentaIndividualBomba and _en_lote(): return # turnos.py invalida una vez por lote
+    cache_dashboard.invalidar(getattr(instance, FECHA_DASHBOARD[sender]))
+
+for _modelo in FECHA_DASHBOARD:
+    post_save.connect(invalidar_cache_dashboard, sender=_modelo, dispatch_uid=f'cache_dashboard_save_{_modelo.__name__}')
+    post_delete.connect(invalidar_cache_dashboard, sender=_modelo, dispatch_uid=f'cache_dashboard_delete_{_modelo.__name__}')
+
+
+# --- CAPACIDADES DE TRABAJADORES ---
+
+@receiver(post_save, sender=PerfilTrabajador)
+@receiver(post_delete, sender=PerfilTrabajador)
+def invalidar_capacidades_perfil(sender, instance, **kwargs):
+    capacidades.invalidar(instance.usuario_id)
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidar_capacidades_usuario(sender, instance, **kwargs):
+    capacidades.invalidar(instance.pk) # is_superuser define el rol
+
+@receiver(post_save, sender=PuntoDeVenta)
+def invalidar_capacidades_punto_venta(sender, instance, raw=False, created=False, **kwargs):
+    if raw or created: return
+    capacidades.invalidar(*PerfilTrabajador.objects.filter(punto_de_venta_asignado=instance).values_list('usuario_id', flat=True))
+
+def invalidar_capacidades_asignaciones(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse: # perfil.camiones_asignados.add(...)
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            capacidades.invalidar(instance.usuario_id)
+        return
+    # camion.operadores_generales.add(perfil, ...): pk_set son perfiles; en un clear hay que leerlos antes
+    if action in ('post_add', 'post_remove'):
+        perfiles = PerfilTrabajador.objects.filter(pk__in=pk_set)
+    elif action == 'pre_clear':
+        perfiles = PerfilTrabajador.objects.filter(pk__in=sender.objects.filter(
+            **{f'{instance._meta.model_name}_id': instance.pk}).values('perfiltrabajador_id'))
+    else:
+        return
+    capacidades.invalidar(*perfiles.values_list('usuario_id', flat=True))
+
+for _campo in ('clientes_asignados', 'camiones_asignados', 'camiones_traspaso'):
+    m2m_changed.connect(invalidar_capacidades_asignaciones, sender=getattr(PerfilTrabajador, _campo).through,
+                        dispatch_uid=f'capacidades_{_campo}')
@@ -0,0 +1,194 @@
+# nembus_app/sincronizacion.py
+# Sincronización en lote de los choferes sin conexión (vista api_sincronizar). El dispositivo guarda en una cola
+# las ventas, recargas y traspasos que no pudo enviar y, al reconectarse, manda toda la cola en un solo POST.
+# - Cada operación trae una clave generada por el dispositivo (ej. un UUID). OperacionSincronizada la guarda con
+#   índice único (usuario, clave): un reenvío (timeout, reintento manual) devuelve el resultado original como
+#   'duplicada' sin aplicarla de nuevo, aunque dos reenvíos lleguen a la vez (el índice decide cuál gana).
+# - El lote se aplica en UNA transacción, con un savepoint por operación: una operación rechazada (sin stock,
+#   camión no asignado, dato inválido, error de la BD) se revierte sola y el resto se confirma junto. Una rechazada no consume
+#   su clave: se puede corregir y reenviar con la misma.
+# - Las operaciones se aplican en el orden de la cola (ej. la recarga antes de la venta que la necesita).
+# - La fecha de los registros es la de aplicación: el libro de movimientos y sus snapshots no admiten fechas
+#   pasadas. La del dispositivo queda en fecha_cliente.
+# - Las fotos de evidencia de las ventas van opcionalmente en el mismo POST (multipart) como foto_<clave>.
+import logging
+from decimal import Decimal, InvalidOperation
+from django.contrib.admin.models import ADDITION, CHANGE
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Cliente, Camion, ReporteVenta, Traspaso, MovimientoCombustible, OperacionSincronizada
+from . import inventario, auditoria
+
+logger = logging.getLogger(__name__)
+
+APLICADA = 'aplicada'
+DUPLICADA = 'duplicada'
+RECHAZADA = 'rechazada'
+LARGO_CLAVE = OperacionSincronizada._meta.get_field('clave').max_length
+
+
+class OperacionRechazada(ValueError):
+    """Operación inválida o no permitida para el chofer. El mensaje es apto para el usuario."""
+
+
+def _litros(valor, campo):
+    """Litros positivos que caben en `campo` (el DecimalField del registro): un valor fuera de sus max_digits o
+    decimal_places haría fallar el INSERT (DataError en PostgreSQL)."""
+    try:
+        litros = Decimal(str(valor))
+    except (InvalidOperation, TypeError, ValueError):
+        raise OperacionRechazada("Dato inválido: litros.")
+    if not litros.is_finite() or litros <= 0:
+        raise OperacionRechazada("Los litros deben ser positivos.")
+    try:
+        campo.run_validators(litros)
+    except ValidationError:
+        raise OperacionRechazada(f"Dato inválido: litros (hasta {campo.max_digits - campo.decimal_places} dígitos enteros "
+                                 f"y {campo.decimal_places} decimales).")
+    return litros
+
+
+def _fecha_cliente(valor):
+    """Fecha informada por el dispositivo (opcional). Una fecha con formato válido pero imposible (ej. mes 13) se rechaza."""
+    try:
+        fecha = parse_datetime(valor) if isinstance(valor, str) else None
+    except ValueError:
+        raise OperacionRechazada("Dato inválido: fecha.")
+    if fecha is not None and timezone.is_naive(fecha):
+        fecha = timezone.make_aware(fecha)
+    return fecha
+
+
+# --- OPERACIONES ---
+# Cada una valida contra las capacidades del chofer (capacidades.py), aplica lo mismo que su vista web y devuelve
+# (campos de OperacionSincronizada, resultado para el dispositivo)
+
+def _venta(operacion, usuario, perfil, foto):
+    if perfil.es_bombero:
+        raise OperacionRechazada("Acción no disponible para tu perfil.")
+    if not perfil.cliente_asignado(operacion.get('cliente')):
+        raise OperacionRechazada("Cliente seleccionado no válido.")
+    if not perfil.camion_asignado(operacion.get('camion')):
+        raise OperacionRechazada("Camión seleccionado no válido.")
+    litros = _litros(operacion.get('litros'), ReporteVenta._meta.get_field('litros_vendidos'))
+    cliente = Cliente.objects.get(pk=operacion['cliente'])
+    camion = Camion.objects.get(pk=operacion['camion'])
+
+    monto_combustible = litros * cliente.precio_litro_clp
+    reporte = ReporteVenta.objects.create(
+        trabajador=usuario, cliente=cliente, camion=camion, litros_vendidos=litros,
+        monto_combustible_clp=monto_combustible, costo_flete_clp=cliente.costo_flete_clp,
+        monto_total_clp=monto_combustible + cliente.costo_flete_clp,
+    )
+    inventario.descontar_camion(camion, litros, trabajador=usuario, reporte_venta=reporte)
+    if foto is not None: # El worker la normaliza (fotos.py)
+        reporte.foto_evidencia = foto
+        reporte.foto_estado = ReporteVenta.FOTO_PENDIENTE
+        reporte.save(update_fields=['foto_evidencia', 'foto_estado'])
+    auditoria.registrar(usuario, reporte, ADDITION, "Venta registrada por sincronización sin conexión.")
+    return {'reporte_venta': reporte}, {'id': reporte.pk, 'monto_total_clp': str(reporte.monto_total_clp)}
+
+
+def _recarga(operacion, usuario, perfil, foto):
+    if not perfil.puede_recargar or perfil.es_bombero:
+        raise OperacionRechazada("Acción no permitida.")
+    if not perfil.camion_asignado(operacion.get('camion')):
+        raise OperacionRechazada("Camión seleccionado no válido.")
+    litros = _litros(operacion.get('litros'), MovimientoCombustible._meta.get_field('litros'))
+    camion = Camion.objects.get(pk=operacion['camion'])
+
+    movimiento = inventario.recargar_camion(camion, litros, trabajador=usuario)
+    auditoria.registrar(usuario, camion, CHANGE, f"Recarga de {litros}L registrada por sincronización sin conexión.")
+    return {'movimiento': movimiento}, {'id': movimiento.pk, 'camion': camion.patente}
+
+
+def _traspaso(operacion, usuario, perfil, foto):
+    if not perfil.puede_traspasar or perfil.es_bombero:
+        raise OperacionRechazada("Acción no permitida.")
+    if not (perfil.camion_traspaso(operacion.get('camion_origen')) and perfil.camion_traspaso(operacion.get('camion_destino'))):
+        raise OperacionRechazada("Error: Camión no válido o no permitido para traspasos.")
+    litros = _litros(operacion.get('litros'), Traspaso._meta.get_field('litros'))
+    camion_origen = Camion.objects.get(pk=operacion['camion_origen'])
+    camion_destino = Camion.objects.get(pk=operacion['camion_destino'])
+
+    traspaso = Traspaso.objects.create(trabajador=usuario, camion_origen=camion_origen, camion_destino=camion_destino, litros=litros)
+    inventario.traspasar_entre_camiones(camion_origen, camion_destino, litros, trabajador=usuario, traspaso=traspaso)
+    auditoria.registrar(usuario, traspaso, ADDITION, "Traspaso registrado por sincronización sin conexión.")
+    return {'traspaso': traspaso}, {'id': traspaso.pk}
+
+
+APLICAR = {
+    OperacionSincronizada.VENTA: _venta,
+    OperacionSincronizada.RECARGA: _recarga,
+    OperacionSincronizada.TRASPASO: _traspaso,
+}
+
+
+# --- LOTE ---
+
+def _aplicar(operacion, clave, usuario, perfil, fotos):
+    """Aplica una operación en su savepoint. Devuelve el resultado para el dispositivo."""
+    tipo = operacion.get('tipo')
+    try:
+        with transaction.atomic():
+            # La clave se inserta ANTES de aplicar: si otro reenvío la está aplicando, este espera su transacción
+            # y falla por el índice único en vez de aplicarla dos veces
+            registro = OperacionSincronizada.objects.create(
+                usuario=usuario, clave=clave, tipo=tipo, fecha_cliente=_fecha_cliente(operacion.get('fecha')),
+            )
+            campos, resultado = APLICAR[tipo](operacion, usuario, perfil, fotos.get(f'foto_{clave}'))
+            for campo, valor in campos.items():
+                setattr(registro, campo, valor)
+            registro.resultado = resultado
+            registro.save(update_fields=[*campos, 'resultado'])
+    except IntegrityError:
+        existente = OperacionSincronizada.objects.filter(usuario=usuario, clave=clave).first()
+        if existente is None: # La restricción violada no era la de la clave
+            logger.exception("sincronizacion_error_integridad usuario=%s clave=%s", usuario.pk, clave)
+            return {'clave': clave, 'estado': RECHAZADA, 'error': "No se pudo registrar la operación."}
+        return {'clave': clave, 'estado': DUPLICADA, **existente.resultado}
+    except DatabaseError:
+        # Ej. un DataError (valor fuera de rango): se revirtió solo su savepoint y el resto del lote sigue
+        logger.exception("sincronizacion_error_bd usuario=%s clave=%s tipo=%s", usuario.pk, clave, tipo)
+        return {'clave': clave, 'estado': RECHAZADA, 'error': "No se pudo registrar la operación."}
+    except (OperacionRechazada, inventario.InventarioError) as e:
+        return {'clave': clave, 'estado': RECHAZADA, 'error': str(e)}
+    except (Cliente.DoesNotExist, Camion.DoesNotExist):
+        return {'clave': clave, 'estado': RECHAZADA, 'error': "Cliente o camión no válido."}
+    return {'clave': clave, 'estado': APLICADA, **resultado}
+
+
+def sincronizar(usuario, perfil, operaciones, fotos=None):
+    """Aplica la cola `operaciones` (lista de dicts con clave, tipo y sus datos) del chofer en una transacción y
+    devuelve un resultado por operación, en el mismo orden: aplicada, duplicada (ya aplicada antes: trae el
+    resultado original) o rechazada (con el error)."""
+    fotos = fotos or {}
+    claves = [op.get('clave') for op in operaciones if isinstance(op, dict) and isinstance(op.get('clave'), str)]
+    # Los reenvíos ya aplicados se responden sin savepoint ni escrituras (una consulta para todo el lote)
+    aplicadas = {
+        registro.clave: registro.resultado
+        for registro in OperacionSincronizada.objects.filter(usuario=usuario, clave__in=claves).only('clave', 'resultado')
+    }
+    resultados = []
+    with transaction.atomic():
+        for operacion in operaciones:
+            clave = operacion.get('clave') if isinstance(operacion, dict) else None
+            if not isinstance(clave, str) or not 0 < len(clave) <= LARGO_CLAVE:
+                resultados.append({'clave': clave, 'estado': RECHAZADA, 'error': f"Clave inválida (texto de 1 a {LARGO_CLAVE} caracteres)."})
+            elif clave in aplicadas:
+                resultados.append({'clave': clave, 'estado': DUPLICADA, **aplicadas[clave]})
+            elif operacion.get('tipo') not in APLICAR:
+                resultados.append({'clave': clave, 'estado': RECHAZADA, 'error': f"Tipo de operación desconocido: {operacion.get('tipo')}."})
+            else:
+                resultado = _aplicar(operacion, clave, usuario, perfil, fotos)
+                if resultado['estado'] == APLICADA: # Repetida más adelante en el mismo lote: duplicada
+                    aplicadas[clave] = {k: v for k, v in resultado.items() if k not in ('clave', 'estado')}
+                resultados.append(resultado)
+
+    conteo = {estado: sum(1 for r in resultados if r['estado'] == estado) for estado in (APLICADA, DUPLICADA, RECHAZADA)}
+    logger.info("sincronizacion_lote usuario=%s operaciones=%d aplicadas=%d duplicadas=%d rechazadas=%d",
+                usuario.pk, len(resultados), conteo[APLICADA], conteo[DUPLICADA], conteo[RECHAZADA])
+    return resultados
+
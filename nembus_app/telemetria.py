@@ -0,0 +1,302 @@
+# nembus_app/telemetria.py
+# Endpoint /metrics en formato de texto de Prometheus (exposition format 0.0.4), sin dependencias extra.
+# - Requests: histograma de latencia y de consultas SQL por vista (nombre de URL) y contador por estado HTTP.
+#   Los alimenta InstrumentacionMiddleware; viven en memoria del proceso (cada worker expone los suyos,
+#   con la etiqueta 'pid', y se reinician con el proceso: usar rate()/increase() en Prometheus).
+# - Negocio y colas: litros_actuales por camión y por bomba, turnos abiertos, exportaciones y fotos en cola,
+#   duración de las exportaciones y caché del dashboard. Se leen de una FOTO (snapshot) que se recalcula
+#   cada METRICAS_INTERVALO segundos en un hilo aparte: un scrape nunca consulta la BD, salvo el primero
+#   del proceso.
+# - Pool de conexiones (DB_POOL=True): tamaño, disponibles, esperas y timeouts del pool de psycopg del proceso.
+# - Réplica de lectura (DATABASE_REPLICA_URL): si está en uso y su último retraso medido (replica.py).
+import os
+import resource
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Q, Sum
+from . import replica
+
+# Límites superiores (le) de los histogramas
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKETS_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 200)
+BUCKETS_EXPORTACION = (1, 5, 15, 30, 60, 120, 300, 600, 1800)
+
+INICIO_PROCESO = time.time()
+
+
+# --- HISTOGRAMAS EN MEMORIA (POR PROCESO) ---
+
+class Histograma:
+    """Histograma acumulado por combinación de etiquetas."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.series = {} # etiquetas (tupla) -> [conteos por bucket..., suma, total]
+
+    def observar(self, etiquetas, valor):
+        serie = self.series.get(etiquetas)
+        if serie is None:
+            serie = self.series[etiquetas] = [0] * len(self.buckets) + [0.0, 0]
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                serie[i] += 1
+        serie[-2] += valor
+        serie[-1] += 1
+
+
+_lock = threading.Lock()
+_latencia = Histograma(BUCKETS_SEGUNDOS)
+_consultas = Histograma(BUCKETS_CONSULTAS)
+_peticiones = {} # (vista, metodo, estado) -> total
+
+
+def observar_peticion(vista, metodo, estado, segundos, consultas):
+    """Registra un request ya medido (lo llama InstrumentacionMiddleware)."""
+    vista = vista or 'sin_ruta' # 404 y rutas fuera del URLconf: una sola serie
+    with _lock:
+        _latencia.observar((vista,), segundos)
+        _consultas.observar((vista,), consultas)
+        clave = (vista, metodo, str(estado))
+        _peticiones[clave] = _peticiones.get(clave, 0) + 1
+
+
+def reiniciar():
+    """Borra los contadores del proceso y la foto (pruebas y comandos)."""
+    global _foto, _foto_instante
+    with _lock:
+        _latencia.series.clear()
+        _consultas.series.clear()
+        _peticiones.clear()
+    with _lock_foto:
+        _foto, _foto_instante = None, 0.0
+
+
+# --- FOTO PERIÓDICA DE NEGOCIO ---
+
+_lock_foto = threading.Lock()
+_foto = None
+_foto_instante = 0.0 # time.monotonic() del último cálculo
+_refrescando = False
+
+
+def calcular_foto():
+    """Lee de la BD los valores de negocio y colas. Una consulta por grupo, sin importar cuántos camiones/bombas haya."""
+    from .models import Camion, Bomba, ReporteTurno, ReporteVenta, TrabajoExportacion
+    from . import cache_dashboard
+
+    duracion = ExpressionWrapper(F('fecha_fin') - F('fecha_inicio'), output_field=DurationField())
+    buckets = {f'b{i}': Count('id', filter=Q(duracion__lte=timedelta(seconds=limite)))
+               for i, limite in enumerate(BUCKETS_EXPORTACION)}
+    exportaciones = []
+    for fila in (TrabajoExportacion.objects
+                 .filter(estado__in=[TrabajoExportacion.COMPLETADO, TrabajoExportacion.ERROR],
+                         fecha_inicio__isnull=False, fecha_fin__isnull=False)
+                 .annotate(duracion=duracion).values('tipo', 'estado')
+                 .annotate(total=Count('id'), suma=Sum('duracion'), **buckets).order_by('tipo', 'estado')):
+        suma = fila['suma']
+        if not isinstance(suma, timedelta): # Algunos backends devuelven microsegundos
+            suma = timedelta(microseconds=suma or 0)
+        exportaciones.append({
+            'tipo': fila['tipo'], 'estado': fila['estado'], 'total': fila['total'], 'suma': suma.total_seconds(),
+            'buckets': [fila[f'b{i}'] for i in range(len(BUCKETS_EXPORTACION))],
+        })
+
+    return {
+        'camiones': list(Camion.objects.order_by('patente').values_list('patente', 'litros_actuales')),
+        'bombas': list(Bomba.objects.order_by('punto_de_venta__nombre', 'nombre')
+                       .values_list('punto_de_venta__nombre', 'nombre', 'litros_actuales')),
+        'turnos_abiertos': ReporteTurno.objects.filter(esta_abierto=True).count(),
+        'exportaciones_cola': dict(TrabajoExportacion.objects
+                                   .filter(estado__in=[TrabajoExportacion.PENDIENTE, TrabajoExportacion.EN_PROCESO])
+                                   .values_list('estado').annotate(n=Count('id')).order_by()),
+        'exportaciones': exportaciones,
+        'fotos_pendientes': ReporteVenta.objects.filter(foto_estado=ReporteVenta.FOTO_PENDIENTE).count(),
+        'cache_dashboard': cache_dashboard.estadisticas(),
+        'calculada': time.time(),
+        'segundos_calculo': 0.0,
+    }
+
+
+def _refrescar():
+    global _foto, _foto_instante, _refrescando
+    try:
+        inicio = time.perf_counter()
+        foto = calcular_foto()
+        foto['segundos_calculo'] = time.perf_counter() - inicio
+        with _lock_foto:
+            _foto, _foto_instante = foto, time.monotonic()
+    finally:
+        _refrescando = False
+        close_old_connections() # El hilo no pasa por el ciclo de request que cierra la conexión
+
+
+def foto_actual():
+    """Foto vigente. Si está vencida se recalcula en segundo plano y mientras tanto se sirve la anterior;
+    solo el primer scrape del proceso espera el cálculo."""
+    global _refrescando
+    with _lock_foto:
+        foto, edad = _foto, time.monotonic() - _foto_instante
+        vencida = foto is None or edad >= settings.METRICAS_INTERVALO
+        lanzar = vencida and foto is not None and not _refrescando
+        if lanzar:
+            _refrescando = True
+    if foto is None:
+        _refrescar()
+        return _foto
+    if lanzar:
+        threading.Thread(target=_refrescar, name='metricas-foto', daemon=True).start()
+    return foto
+
+
+# --- POOL DE CONEXIONES ---
+
+# Métrica -> (clave de psycopg_pool get_stats(), tipo, divisor, ayuda)
+METRICAS_POOL = {
+    'nembus_bd_pool_conexiones': ('pool_size', 'gauge', 1, 'Conexiones abiertas por el pool (en uso + disponibles).'),
+    'nembus_bd_pool_disponibles': ('pool_available', 'gauge', 1, 'Conexiones del pool libres para un request.'),
+    'nembus_bd_pool_min': ('pool_min', 'gauge', 1, 'Tamaño mínimo del pool (DB_POOL_MIN).'),
+    'nembus_bd_pool_max': ('pool_max', 'gauge', 1, 'Tamaño máximo del pool (DB_POOL_MAX).'),
+    'nembus_bd_pool_esperando': ('requests_waiting', 'gauge', 1, 'Requests esperando una conexión ahora.'),
+    'nembus_bd_pool_peticiones_total': ('requests_num', 'counter', 1, 'Conexiones pedidas al pool.'),
+    'nembus_bd_pool_en_cola_total': ('requests_queued', 'counter', 1, 'Pedidos que tuvieron que esperar una conexión.'),
+    'nembus_bd_pool_espera_seconds_total': ('requests_wait_ms', 'counter', 1000, 'Tiempo total esperando conexiones.'),
+    'nembus_bd_pool_timeouts_total': ('requests_errors', 'counter', 1, 'Pedidos que agotaron DB_POOL_TIMEOUT.'),
+    'nembus_bd_pool_conexiones_abiertas_total': ('connections_num', 'counter', 1, 'Conexiones abiertas al servidor.'),
+    'nembus_bd_pool_conexiones_perdidas_total': ('connections_lost', 'counter', 1, 'Conexiones descartadas por el chequeo de salud.'),
+}
+
+
+def estadisticas_pool():
+    """{alias: get_stats()} del pool de cada BD configurada con pool (en memoria del proceso, sin consultas)."""
+    resultado = {}
+    for alias in connections:
+        conexion = connections[alias]
+        if not conexion.settings_dict.get('OPTIONS', {}).get('pool'):
+            continue
+        pool = conexion.pool # Compartido por los hilos del proceso
+        if pool is not None:
+            resultado[alias] = pool.get_stats()
+    return resultado
+
+
+# --- FORMATO DE TEXTO ---
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _etiquetas(nombres, valores, extra=()):
+    pares = list(zip(nombres, valores)) + list(extra)
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{n}="{_escapar(v)}"' for n, v in pares) + '}'
+
+def _numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if not isinstance(valor, int) else str(valor)
+
+def _cabecera(lineas, nombre, tipo, ayuda):
+    lineas.append(f'# HELP {nombre} {ayuda}')
+    lineas.append(f'# TYPE {nombre} {tipo}')
+
+def _histograma(lineas, nombre, ayuda, nombres, buckets, series):
+    """series: iterable de (valores_etiquetas, conteos_por_bucket, suma, total)."""
+    _cabecera(lineas, nombre, 'histogram', ayuda)
+    for valores, conteos, suma, total in series:
+        for limite, conteo in zip(buckets, conteos):
+            lineas.append(f'{nombre}_bucket{_etiquetas(nombres, valores, [("le", _numero(limite))])} {conteo}')
+        lineas.append(f'{nombre}_bucket{_etiquetas(nombres, valores, [("le", "+Inf")])} {total}')
+        lineas.append(f'{nombre}_sum{_etiquetas(nombres, valores)} {_numero(float(suma))}')
+        lineas.append(f'{nombre}_count{_etiquetas(nombres, valores)} {total}')
+
+
+def _memoria_residente():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def exposicion():
+    """Texto completo del endpoint /metrics."""
+    lineas = []
+    pid = str(os.getpid())
+
+    # Requests (en memoria del proceso)
+    with _lock:
+        latencia = [((v, pid), s[:-2], s[-2], s[-1]) for (v,), s in sorted(_latencia.series.items())]
+        consultas = [((v, pid), s[:-2], s[-2], s[-1]) for (v,), s in sorted(_consultas.series.items())]
+        peticiones = sorted(_peticiones.items())
+    _histograma(lineas, 'nembus_peticion_duracion_seconds', 'Latencia de los requests por vista.',
+                ('vista', 'pid'), BUCKETS_SEGUNDOS, latencia)
+    _histograma(lineas, 'nembus_peticion_consultas', 'Consultas SQL por request, por vista.',
+                ('vista', 'pid'), BUCKETS_CONSULTAS, consultas)
+    _cabecera(lineas, 'nembus_peticiones_total', 'counter', 'Requests atendidos por vista, método y estado HTTP.')
+    for (vista, metodo, estado), total in peticiones:
+        lineas.append(f'nembus_peticiones_total{_etiquetas(("vista", "metodo", "estado", "pid"), (vista, metodo, estado, pid))} {total}')
+
+    # Proceso
+    uso = resource.getrusage(resource.RUSAGE_SELF)
+    _cabecera(lineas, 'process_cpu_seconds_total', 'counter', 'Tiempo de CPU (usuario + sistema) del proceso.')
+    lineas.append(f'process_cpu_seconds_total{_etiquetas(("pid",), (pid,))} {_numero(uso.ru_utime + uso.ru_stime)}')
+    memoria = _memoria_residente()
+    if memoria is not None:
+        _cabecera(lineas, 'process_resident_memory_bytes', 'gauge', 'Memoria residente del proceso.')
+        lineas.append(f'process_resident_memory_bytes{_etiquetas(("pid",), (pid,))} {memoria}')
+    _cabecera(lineas, 'process_start_time_seconds', 'gauge', 'Inicio del proceso (epoch).')
+    lineas.append(f'process_start_time_seconds{_etiquetas(("pid",), (pid,))} {_numero(INICIO_PROCESO)}')
+    _cabecera(lineas, 'process_threads', 'gauge', 'Hilos de Python vivos en el proceso.')
+    lineas.append(f'process_threads{_etiquetas(("pid",), (pid,))} {threading.active_count()}')
+
+    # Pool de conexiones (en vivo: get_stats() solo lee contadores en memoria)
+    pools = estadisticas_pool()
+    if pools:
+        for nombre, (clave, tipo, divisor, ayuda) in METRICAS_POOL.items():
+            _cabecera(lineas, nombre, tipo, ayuda)
+            for alias, stats in sorted(pools.items()):
+                valor = stats.get(clave, 0) # psycopg_pool omite los contadores en cero
+                lineas.append(f'{nombre}{_etiquetas(("alias", "pid"), (alias, pid))} {_numero(valor / divisor if divisor != 1 else valor)}')
+
+    # Réplica de lectura (la última medición del proceso, sin consultar)
+    if replica.configurada():
+        medicion = replica.estado()
+        _cabecera(lineas, 'nembus_replica_al_dia', 'gauge', 'Lecturas analíticas en la réplica (1) o de vuelta en el primario (0).')
+        lineas.append(f'nembus_replica_al_dia{_etiquetas(("pid",), (pid,))} {int(medicion["al_dia"])}')
+        if medicion['segundos'] is not None:
+            _cabecera(lineas, 'nembus_replica_retraso_seconds', 'gauge', 'Retraso de la réplica en la última medición.')
+            lineas.append(f'nembus_replica_retraso_seconds{_etiquetas(("pid",), (pid,))} {_numero(medicion["segundos"])}')
+
+    # Foto de negocio
+    foto = foto_actual()
+    _cabecera(lineas, 'nembus_camion_litros', 'gauge', 'Litros actuales en el estanque de cada camión.')
+    for patente, litros in foto['camiones']:
+        lineas.append(f'nembus_camion_litros{_etiquetas(("patente",), (patente,))} {_numero(litros)}')
+    _cabecera(lineas, 'nembus_bomba_litros', 'gauge', 'Litros actuales de cada bomba.')
+    for punto_venta, bomba, litros in foto['bombas']:
+        lineas.append(f'nembus_bomba_litros{_etiquetas(("punto_venta", "bomba"), (punto_venta, bomba))} {_numero(litros)}')
+    _cabecera(lineas, 'nembus_turnos_abiertos', 'gauge', 'Turnos de bomba (ReporteTurno) abiertos.')
+    lineas.append(f'nembus_turnos_abiertos {foto["turnos_abiertos"]}')
+    _cabecera(lineas, 'nembus_exportaciones_en_cola', 'gauge', 'Trabajos de exportación pendientes o en proceso.')
+    for estado in ('pendiente', 'en_proceso'):
+        lineas.append(f'nembus_exportaciones_en_cola{_etiquetas(("estado",), (estado,))} {foto["exportaciones_cola"].get(estado, 0)}')
+    _histograma(lineas, 'nembus_exportacion_duracion_seconds', 'Duración de los trabajos de exportación terminados.',
+                ('tipo', 'estado'), BUCKETS_EXPORTACION,
+                [((e['tipo'], e['estado']), e['buckets'], e['suma'], e['total']) for e in foto['exportaciones']])
+    _cabecera(lineas, 'nembus_fotos_pendientes', 'gauge', 'Fotos de evidencia esperando al worker.')
+    lineas.append(f'nembus_fotos_pendientes {foto["fotos_pendientes"]}')
+    cache = foto['cache_dashboard']
+    for contador in ('aciertos', 'fallos', 'invalidaciones'):
+        nombre = f'nembus_cache_dashboard_{contador}_total'
+        _cabecera(lineas, nombre, 'counter', f'Caché del dashboard: {contador} acumulados.')
+        lineas.append(f'{nombre} {cache[contador]}')
+    _cabecera(lineas, 'nembus_cache_dashboard_tasa_aciertos', 'gauge', 'Caché del dashboard: aciertos / (aciertos + fallos).')
+    lineas.append(f'nembus_cache_dashboard_tasa_aciertos {_numero(cache["tasa_aciertos"])}')
+    _cabecera(lineas, 'nembus_metricas_foto_timestamp_seconds', 'gauge', 'Momento (epoch) en que se calculó la foto de negocio.')
+    lineas.append(f'nembus_metricas_foto_timestamp_seconds {_numero(foto["calculada"])}')
+    _cabecera(lineas, 'nembus_metricas_foto_calculo_seconds', 'gauge', 'Lo que tardó el último cálculo de la foto.')
+    lineas.append(f'nembus_metricas_foto_calculo_seconds {_numero(foto["segundos_calculo"])}')
+    return '\n'.join(lineas) + '\n'
@@ -1,3 +1,819 @@
-from django.test import TestCase
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile
+from django.db import DEFAULT_DB_ALIAS, DataError, OperationalError, connection, transaction
+from django.db.utils import ConnectionHandler
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from .forms import VentaIndividualFormSet
+from .models import (
+    Camion, Cliente, PerfilTrabajador, ReporteVenta, OperacionSincronizada, PuntoDeVenta, Bomba, Turno, ReporteTurno, LecturaBomba, RegistroVentaIndividualBomba,
+    ResumenVentaBombaDia, MovimientoCombustible, TrabajoExportacion, ArchivoEvidencia
+)
+from . import almacenamiento, cache_dashboard, exportaciones, fotos, inventario, periodos, replica, resumenes, sincronizacion, turnos
 
-# Create your tests here.
+
+# --- MÉTRICAS PARA PROMETHEUS ---
+
+class MetricasPrometheusTests(TestCase):
+    """/metrics responde al token o a staff; nunca por la IP de origen (detrás de nginx todo llega de localhost)."""
+
+    def setUp(self):
+        self.url = reverse('nembus_app:metricas_prometheus')
+
+    @override_settings(METRICAS_TOKEN='')
+    def test_sin_token_localhost_no_basta(self):
+        self.assertEqual(self.client.get(self.url, REMOTE_ADDR='127.0.0.1').status_code, 403)
+        self.assertEqual(self.client.get(self.url, REMOTE_ADDR='::1').status_code, 403)
+
+    @override_settings(METRICAS_TOKEN='')
+    def test_sin_token_responde_a_staff(self):
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        respuesta = self.client.get(self.url)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn(b'nembus_', respuesta.content)
+
+    @override_settings(METRICAS_TOKEN='')
+    def test_sin_token_usuario_comun_no(self):
+        self.client.force_login(User.objects.create_user('chofer'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    @override_settings(METRICAS_TOKEN='secreto')
+    def test_con_token(self):
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION='Bearer secreto').status_code, 200)
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION='Bearer otro').status_code, 403)
+        self.assertEqual(self.client.get(self.url, REMOTE_ADDR='127.0.0.1').status_code, 403)
+
+
+# --- INVENTARIO DE CAMIONES (CONCURRENCIA) ---
+
+class InventarioConcurrenteTests(TransactionTestCase):
+    """Ventas, recargas y traspasos concurrentes (un hilo y una conexión por trabajador) no pierden actualizaciones,
+    no dejan stock negativo y el libro cuadra con litros_actuales. La carrera de leer-modificar-guardar solo se
+    reproduce en PostgreSQL (READ COMMITTED); SQLite serializa las transacciones que escriben."""
+    INICIAL = Decimal('5000.00')
+    CAPACIDAD = 10000
+
+    def setUp(self):
+        self.camiones = [Camion.objects.create(patente=f'CONC-{i}', capacidad_total=self.CAPACIDAD, litros_actuales=self.INICIAL)
+                         for i in range(3)]
+        for camion in self.camiones:
+            inventario.registrar_ajuste(camion, self.INICIAL, nota="Saldo inicial")
+
+    def en_hilos(self, n_hilos, trabajo):
+        """Corre trabajo(semilla) en n_hilos a la vez; cada hilo cierra su conexión al terminar."""
+        errores = []
+        def hilo(semilla):
+            try:
+                trabajo(semilla)
+            except Exception as e: # Se reporta en el hilo principal
+                errores.append(e)
+            finally:
+                connection.close()
+        hilos = [threading.Thread(target=hilo, args=(semilla,)) for semilla in range(n_hilos)]
+        for h in hilos: h.start()
+        for h in hilos: h.join()
+        self.assertEqual(errores, [])
+
+    def operar(self, funcion, *args):
+        """Aplica un movimiento en su transacción. True si se confirmó, False si lo rechazó el inventario.
+        SQLite bloquea la BD entera entre escritores: se reintenta (en PostgreSQL espera el bloqueo de fila)."""
+        for intento in range(50):
+            try:
+                with transaction.atomic():
+                    funcion(*args)
+                return True
+            except inventario.InventarioError:
+                return False
+            except OperationalError:
+                time.sleep(0.005 * (intento + 1))
+        raise AssertionError("La BD siguió bloqueada tras 50 reintentos.")
+
+    def test_movimientos_concurrentes(self):
+        esperado = {camion.pk: self.INICIAL for camion in self.camiones}
+        lock = threading.Lock()
+
+        def trabajo(semilla):
+            r = random.Random(semilla)
+            for _ in range(40):
+                litros = Decimal(r.randint(1, 400))
+                a, b = r.sample(self.camiones, 2)
+                op = r.choice(['venta', 'recarga', 'traspaso'])
+                if op == 'venta' and self.operar(inventario.descontar_camion, a, litros):
+                    deltas = {a.pk: -litros}
+                elif op == 'recarga' and self.operar(inventario.recargar_camion, a, litros):
+                    deltas = {a.pk: litros}
+                elif op == 'traspaso' and self.operar(inventario.traspasar_entre_camiones, a, b, litros):
+                    deltas = {a.pk: -litros, b.pk: litros}
+                else:
+                    continue
+                with lock:
+                    for pk, delta in deltas.items():
+                        esperado[pk] += delta
+
+        self.en_hilos(6, trabajo)
+        reales = dict(Camion.objects.values_list('pk', 'litros_actuales'))
+        self.assertEqual(reales, esperado)
+        for litros in reales.values():
+            self.assertTrue(0 <= litros <= self.CAPACIDAD)
+        self.assertEqual(inventario.saldos_descuadrados(), [])
+
+    def test_ventas_concurrentes_no_dejan_negativo(self):
+        # 6 hilos x 10 ventas de 100 L sobre un camión con 5000 L: exactamente 50 se confirman
+        camion = self.camiones[0]
+        confirmadas = []
+        self.en_hilos(6, lambda semilla: confirmadas.extend(
+            ok for ok in (self.operar(inventario.descontar_camion, camion, Decimal('100')) for _ in range(10)) if ok
+        ))
+        camion.refresh_from_db()
+        self.assertEqual(len(confirmadas), 50)
+        self.assertEqual(camion.litros_actuales, Decimal('0'))
+        self.assertEqual(inventario.saldos_descuadrados(), [])
+
+
+# --- INVENTARIO: EDICIÓN EN EL ADMIN ---
+
+class EstanqueAdminTests(TestCase):
+    """Editar un camión en el admin no pisa el saldo: los movimientos concurrentes se conservan y los ajustes son deltas."""
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin'))
+        self.camion = Camion.objects.create(patente='AB12', capacidad_total=10000, litros_actuales=5000)
+        inventario.registrar_ajuste(self.camion, Decimal('5000'), nota="Saldo inicial")
+        self.url = reverse('admin:nembus_app_camion_change', args=[self.camion.pk])
+
+    def guardar(self, **datos):
+        respuesta = self.client.post(self.url, {'patente': 'AB12', 'capacidad_total': 12000, **datos})
+        self.assertEqual(respuesta.status_code, 302)
+        self.camion.refresh_from_db()
+
+    def test_guardar_no_revierte_movimientos_concurrentes(self):
+        # La página se abrió con 5000 L y mientras tanto hubo una venta; el POST trae el saldo viejo (se ignora)
+        with transaction.atomic():
+            inventario.descontar_camion(self.camion, Decimal('300'))
+        self.guardar(litros_actuales='5000')
+        self.assertEqual((self.camion.capacidad_total, self.camion.litros_actuales), (12000, Decimal('4700')))
+        self.assertFalse(MovimientoCombustible.objects.filter(tipo=MovimientoCombustible.AJUSTE, nota__contains='admin').exists())
+        self.assertEqual(inventario.saldos_descuadrados(), [])
+
+    def test_ajuste_es_un_delta(self):
+        self.guardar(ajuste_litros='-250.5')
+        self.assertEqual(self.camion.litros_actuales, Decimal('4749.50'))
+        ajuste = MovimientoCombustible.objects.get(tipo=MovimientoCombustible.AJUSTE, nota="Ajuste manual desde el admin")
+        self.assertEqual(ajuste.litros, Decimal('-250.5'))
+        self.assertEqual(inventario.saldos_descuadrados(), [])
+
+
+# --- GESTIÓN DE TURNOS (GUARDADO EN LOTE) ---
+
+class TurnoLoteTests(TestCase):
+    """guardar_ventas_turno y finalizar_turno hacen un número fijo de consultas, sin importar cuántas ventas haya
+    (solo crecerían por los lotes de bulk_create/bulk_update, que con estos tamaños son uno)."""
+
+    def setUp(self):
+        self.usuario = User.objects.create_user('bombero')
+        self.pdv = PuntoDeVenta.objects.create(nombre='PDV Turno')
+        ContentType.objects.get_for_model(RegistroVentaIndividualBomba) # La auditoría la cachea al primer uso
+
+    def escenario(self, n_bombas=2):
+        """Turno abierto con bombas nuevas (sin filas de resumen previas) y sus lecturas."""
+        self.bombas = [Bomba.objects.create(punto_de_venta=self.pdv, nombre=f'B{i}', precio_litro_clp=1000, litros_actuales=100000)
+                       for i in range(n_bombas)]
+        self.reporte = ReporteTurno.objects.create(trabajador=self.usuario, turno=Turno.objects.create(punto_de_venta=self.pdv, nombre='T'))
+        for bomba in self.bombas:
+            LecturaBomba.objects.create(reporte_turno=self.reporte, bomba=bomba, contador_inicial=0)
+
+    def lecturas(self):
+        return list(self.reporte.lecturas.select_related('bomba').order_by('bomba__nombre'))
+
+    def formsets(self, lecturas, nuevas=0, editar=0, borrar=0):
+        """Formsets validados como los arma gestionar_turno: edita las primeras `editar` ventas de cada bomba, borra
+        las `borrar` siguientes y agrega `nuevas`."""
+        formsets = {}
+        for lectura in lecturas:
+            prefijo = f'ventas_{lectura.pk}'
+            existentes = list(lectura.ventas_individuales.order_by('pk'))
+            formularios = []
+            for i, venta in enumerate(existentes):
+                litros = venta.litros_vendidos + 1 if i < editar else venta.litros_vendidos
+                formularios.append({'id': venta.pk, 'numero_maquina': venta.numero_maquina, 'socio_propietario': venta.socio_propietario,
+                                    'litros_vendidos': litros, **({'DELETE': 'on'} if editar <= i < editar + borrar else {})})
+            formularios += [{'numero_maquina': str(i), 'socio_propietario': 'SOCIO', 'litros_vendidos': '10'} for i in range(nuevas)]
+            datos = {f'{prefijo}-TOTAL_FORMS': len(formularios), f'{prefijo}-INITIAL_FORMS': len(existentes),
+                     f'{prefijo}-MIN_NUM_FORMS': 0, f'{prefijo}-MAX_NUM_FORMS': 1000}
+            for i, campos in enumerate(formularios):
+                datos.update({f'{prefijo}-{i}-{campo}': valor for campo, valor in campos.items()})
+                datos[f'{prefijo}-{i}-lectura_bomba'] = lectura.pk
+            formset = VentaIndividualFormSet(datos, instance=lectura, prefix=prefijo)
+            self.assertTrue(formset.is_valid(), formset.errors)
+            formsets[lectura.pk] = formset
+        return formsets
+
+    def guardar(self, consultas, **cambios):
+        lecturas = self.lecturas()
+        formsets = self.formsets(lecturas, **cambios)
+        with self.assertNumQueries(consultas):
+            return turnos.guardar_ventas_turno(formsets, {l.pk: l for l in lecturas}, self.usuario)
+
+    def verificar(self):
+        """Resúmenes, totales corrientes e inventario cuadran con las ventas guardadas."""
+        incremental = sorted(ResumenVentaBombaDia.objects.values_list('bomba', 'num_ventas', 'litros_vendidos', 'ingreso'))
+        resumenes.reconstruir()
+        self.assertEqual(incremental, sorted(ResumenVentaBombaDia.objects.values_list('bomba', 'num_ventas', 'litros_vendidos', 'ingreso')))
+        self.assertEqual(resumenes.contadores_turno_descuadrados(), [])
+
+    def test_guardar_y_finalizar_consultas_fijas(self):
+        for n_ventas in (4, 60):
+            with self.subTest(ventas=n_ventas):
+                self.escenario()
+                # Por bomba (una fila de resumen): get_or_create (4 con savepoint) + UPDATE; lecturas y turno: 3 UPDATE;
+                # bulk_create y la lectura de los estados nuevos
+                self.assertEqual(self.guardar(15, nuevas=n_ventas), (2 * n_ventas, 0))
+                # Resumen: restar y sumar por bomba (SELECT + UPDATE c/u, la fila ya existe) y el DELETE de filas en cero;
+                # estados previos, borrado (SELECT + DELETE, hay receptores de señales), bulk_update, bulk_create, estados
+                # nuevos y 3 UPDATE de totales
+                guardadas, borradas = self.guardar(18, nuevas=n_ventas, editar=n_ventas // 2, borrar=n_ventas // 4)
+                self.assertEqual((guardadas, borradas), (2 * (n_ventas + n_ventas // 2), 2 * (n_ventas // 4)))
+                self.verificar()
+
+                lecturas = self.lecturas()
+                with self.assertNumQueries(5): # Totales, contadores finales, bombas, libro y el turno
+                    turnos.finalizar_turno(self.reporte, lecturas, self.usuario)
+                self.reporte.refresh_from_db()
+                self.assertFalse(self.reporte.esta_abierto)
+                for lectura in self.lecturas():
+                    vendido = lectura.ventas_individuales.aggregate(t=Sum('litros_vendidos'))['t']
+                    self.assertEqual(lectura.contador_final, vendido)
+                    lectura.bomba.refresh_from_db()
+                    self.assertEqual(lectura.bomba.litros_actuales, Decimal('100000') - vendido)
+                    self.assertEqual(MovimientoCombustible.objects.filter(bomba=lectura.bomba).aggregate(t=Sum('litros'))['t'], -vendido)
+
+
+    def test_borrar_todas_las_ventas_elimina_la_fila_de_resumen(self):
+        self.escenario(n_bombas=1)
+        self.guardar(9, nuevas=3)
+        self.assertEqual(ResumenVentaBombaDia.objects.filter(bomba__in=self.bombas).count(), 1)
+        self.guardar(8, borrar=3) # Estados, borrado (SELECT + DELETE), resumen (SELECT, UPDATE, DELETE) y 2 UPDATE de totales
+        self.assertFalse(ResumenVentaBombaDia.objects.filter(bomba__in=self.bombas).exists())
+        self.verificar()
+
+    def otro_request_antes_del_bloqueo(self, request_previo):
+        """Parchea turnos.bloquear_turno_abierto para que `request_previo` se complete justo antes de que el request
+        en curso tome el bloqueo (lo que pasaría con dos requests concurrentes)."""
+        bloquear = turnos.bloquear_turno_abierto
+
+        def intercalado(*args):
+            with mock.patch.object(turnos, 'bloquear_turno_abierto', bloquear):
+                request_previo()
+            return bloquear(*args)
+        return mock.patch.object(turnos, 'bloquear_turno_abierto', side_effect=intercalado)
+
+    def test_doble_finalizar_descuenta_una_vez(self):
+        self.escenario()
+        self.guardar(15, nuevas=3)
+        self.client.force_login(self.usuario)
+        url = reverse('nembus_app:gestionar_turno', args=[self.reporte.pk])
+        with self.otro_request_antes_del_bloqueo(lambda: self.client.post(url, {'finalizar_turno': '1'})):
+            self.client.post(url, {'finalizar_turno': '1'})
+        for bomba in self.bombas:
+            bomba.refresh_from_db()
+            self.assertEqual(bomba.litros_actuales, Decimal('99970'))
+            self.assertEqual(MovimientoCombustible.objects.filter(bomba=bomba).count(), 1)
+
+    def test_venta_por_api_durante_el_cierre_se_rechaza(self):
+        self.escenario(n_bombas=1)
+        self.client.force_login(self.usuario)
+        lectura = self.lecturas()[0]
+        finalizar = lambda: self.client.post(reverse('nembus_app:gestionar_turno', args=[self.reporte.pk]), {'finalizar_turno': '1'})
+        with self.otro_request_antes_del_bloqueo(finalizar):
+            respuesta = self.client.post(reverse('nembus_app:api_venta_turno', args=[self.reporte.pk]), {
+                'lectura': lectura.pk, 'numero_maquina': '1', 'socio_propietario': 'SOCIO', 'litros_vendidos': '10'})
+        self.assertEqual(respuesta.status_code, 404)
+        self.assertFalse(RegistroVentaIndividualBomba.objects.exists())
+        self.reporte.refresh_from_db()
+        self.assertFalse(self.reporte.esta_abierto)
+
+# --- DASHBOARD DE GERENCIA (PANELES Y CACHÉ) ---
+
+SIN_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-default'},
+             'dashboard': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+             'capacidades': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+CON_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-default'},
+             'dashboard': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-dashboard', 'TIMEOUT': None},
+             'capacidades': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-capacidades'}}
+
+# Lo que cuesta cualquier request del gerente: la sesión y el usuario dos veces (request.user para el Server-Timing
+# de instrumentacion.py y request.auser() en la vista async)
+CONSULTAS_REQUEST = 3
+# Consultas de datos por panel de la API sin caché: una por agregado y partición ('dia' es una partición, el día en
+# curso; 'semana', un rango de 7 días que termina hoy, son dos: los días cerrados y hoy). bombas/pdv es UNA consulta
+# agrupada por (PDV, bomba, turno)
+CONSULTAS_PANEL = {
+    'dia': {
+        ('camiones', 'kpis'): 1, ('camiones', 'inventario'): 1, ('camiones', 'ventas_hora'): 1,
+        ('bombas', 'kpis'): 2, ('bombas', 'pdv'): 1,
+        ('relaciones', 'kpis'): 3, ('relaciones', 'ingresos_desglose'): 2, ('relaciones', 'viajes_chofer'): 1,
+        ('relaciones', 'clientes'): 1,
+    },
+    'semana': {
+        ('camiones', 'kpis'): 2, ('camiones', 'eficiencia_flota'): 2,
+        ('bombas', 'kpis'): 4, ('bombas', 'pdv'): 2,
+        ('relaciones', 'kpis'): 6, ('relaciones', 'ingresos_desglose'): 4, ('relaciones', 'viajes_chofer'): 2,
+        ('relaciones', 'clientes'): 2,
+    },
+}
+
+
+class DashboardMixin:
+    def setUp(self):
+        self.hoy = timezone.localdate()
+        self.client.force_login(User.objects.create_superuser('gerente'))
+        self.n_pdv = 0
+
+    def agregar_pdv(self, n):
+        """n puntos de venta con una bomba y un turno cada uno, con ventas resumidas ayer y hoy."""
+        for _ in range(n):
+            self.n_pdv += 1
+            pdv = PuntoDeVenta.objects.create(nombre=f'PDV {self.n_pdv:03d}')
+            turno = Turno.objects.create(punto_de_venta=pdv, nombre='T')
+            bomba = Bomba.objects.create(punto_de_venta=pdv, nombre='B', precio_litro_clp=1000)
+            ResumenVentaBombaDia.objects.bulk_create([
+                ResumenVentaBombaDia(fecha=fecha, bomba=bomba, turno=turno, punto_de_venta=pdv, num_ventas=1,
+                                     litros_vendidos=10, ingreso=10000)
+                for fecha in (self.hoy - timedelta(days=1), self.hoy)
+            ])
+
+    def url_panel(self, division, periodo, panel):
+        url = reverse('nembus_app:api_metricas', args=[division, periodo if periodo == 'dia' else 'rango', panel])
+        if periodo == 'semana':
+            url += f'?desde={self.hoy - timedelta(days=6)}&hasta={self.hoy}'
+        return url
+
+
+@override_settings(CACHES=SIN_CACHE)
+class DashboardConsultasTests(DashboardMixin, TestCase):
+    """Cada panel hace un número fijo de consultas, sin importar cuántos puntos de venta haya."""
+
+    def test_paneles_consultas_fijas(self):
+        for n_pdv in (2, 10):
+            self.agregar_pdv(n_pdv - self.n_pdv)
+            for periodo, paneles in CONSULTAS_PANEL.items():
+                for (division, panel), consultas in paneles.items():
+                    with self.subTest(pdv=n_pdv, periodo=periodo, division=division, panel=panel):
+                        with self.assertNumQueries(CONSULTAS_REQUEST + consultas):
+                            respuesta = self.client.get(self.url_panel(division, periodo, panel))
+                        self.assertEqual(respuesta.status_code, 200)
+
+    def test_pdv_de_bombas_agrupado(self):
+        self.agregar_pdv(3)
+        datos = self.client.get(self.url_panel('bombas', 'semana', 'pdv')).json()['datos']
+        self.assertEqual([p['pdv_nombre'] for p in datos['puntos_de_venta']], ['PDV 001', 'PDV 002', 'PDV 003'])
+        self.assertEqual({tuple(p['bombas_data']) for p in datos['puntos_de_venta']}, {(20.0,)})
+
+    def test_paginas_sin_consultas_de_datos(self):
+        # La página solo trae el esqueleto: los paneles se piden a la API
+        self.agregar_pdv(2)
+        for division in ('camiones', 'bombas', 'relaciones'):
+            with self.subTest(division=division), self.assertNumQueries(CONSULTAS_REQUEST):
+                self.assertEqual(self.client.get(reverse('nembus_app:dashboard_gerente', args=[division, 'dia'])).status_code, 200)
+
+
+@override_settings(CACHES=CON_CACHE)
+class DashboardCacheTests(DashboardMixin, TestCase):
+    """Segunda visita desde la caché; una escritura confirmada la invalida."""
+
+    def setUp(self):
+        super().setUp()
+        cache_dashboard._cache().clear()
+        self.agregar_pdv(2)
+        self.url = self.url_panel('bombas', 'dia', 'kpis')
+
+    def test_segunda_visita_desde_cache(self):
+        primera = self.client.get(self.url)
+        with self.assertNumQueries(CONSULTAS_REQUEST):
+            segunda = self.client.get(self.url)
+        self.assertEqual(segunda.json(), primera.json())
+        with self.assertNumQueries(CONSULTAS_REQUEST): # Revalidación con ETag: 304 sin calcular
+            self.assertEqual(self.client.get(self.url, headers={'If-None-Match': primera['ETag']}).status_code, 304)
+
+    def test_escritura_confirmada_invalida(self):
+        self.assertEqual(self.client.get(self.url).json()['datos']['litros_vendidos'], 20.0)
+        bomba = Bomba.objects.get(nombre='B', punto_de_venta__nombre='PDV 001')
+        reporte = ReporteTurno.objects.create(trabajador=User.objects.create_user('bombero'), turno=Turno.objects.get(punto_de_venta=bomba.punto_de_venta))
+        lectura = LecturaBomba.objects.create(reporte_turno=reporte, bomba=bomba, contador_inicial=0)
+
+        # Sin confirmar, la caché no cambia (otro request no debe cachear datos sin confirmar)
+        with self.captureOnCommitCallbacks(execute=False):
+            RegistroVentaIndividualBomba.objects.create(lectura_bomba=lectura, numero_maquina='1', socio_propietario='S', litros_vendidos=5)
+        with self.assertNumQueries(CONSULTAS_REQUEST):
+            self.assertEqual(self.client.get(self.url).json()['datos']['litros_vendidos'], 20.0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            RegistroVentaIndividualBomba.objects.create(lectura_bomba=lectura, numero_maquina='2', socio_propietario='S', litros_vendidos=7)
+        with self.assertNumQueries(CONSULTAS_REQUEST + CONSULTAS_PANEL['dia'][('bombas', 'kpis')]): # Recalculado
+            self.assertEqual(self.client.get(self.url).json()['datos']['litros_vendidos'], 32.0)
+
+    def test_periodo_cerrado_expira(self):
+        # Con locmem otro proceso no ve la invalidación de una corrección: los días cerrados también expiran
+        url = reverse('nembus_app:api_metricas', args=['bombas', 'rango', 'pdv']) + f'?desde={self.hoy - timedelta(days=7)}&hasta={self.hoy - timedelta(days=1)}'
+        for timeout, consultas in ((60, 0), (0, CONSULTAS_PANEL['dia'][('bombas', 'pdv')])):
+            with self.subTest(timeout=timeout), self.settings(DASHBOARD_CACHE_TIMEOUT_HISTORICO=timeout):
+                cache_dashboard._cache().clear()
+                self.client.get(url)
+                with self.assertNumQueries(CONSULTAS_REQUEST + consultas):
+                    self.client.get(url)
+
+
+# --- RÉPLICA DE LECTURA ---
+# En los tests la réplica es un espejo de 'default' (TEST MIRROR, ver settings_test). TransactionTestCase: dentro de
+# la transacción de TestCase el router siempre elegiría el primario.
+
+class ReplicaRouterTests(TransactionTestCase):
+    databases = {DEFAULT_DB_ALIAS, settings.REPLICA_ALIAS}
+
+    def setUp(self):
+        self.router = replica.ReplicaRouter()
+        replica.reiniciar()
+        self.addCleanup(replica.reiniciar)
+        retraso = mock.patch.object(replica, 'medir_retraso', return_value=0.0)
+        self.medir_retraso = retraso.start()
+        self.addCleanup(retraso.stop)
+
+    def test_lectura_analitica_a_la_replica(self):
+        with replica.usar_replica():
+            self.assertEqual(self.router.db_for_read(Cliente), settings.REPLICA_ALIAS)
+            self.assertIsNone(self.router.db_for_read(User)) # Sesiones y usuarios: siempre el primario
+            with replica.usar_primario():
+                self.assertIsNone(self.router.db_for_read(Cliente))
+
+    def test_lectura_no_analitica_al_primario(self):
+        self.assertIsNone(self.router.db_for_read(Cliente))
+
+    def test_dentro_de_transaccion_al_primario(self):
+        with replica.usar_replica(), transaction.atomic():
+            self.assertIsNone(self.router.db_for_read(Cliente))
+
+    def test_cookie_de_escritura_al_primario(self):
+        token = replica._peticion.set({'primario': True, 'escribio': False})
+        try:
+            with replica.usar_replica():
+                self.assertIsNone(self.router.db_for_read(Cliente))
+        finally:
+            replica._peticion.reset(token)
+
+    def test_replica_atrasada_o_caida_al_primario(self):
+        for retraso in (settings.REPLICA_LAG_MAX + 1, None): # None: no se pudo medir
+            with self.subTest(retraso=retraso):
+                replica.reiniciar()
+                self.medir_retraso.return_value = retraso
+                with replica.usar_replica():
+                    self.assertFalse(replica.al_dia())
+                    self.assertIsNone(self.router.db_for_read(Cliente))
+
+    def test_escrituras_y_migraciones_al_primario(self):
+        with replica.usar_replica():
+            self.assertEqual(self.router.db_for_write(Cliente), DEFAULT_DB_ALIAS)
+        self.assertFalse(self.router.allow_migrate(settings.REPLICA_ALIAS, 'nembus_app'))
+        self.assertTrue(self.router.allow_migrate(DEFAULT_DB_ALIAS, 'nembus_app'))
+
+    def test_middleware_deja_cookie_solo_si_escribe(self):
+        def vista(escribe):
+            def get_response(request):
+                if escribe:
+                    Cliente.objects.create(nombre='Escrito', precio_litro_clp=1000)
+                else:
+                    Cliente.objects.count()
+                return HttpResponse()
+            return replica.ReplicaMiddleware(get_response)
+
+        request = RequestFactory().get('/')
+        self.assertNotIn(settings.REPLICA_COOKIE, vista(False)(request).cookies)
+        self.assertIn(settings.REPLICA_COOKIE, vista(True)(request).cookies)
+
+    def test_api_de_metricas_lee_de_la_replica(self):
+        self.client.force_login(User.objects.create_superuser('gerente'))
+        url = reverse('nembus_app:api_metricas', args=['bombas', 'dia', 'kpis'])
+        with override_settings(CACHES=SIN_CACHE):
+            respuesta = self.client.get(url)
+            self.assertGreater(respuesta.wsgi_request.instrumentacion['por_bd'].get(settings.REPLICA_ALIAS, 0), 0)
+
+            self.client.cookies[settings.REPLICA_COOKIE] = '1' # Escribió hace poco: lee lo que escribió
+            respuesta = self.client.get(url)
+            self.assertNotIn(settings.REPLICA_ALIAS, respuesta.wsgi_request.instrumentacion['por_bd'])
+
+
+
+class ReplicaRetrasoSqliteTests(SimpleTestCase):
+    """Entorno local de dos archivos SQLite: la réplica es una copia del primario y lleva de retraso lo que el primario
+    se modificó después de la copia (medir_retraso). Con más de REPLICA_LAG_MAX, las lecturas vuelven al primario."""
+
+    def setUp(self):
+        carpeta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, carpeta, ignore_errors=True)
+        self.primario, self.copia = os.path.join(carpeta, 'primario.sqlite3'), os.path.join(carpeta, 'replica.sqlite3')
+        with sqlite3.connect(self.primario) as bd:
+            bd.execute('CREATE TABLE t (x INTEGER)')
+        motor = 'django.db.backends.sqlite3'
+        conexiones = ConnectionHandler({DEFAULT_DB_ALIAS: {'ENGINE': motor, 'NAME': self.primario},
+                                        settings.REPLICA_ALIAS: {'ENGINE': motor, 'NAME': self.copia}})
+        self.addCleanup(conexiones.close_all)
+        parche = mock.patch.object(replica, 'connections', conexiones)
+        parche.start()
+        self.addCleanup(parche.stop)
+        self.addCleanup(replica.reiniciar)
+
+    def copiar(self, hace):
+        """Copia el primario a la réplica como si la copia se hubiera hecho hace `hace` segundos."""
+        shutil.copyfile(self.primario, self.copia)
+        ahora = time.time()
+        os.utime(self.copia, (ahora - hace, ahora - hace))
+        os.utime(self.primario, (ahora, ahora))
+
+    def test_retraso_por_mtime_y_vuelta_al_primario(self):
+        router = replica.ReplicaRouter()
+        for retraso, alias in ((1, settings.REPLICA_ALIAS), (settings.REPLICA_LAG_MAX + 5, None)):
+            with self.subTest(retraso=retraso):
+                self.copiar(retraso)
+                replica.reiniciar()
+                with replica.usar_replica():
+                    self.assertEqual(router.db_for_read(Cliente), alias)
+                self.assertAlmostEqual(replica.estado()['segundos'], retraso, delta=0.5)
+
+# --- SINCRONIZACIÓN SIN CONEXIÓN (CHOFERES) ---
+
+@override_settings(CACHES=CON_CACHE)
+class SincronizacionTests(TestCase):
+    """Cada operación del lote se aplica o se rechaza sola; un reenvío no aplica nada dos veces."""
+
+    def setUp(self):
+        self.chofer = User.objects.create_user('chofer')
+        self.cliente = Cliente.objects.create(nombre='Cliente', precio_litro_clp=1000)
+        self.camion = Camion.objects.create(patente='AB12', capacidad_total=10000, litros_actuales=5000)
+        perfil = PerfilTrabajador.objects.create(usuario=self.chofer, puede_recargar_combustible=True)
+        perfil.clientes_asignados.add(self.cliente)
+        perfil.camiones_asignados.add(self.camion)
+        self.client.force_login(self.chofer)
+        self.url = reverse('nembus_app:api_sincronizar')
+
+    def sincronizar(self, operaciones):
+        respuesta = self.client.post(self.url, {'operaciones': operaciones}, content_type='application/json')
+        self.assertEqual(respuesta.status_code, 200)
+        return [(r['clave'], r['estado']) for r in respuesta.json()['resultados']]
+
+    def venta(self, clave, litros='100'):
+        return {'clave': clave, 'tipo': 'venta', 'cliente': self.cliente.pk, 'camion': self.camion.pk, 'litros': litros}
+
+    def test_lote_y_reenvio(self):
+        lote = [self.venta('v1'), {'clave': 'r1', 'tipo': 'recarga', 'camion': self.camion.pk, 'litros': '500'},
+                self.venta('v2', litros='999999'), self.venta('v1')]
+        esperado = [('v1', sincronizacion.APLICADA), ('r1', sincronizacion.APLICADA),
+                    ('v2', sincronizacion.RECHAZADA), ('v1', sincronizacion.DUPLICADA)] # Sin stock; repetida en el lote
+        self.assertEqual(self.sincronizar(lote), esperado)
+        self.camion.refresh_from_db()
+        self.assertEqual(self.camion.litros_actuales, Decimal('5400'))
+
+        self.assertEqual(self.sincronizar(lote), [('v1', sincronizacion.DUPLICADA), ('r1', sincronizacion.DUPLICADA),
+                                                  ('v2', sincronizacion.RECHAZADA), ('v1', sincronizacion.DUPLICADA)])
+        self.camion.refresh_from_db()
+        self.assertEqual(self.camion.litros_actuales, Decimal('5400'))
+        self.assertEqual(ReporteVenta.objects.count(), 1)
+
+    def test_litros_fuera_de_rango_rechazados(self):
+        # No cabrían en el DecimalField (DataError en PostgreSQL): se rechazan antes de escribir
+        for litros in ('1e15', '0.00001'):
+            with self.subTest(litros=litros):
+                self.assertEqual(self.sincronizar([self.venta(f'v-{litros}', litros)]), [(f'v-{litros}', sincronizacion.RECHAZADA)])
+        self.assertFalse(OperacionSincronizada.objects.exists())
+
+    def test_fecha_invalida_rechaza_solo_esa_operacion(self):
+        lote = [self.venta('v1'), {**self.venta('v2'), 'fecha': '2026-13-45T10:00:00'}, {**self.venta('v3'), 'fecha': '2026-10-17T10:00:00'}]
+        self.assertEqual(self.sincronizar(lote), [('v1', sincronizacion.APLICADA), ('v2', sincronizacion.RECHAZADA),
+                                                  ('v3', sincronizacion.APLICADA)])
+        self.assertEqual(ReporteVenta.objects.count(), 2)
+
+    def test_error_de_bd_no_aborta_el_lote(self):
+        lote = [self.venta('v1'), {'clave': 'r1', 'tipo': 'recarga', 'camion': self.camion.pk, 'litros': '500'}, self.venta('v2')]
+        with mock.patch.object(inventario, 'recargar_camion', side_effect=DataError("numeric field overflow")), \
+                self.assertLogs('nembus_app.sincronizacion', 'ERROR'):
+            resultados = self.sincronizar(lote)
+        self.assertEqual(resultados, [('v1', sincronizacion.APLICADA), ('r1', sincronizacion.RECHAZADA), ('v2', sincronizacion.APLICADA)])
+        self.assertEqual(ReporteVenta.objects.count(), 2)
+        # La rechazada no consumió su clave: se puede reenviar
+        self.assertEqual(self.sincronizar(lote[1:2]), [('r1', sincronizacion.APLICADA)])
+
+
+# --- EXPORTACIONES EN SEGUNDO PLANO ---
+
+class ExportacionesTests(TestCase):
+    """Un trabajo largo pero vivo no se recupera, y una corrida que perdió su reclamo no pisa al nuevo dueño."""
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        ajustes = override_settings(MEDIA_ROOT=self.media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.usuario = User.objects.create_user('gerente')
+
+    def encolar(self):
+        hoy = timezone.now()
+        return exportaciones.encolar_exportacion(TrabajoExportacion.TIPO_CSV_CAMIONES, self.usuario, 'ventas.csv', 0,
+                                                 start_dt=hoy - timedelta(days=1), end_dt=hoy)
+
+    def test_recupera_por_latido_y_no_por_inicio(self):
+        hace_una_hora = timezone.now() - timedelta(hours=1)
+        vivo, colgado, antiguo = self.encolar(), self.encolar(), self.encolar()
+        TrabajoExportacion.objects.filter(pk=vivo.pk).update(estado=TrabajoExportacion.EN_PROCESO, fecha_inicio=hace_una_hora, fecha_latido=timezone.now())
+        TrabajoExportacion.objects.filter(pk=colgado.pk).update(estado=TrabajoExportacion.EN_PROCESO, fecha_inicio=hace_una_hora, fecha_latido=hace_una_hora)
+        TrabajoExportacion.objects.filter(pk=antiguo.pk).update(estado=TrabajoExportacion.EN_PROCESO, fecha_inicio=hace_una_hora) # Sin latido
+        self.assertEqual(exportaciones.recuperar_colgados(30), 2)
+        estados = dict(TrabajoExportacion.objects.values_list('pk', 'estado'))
+        self.assertEqual(estados, {vivo.pk: TrabajoExportacion.EN_PROCESO, colgado.pk: TrabajoExportacion.PENDIENTE,
+                                   antiguo.pk: TrabajoExportacion.PENDIENTE})
+
+    def test_latido_se_renueva_mientras_escribe(self):
+        self.encolar()
+        trabajo = exportaciones.tomar_siguiente_trabajo()
+        TrabajoExportacion.objects.filter(pk=trabajo.pk).update(fecha_latido=trabajo.fecha_inicio - timedelta(hours=1))
+        with mock.patch.object(exportaciones, 'LATIDO_SEGUNDOS', 0):
+            self.assertIsNotNone(exportaciones.procesar_trabajo(trabajo))
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.estado, TrabajoExportacion.COMPLETADO)
+        self.assertGreaterEqual(trabajo.fecha_latido, trabajo.fecha_inicio)
+
+    def reclamado_por_otro(self, trabajo):
+        """Simula que otro worker recuperó el trabajo y lo volvió a reclamar."""
+        TrabajoExportacion.objects.filter(pk=trabajo.pk).update(fecha_inicio=trabajo.fecha_inicio + timedelta(seconds=1))
+
+    def test_reclamo_perdido_al_escribir_descarta_la_corrida(self):
+        self.encolar()
+        trabajo = exportaciones.tomar_siguiente_trabajo()
+        self.reclamado_por_otro(trabajo)
+        with mock.patch.object(exportaciones, 'LATIDO_SEGUNDOS', 0), self.assertLogs('nembus_app.exportaciones', 'WARNING'):
+            self.assertIsNone(exportaciones.procesar_trabajo(trabajo))
+        actual = TrabajoExportacion.objects.get(pk=trabajo.pk)
+        self.assertEqual(actual.estado, TrabajoExportacion.EN_PROCESO)
+        self.assertFalse(actual.archivo)
+
+    def test_reclamo_perdido_al_terminar_no_pisa_al_nuevo_dueno(self):
+        self.encolar()
+        trabajo = exportaciones.tomar_siguiente_trabajo()
+        filas_originales = exportaciones.lineas_csv_camiones
+
+        def filas_y_reclamo(*args):
+            yield from filas_originales(*args)
+            self.reclamado_por_otro(trabajo)
+
+        with mock.patch.object(exportaciones, 'lineas_csv_camiones', filas_y_reclamo), \
+                self.assertLogs('nembus_app.exportaciones', 'WARNING'):
+            self.assertIsNone(exportaciones.procesar_trabajo(trabajo))
+        actual = TrabajoExportacion.objects.get(pk=trabajo.pk)
+        self.assertEqual(actual.estado, TrabajoExportacion.EN_PROCESO)
+        self.assertFalse(actual.archivo)
+        self.assertEqual(os.listdir(os.path.join(self.media, 'exportaciones')), []) # El archivo de esta corrida se borró
+
+
+# --- FOTOS DE EVIDENCIA (ALMACENAMIENTO DEDUPLICADO) ---
+
+class EvidenciasDeduplicadasTests(TestCase):
+    """Guardar (que puede reutilizar un archivo) y borrar un archivo sin uso toman el mismo bloqueo por nombre."""
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        ajustes = override_settings(MEDIA_ROOT=self.media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.storage = almacenamiento.evidencias()
+        chofer = User.objects.create_user('chofer')
+        cliente = Cliente.objects.create(nombre='Cliente', precio_litro_clp=1000)
+        camion = Camion.objects.create(patente='AB12', capacidad_total=10000)
+        self.venta = lambda foto: ReporteVenta.objects.create(trabajador=chofer, cliente=cliente, camion=camion,
+                                                              litros_vendidos=10, foto_evidencia=foto)
+
+    def guardar(self):
+        return self.storage.save('evidencias/foto.jpg', ContentFile(b'misma foto'))
+
+    def test_guardar_y_borrar_bloquean_el_mismo_nombre(self):
+        bloqueos = []
+
+        def registrar(nombre):
+            bloqueos.append((nombre, connection.in_atomic_block))
+            bloquear(nombre)
+
+        bloquear = almacenamiento.bloquear_nombre
+        with mock.patch.object(almacenamiento, 'bloquear_nombre', registrar), mock.patch.object(fotos, 'bloquear_nombre', registrar):
+            nombre = self.guardar()
+            self.assertEqual(self.guardar(), nombre) # Deduplicado
+            fotos.borrar_si_sin_uso(nombre)
+        self.assertEqual(bloqueos, [(nombre, True)] * 3)
+
+    def test_borra_solo_sin_referencias(self):
+        nombre = self.guardar()
+        venta = self.venta(nombre)
+        self.assertFalse(fotos.borrar_si_sin_uso(nombre))
+        self.assertTrue(self.storage.exists(nombre))
+        venta.delete()
+        self.assertTrue(fotos.borrar_si_sin_uso(nombre))
+        self.assertFalse(self.storage.exists(nombre))
+        self.assertFalse(ArchivoEvidencia.objects.filter(nombre=nombre).exists())
+        # Una subida posterior del mismo contenido lo vuelve a escribir
+        self.assertEqual(self.guardar(), nombre)
+        self.assertTrue(self.storage.exists(nombre))
+
+
+# --- MOTOR DE PERÍODOS ---
+
+def fecha(texto): return date.fromisoformat(texto)
+
+HOY = fecha('2026-10-14') # Miércoles
+
+
+class PeriodosTests(SimpleTestCase):
+    """Aritmética de fechas de periodos.py (dashboard y exportaciones), con tablas de casos."""
+
+    def test_sumar_meses(self):
+        casos = [
+            ('2026-03-31', -1, '2026-02-28'), # Día inexistente: último del mes
+            ('2024-03-31', -1, '2024-02-29'), # Año bisiesto
+            ('2026-01-31', 1, '2026-02-28'),
+            ('2026-11-30', 3, '2027-02-28'),
+            ('2026-12-15', 1, '2027-01-15'), # Cruce de año hacia adelante...
+            ('2026-01-15', -1, '2025-12-15'), # ...y hacia atrás
+            ('2024-02-29', -12, '2023-02-28'),
+            ('2026-10-01', 0, '2026-10-01'),
+        ]
+        for inicio, meses, esperado in casos:
+            with self.subTest(inicio=inicio, meses=meses):
+                self.assertEqual(periodos._sumar_meses(fecha(inicio), meses), fecha(esperado))
+
+    def test_relativos(self):
+        casos = [
+            ('dia', HOY, '2026-10-14', '2026-10-15', 'Hoy'),
+            ('semana', HOY, '2026-10-12', '2026-10-19', 'Esta Semana'), # Lunes a lunes
+            ('semana_anterior', HOY, '2026-10-05', '2026-10-12', 'Semana Anterior'),
+            ('mes_anterior', HOY, '2026-09-01', '2026-10-01', 'Septiembre 2026'),
+            ('mes_anterior', fecha('2026-01-15'), '2025-12-01', '2026-01-01', 'Diciembre 2025'),
+            ('trimestre', HOY, '2026-10-01', '2027-01-01', 'Este Trimestre'),
+            ('trimestre_anterior', HOY, '2026-07-01', '2026-10-01', 'T3 2026'),
+            ('ultimos_7', HOY, '2026-10-08', '2026-10-15', 'Últimos 7 días'),
+            ('desconocida', HOY, '2026-10-14', '2026-10-15', 'Hoy'),
+        ]
+        for clave, hoy, desde, hasta, titulo in casos:
+            with self.subTest(clave=clave, hoy=hoy):
+                periodo = periodos.relativo(clave, hoy)
+                self.assertEqual((periodo.desde, periodo.hasta, periodo.titulo), (fecha(desde), fecha(hasta), titulo))
+
+    def test_rango_invalido(self):
+        for args in (('2026-10-14', '2026-10-13'), ('2026-13-01',)):
+            with self.subTest(args=args), self.assertRaises(ValueError):
+                periodos.rango(*args)
+        with self.assertRaises(ValueError):
+            periodos.resolver('rango')
+
+    def test_comparacion(self):
+        semana, mes = periodos.relativo('semana', HOY), periodos.relativo('mes', HOY)
+        casos = [
+            # La semana en curso "a la fecha": lunes a miércoles contra lunes a miércoles de la anterior
+            (semana, 'anterior', ('2026-10-05', '2026-10-08')),
+            (mes, 'anterior', ('2026-09-01', '2026-09-15')),
+            (mes, 'anio', ('2025-10-01', '2025-10-15')),
+            (periodos.relativo('trimestre_anterior', HOY), 'anterior', ('2026-04-01', '2026-07-01')),
+            (periodos.relativo('dia', HOY), 'anterior', ('2026-10-13', '2026-10-14')),
+            # Rango que termina en el futuro: se corre su largo completo pero solo hasta hoy
+            (periodos.rango('2026-10-10', '2026-10-20'), 'anterior', ('2026-09-29', '2026-10-04')),
+            # 29 de febrero contra el año anterior: 28 de febrero
+            (periodos.rango('2024-02-29'), 'anio', ('2023-02-28', '2023-03-01')),
+            (periodos.rango('2026-10-20', '2026-10-25'), 'anterior', None), # Completamente futuro
+            (mes, 'otro', None),
+        ]
+        for periodo, modo, esperado in casos:
+            with self.subTest(periodo=periodo, modo=modo):
+                resultado = periodos.comparacion(periodo, modo, HOY)
+                self.assertEqual(resultado and (resultado.desde, resultado.hasta), esperado and tuple(map(fecha, esperado)))
+
+    def test_particionar(self):
+        casos = [
+            (periodos.relativo('dia', HOY), [('2026-10-14', '2026-10-15')]),
+            (periodos.relativo('semana', HOY), [('2026-10-12', '2026-10-14'), ('2026-10-14', '2026-10-15')]), # Días futuros omitidos
+            (periodos.relativo('semana_anterior', HOY), [('2026-10-05', '2026-10-12')]),
+            (periodos.rango('2026-10-10', '2026-10-20'), [('2026-10-10', '2026-10-14'), ('2026-10-14', '2026-10-15')]),
+            (periodos.rango('2026-10-20', '2026-10-25'), []),
+        ]
+        for periodo, esperado in casos:
+            with self.subTest(periodo=periodo):
+                self.assertEqual(periodos.particionar(periodo, HOY), [(fecha(a), fecha(b)) for a, b in esperado])
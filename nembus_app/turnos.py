@@ -0,0 +1,135 @@
+# nembus_app/turnos.py
+# Guardado en lote de la gestión de turnos de bomberos. Un POST de gestionar_turno se traduce en
+# un número FIJO de consultas sin importar cuántas ventas traiga: un bulk_create para las nuevas,
+# un bulk_update para las modificadas y un DELETE para las borradas; la auditoría (LogEntry) se escribe
+# en un solo bulk_create al terminar el request (ver auditoria.py).
+# Como bulk_create/bulk_update no disparan señales, los resúmenes del dashboard y los totales corrientes
+# de cada lectura/turno se ajustan aquí en bloque.
+# Además, la API JSON del turno (agregar/editar/borrar UNA venta y devolver los totales) vive al final.
+from decimal import Decimal
+from django.contrib.admin.models import ADDITION, CHANGE, DELETION
+from django.utils import timezone
+from .models import ReporteTurno, LecturaBomba, RegistroVentaIndividualBomba
+from .signals import resumenes_bomba_en_lote
+from . import auditoria, inventario, resumenes, cache_dashboard
+
+CERO = Decimal('0')
+
+# Campos que puede cambiar una venta existente (los del formulario + los calculados)
+CAMPOS_VENTA = ['numero_maquina', 'socio_propietario', 'litros_vendidos', 'precio_litro_venta', 'ingreso_registro']
+
+
+def bloquear_turno_abierto(reporte_id, usuario):
+    """Dentro de transaction.atomic(): el turno abierto del usuario con su fila bloqueada (SELECT FOR UPDATE) hasta el
+    commit, o None si ya se cerró. Serializa las ventas con el cierre: ninguna se agrega después de que finalizar_turno
+    leyó los totales, y un doble envío de "Finalizar Turno" no descuenta las bombas dos veces."""
+    return ReporteTurno.objects.select_for_update().filter(pk=reporte_id, trabajador=usuario, esta_abierto=True).first()
+
+
+def guardar_ventas_turno(formsets_por_lectura, lecturas_por_id, usuario):
+    """Persiste los formsets (ya validados) de un turno en lote. Devuelve (guardadas, borradas)."""
+    nuevas, modificadas, borradas = [], [], []
+    for lectura_id, formset in formsets_por_lectura.items():
+        lectura = lecturas_por_id[lectura_id]
+        for form in formset:
+            if form.cleaned_data.get('DELETE', False):
+                if form.instance.pk: # Solo si ya existe en la BD
+                    borradas.append(form.instance)
+            elif form.has_changed(): # Nuevo con datos o modificado
+                venta = form.save(commit=False)
+                venta.lectura_bomba = lectura
+                venta.precio_litro_venta = lectura.bomba.precio_litro_clp
+                venta.calcular_ingreso()
+                (modificadas if venta.pk else nuevas).append(venta)
+
+    # Estado previo (para restarlo del resumen y de los totales) de todo lo que se modifica o borra: una consulta
+    previos = resumenes.ventas_bomba_en_bd([v.pk for v in modificadas + borradas]).values()
+    # Los repr para el log de borrado se toman antes de borrar
+    auditoria.registrar_lote(
+        (usuario, v, DELETION, f"Venta de bomba borrada desde gestión de turno (Lectura ID: {v.lectura_bomba_id}).")
+        for v in borradas
+    )
+
+    with resumenes_bomba_en_lote():
+        if borradas:
+            RegistroVentaIndividualBomba.objects.filter(pk__in=[v.pk for v in borradas]).delete()
+        if modificadas:
+            RegistroVentaIndividualBomba.objects.bulk_update(modificadas, CAMPOS_VENTA)
+        if nuevas:
+            RegistroVentaIndividualBomba.objects.bulk_create(nuevas)
+
+    actuales = resumenes.ventas_bomba_en_bd([v.pk for v in nuevas + modificadas]).values()
+    resumenes.restar_ventas_bomba(estado for estado, _ in previos)
+    resumenes.sumar_ventas_bomba(estado for estado, _ in actuales)
+    resumenes.ajustar_contadores_turno(restar=[c for _, c in previos], sumar=[c for _, c in actuales])
+    # Sin señales por fila: una sola invalidación de la caché del dashboard, desde el día más antiguo tocado
+    fechas = [estado[0]['fecha'] for estado, _ in [*previos, *actuales]]
+    if fechas:
+        cache_dashboard.invalidar(min(fechas))
+
+    auditoria.registrar_lote([
+        (usuario, v, ADDITION, f"Venta de bomba creada desde gestión de turno (Lectura ID: {v.lectura_bomba_id}).")
+        for v in nuevas
+    ] + [
+        (usuario, v, CHANGE, f"Venta de bomba modificada desde gestión de turno (Lectura ID: {v.lectura_bomba_id}).")
+        for v in modificadas
+    ])
+    return len(nuevas) + len(modificadas), len(borradas)
+
+
+def finalizar_turno(reporte, lecturas, usuario):
+    """Calcula el contador final de TODAS las lecturas desde su total corriente de litros y cierra el turno.
+    Se llama con el turno bloqueado por bloquear_turno_abierto en la misma transacción."""
+    # Totales frescos (el guardado de este mismo POST los acaba de ajustar con F()): una consulta, sin agregar ventas
+    litros = dict(LecturaBomba.objects.filter(pk__in=[l.pk for l in lecturas]).values_list('pk', 'litros_vendidos_turno'))
+    lecturas = list(lecturas)
+    for lectura in lecturas:
+        lectura.litros_vendidos_turno = litros[lectura.pk]
+        lectura.contador_final = lectura.contador_inicial + lectura.litros_vendidos_turno
+    LecturaBomba.objects.bulk_update(lecturas, ['contador_final'])
+    inventario.descontar_bombas(lecturas, trabajador=usuario)
+
+    reporte.fecha_fin = timezone.now()
+    reporte.esta_abierto = False
+    reporte.save(update_fields=['fecha_fin', 'esta_abierto'])
+    return lecturas
+
+
+# --- VENTAS INDIVIDUALES (API JSON DE gestionar_turno) ---
+
+def totales_turno(reporte):
+    """Totales corrientes del turno y de cada lectura (dos consultas, sin agregar las ventas)."""
+    turno = ReporteTurno.objects.values('num_ventas', 'total_litros', 'total_ingreso').get(pk=reporte.pk)
+    por_lectura = {
+        pk: {'num_ventas': n, 'litros': litros, 'ingreso': ingreso}
+        for pk, n, litros, ingreso in LecturaBomba.objects.filter(reporte_turno=reporte).values_list(
+            'pk', 'num_ventas_turno', 'litros_vendidos_turno', 'ingreso_turno')
+    }
+    turno = {'num_ventas': turno['num_ventas'], 'litros': turno['total_litros'], 'ingreso': turno['total_ingreso']}
+    return {'lecturas': por_lectura, 'turno': turno}
+
+
+def venta_a_dict(venta):
+    return {
+        'id': venta.pk, 'lectura': venta.lectura_bomba_id, 'numero_maquina': venta.numero_maquina,
+        'socio_propietario': venta.socio_propietario, 'litros_vendidos': venta.litros_vendidos,
+        'precio_litro_venta': venta.precio_litro_venta, 'ingreso_registro': venta.ingreso_registro,
+        'fecha_registro': timezone.localtime(venta.fecha_registro).strftime('%d/%m %H:%M'),
+    }
+
+
+def guardar_venta(form, usuario):
+    """Crea o edita UNA venta desde un VentaIndividualForm válido (con instance.lectura_bomba ya asignada)."""
+    venta = form.save(commit=False)
+    accion = CHANGE if venta.pk else ADDITION
+    venta.precio_litro_venta = venta.lectura_bomba.bomba.precio_litro_clp # Igual que el guardado del formset
+    venta.save() # save() calcula el ingreso; las señales mantienen el resumen
+    mensaje = f"Venta de bomba {'creada' if accion == ADDITION else 'modificada'} desde gestión de turno (Lectura ID: {venta.lectura_bomba_id})."
+    auditoria.registrar(usuario, venta, accion, mensaje)
+    return venta
+
+
+def borrar_venta(venta, usuario):
+    auditoria.registrar(usuario, venta, DELETION,
+                        f"Venta de bomba borrada desde gestión de turno (Lectura ID: {venta.lectura_bomba_id}).")
+    venta.delete()
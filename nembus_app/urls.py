@@ -16,20 +16,29 @@ urlpatterns = [
     path('dashboard/', views.dashboard_trabajador, name='dashboard_trabajador'),
     path('gerente/dashboard/', views.dashboard_redirect, name='dashboard_gerente_redirect'),
     path('gerente/dashboard/<str:division>/<str:periodo>/', views.dashboard_gerente, name='dashboard_gerente'),
+    path('api/v1/metrics/<str:division>/<str:periodo>/<str:panel>/', views.api_metricas, name='api_metricas'), # Paneles del dashboard (JSON)
 
     # --- URLs para CHOFERES (Camiones) ---
     path('reporte/nuevo/', views.crear_reporte_venta, name='crear_reporte'), # Venta desde camión
     path('reporte/exito/', views.reporte_exito, name='reporte_exito'), # Página éxito genérica?
     path('recarga/nueva/', views.crear_recarga, name='crear_recarga'), # Recarga de camión
     path('traspaso/nuevo/', views.crear_traspaso, name='crear_traspaso'), # Traspaso entre camiones
+    path('api/v1/sincronizar/', views.api_sincronizar, name='api_sincronizar'), # API JSON: cola sin conexión (ventas, recargas, traspasos)
 
     # --- URLs para BOMBEROS (Nuevo flujo de Turnos y Ventas) ---
     path('turno/iniciar/', views.iniciar_turno, name='iniciar_turno'), # <-- NUEVA RUTA para iniciar turno
     path('turno/gestionar/<int:reporte_id>/', views.gestionar_turno, name='gestionar_turno'), # <-- NUEVA RUTA para ver/añadir ventas/finalizar
+    path('turno/<int:reporte_id>/ventas/', views.api_venta_turno, name='api_venta_turno'), # API JSON: agregar venta (POST)
+    path('turno/<int:reporte_id>/ventas/<int:venta_id>/', views.api_venta_turno, name='api_venta_turno_detalle'), # API JSON: editar (POST) / borrar (DELETE)
     # path('reporte-bomba/nuevo/', views.crear_reporte_turno, name='crear_reporte_turno'), # <-- RUTA ANTIGUA COMENTADA O ELIMINADA
 
     # --- URLs de Exportación ---
     path('reportes/exportar/', views.exportar_reportes_csv, name='exportar_reportes'), # Exportación CSV (¿quizás solo camiones ahora?)
     path('reportes/ventas/bombas/exportar/', views.exportar_ventas_bomba_excel, name='exportar_ventas_bomba_excel'), # <-- NUEVA RUTA EXPORTACIÓN EXCEL BOMBAS
+    path('reportes/exportaciones/<int:trabajo_id>/', views.estado_exportacion, name='estado_exportacion'), # Estado de exportación en segundo plano
+    path('reportes/exportaciones/<int:trabajo_id>/descargar/', views.descargar_exportacion, name='descargar_exportacion'),
+
+    # --- Monitoreo ---
+    path('metrics', views.metricas_prometheus, name='metricas_prometheus'), # Prometheus (ver telemetria.py)
 
 ]
\ No newline at end of file
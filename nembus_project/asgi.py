@@ -3,6 +3,13 @@ ASGI config for nembus_project project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Modo ASGI de Nembus (en vez de gunicorn con workers síncronos sobre wsgi.py):
+
+    gunicorn nembus_project.asgi:application -k uvicorn_worker.UvicornWorker
+
+Las vistas de dashboard, métricas y exportaciones son async (ver nembus_app/asincrono.py) y el resto
+corre en un hilo por request, así una exportación lenta no bloquea al worker.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
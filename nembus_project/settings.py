@@ -1,8 +1,10 @@
 # nembus_project/settings.py
 
+import importlib.util
 import os # Necesario para leer variables de entorno
 import dj_database_url # Necesario para configurar la base de datos desde una URL
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -56,14 +58,24 @@ MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     # --- Configuración para WhiteNoise (archivos estáticos en producción) ---
     # Debe ir DESPUÉS de SecurityMiddleware y ANTES que todo lo demás
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    # (WhiteNoise con soporte async, ver nembus_app/asincrono.py: todos los middlewares deben serlo para ASGI)
+    'nembus_app.asincrono.EstaticosMiddleware',
     # ---------------------------------------------------------------------
+    # Tiempo y SQL de cada request: Server-Timing y log de peticiones lentas (nembus_app/instrumentacion.py).
+    # Va después de WhiteNoise (los estáticos no se miden) y antes del resto, para medir todo el request
+    'nembus_app.instrumentacion.InstrumentacionMiddleware',
+    # Cookie de "escribiste hace poco" para leer del primario y no de la réplica (nembus_app/replica.py)
+    'nembus_app.replica.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # request.capacidades: rol, permisos y asignaciones del trabajador desde caché (nembus_app/capacidades.py)
+    'nembus_app.capacidades.CapacidadesMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Escribe la auditoría (LogEntry) confirmada del request en un solo bulk_create al terminar (nembus_app/auditoria.py)
+    'nembus_app.auditoria.AuditoriaMiddleware',
 ]
 
 ROOT_URLCONF = 'nembus_project.urls'
@@ -88,14 +100,73 @@ WSGI_APPLICATION = 'nembus_project.wsgi.application'
 
 # Database
 # Configuración dinámica: usa DATABASE_URL de Render si existe, si no, usa SQLite local.
+# Conexiones a PostgreSQL (ver python manage.py verificar_bd y benchmark_pool):
+# - Por defecto cada worker/hilo mantiene UNA conexión persistente (DB_CONN_MAX_AGE segundos), con psycopg 3 o
+#   psycopg2 (Django usa psycopg 3 si está instalado).
+# - DB_POOL=True: pool de conexiones de Django (solo psycopg 3 con psycopg-pool). Cada proceso abre entre
+#   DB_POOL_MIN y DB_POOL_MAX conexiones y los requests las toman y devuelven; si están todas ocupadas un request
+#   espera hasta DB_POOL_TIMEOUT segundos en vez de abrir otra. Así el total queda acotado a
+#   procesos x DB_POOL_MAX, por debajo del max_connections del servidor, aunque haya ráfagas (cambio de turno).
+# - Con psycopg 3, una consulta que se repite DB_PREPARE_THRESHOLD veces en una conexión queda preparada en el
+#   servidor (con el pool, las conexiones y sus sentencias preparadas duran entre requests). 'no' lo desactiva:
+#   necesario detrás de PgBouncer en modo transaction anterior a 1.21.
+# - Las conexiones se verifican antes de reutilizarlas (CONN_HEALTH_CHECKS, y check del pool).
+DB_POOL = os.environ.get('DB_POOL', 'False') == 'True'
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', '600'))
 DATABASES = {
     'default': dj_database_url.config(
         # Busca la variable de entorno DATABASE_URL
         default=f'sqlite:///{BASE_DIR / "db.sqlite3"}', # Fallback a SQLite local
-        conn_max_age=600 # Opcional: Reutiliza conexiones a la BD por 10 minutos
+        conn_max_age=0 if DB_POOL else DB_CONN_MAX_AGE, # El pool no admite conexiones persistentes (las maneja él)
+        conn_health_checks=True,
     )
 }
-
+# Réplica de lectura (nembus_app/replica.py): con DATABASE_REPLICA_URL, el dashboard de gerencia, la API de
+# métricas y las exportaciones leen de ella mientras su retraso no supere REPLICA_LAG_MAX segundos (medido cada
+# REPLICA_LAG_INTERVALO); las escrituras y los flujos de trabajadores siguen en el primario. Tras escribir, un
+# navegador lee del primario por REPLICA_PEGAR_SEGUNDOS (cookie REPLICA_COOKIE). Los tests definen su propia
+# réplica (nembus_project/settings_test.py).
+REPLICA_ALIAS = 'replica'
+if os.environ.get('DATABASE_REPLICA_URL'):
+    DATABASES[REPLICA_ALIAS] = dj_database_url.parse(
+        os.environ['DATABASE_REPLICA_URL'],
+        conn_max_age=0 if DB_POOL else DB_CONN_MAX_AGE,
+        conn_health_checks=True,
+    )
+DATABASE_ROUTERS = ['nembus_app.replica.ReplicaRouter']
+REPLICA_LAG_MAX = float(os.environ.get('REPLICA_LAG_MAX', '30'))
+REPLICA_LAG_INTERVALO = float(os.environ.get('REPLICA_LAG_INTERVALO', '5'))
+REPLICA_PEGAR_SEGUNDOS = int(os.environ.get('REPLICA_PEGAR_SEGUNDOS', '10'))
+REPLICA_COOKIE = 'nembus_primario'
+
+# SQLite (desarrollo y pilotos de un solo servidor): las transacciones toman el bloqueo de escritura al empezar
+# (BEGIN IMMEDIATE). Con el modo por defecto (DEFERRED), una transacción que lee y después escribe (ej. finalizar
+# un turno) falla al instante con "database is locked" si otra escribió entremedio, porque SQLite no puede esperar
+# sin arriesgar un interbloqueo. Con IMMEDIATE las escrituras concurrentes hacen fila hasta DB_SQLITE_TIMEOUT
+# segundos (prueba_carga --hilos 8 sin errores).
+for _bd in DATABASES.values():
+    if _bd['ENGINE'] == 'django.db.backends.sqlite3':
+        _bd['OPTIONS'] = {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': float(os.environ.get('DB_SQLITE_TIMEOUT', '20')),
+            **_bd.get('OPTIONS', {}),
+        }
+
+for _bd in DATABASES.values(): # Cada alias (primario y réplica) con su propio pool
+    if _bd['ENGINE'] != 'django.db.backends.postgresql':
+        continue
+    _opciones_bd = _bd.setdefault('OPTIONS', {})
+    if DB_POOL:
+        _opciones_bd['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN', '2')),
+            'max_size': int(os.environ.get('DB_POOL_MAX', '10')),
+            'timeout': float(os.environ.get('DB_POOL_TIMEOUT', '10')),
+            'max_idle': float(os.environ.get('DB_POOL_MAX_IDLE', '300')), # Cierra las conexiones ociosas sobre min_size
+            'max_lifetime': float(os.environ.get('DB_POOL_MAX_LIFETIME', '3600')),
+        }
+    if importlib.util.find_spec('psycopg') is not None: # psycopg2 no acepta prepare_threshold
+        _umbral_preparadas = os.environ.get('DB_PREPARE_THRESHOLD', '5')
+        _opciones_bd['prepare_threshold'] = None if _umbral_preparadas == 'no' else int(_umbral_preparadas)
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -135,9 +206,6 @@ STATIC_URL = 'static/'
 # Directorio donde `collectstatic` reunirá todos los archivos estáticos para producción.
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
-# Configuración para WhiteNoise (servir estáticos en producción)
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
-
 
 # Media files (User Uploads)
 # https://docs.djangoproject.com/en/5.2/topics/files/
@@ -145,6 +213,129 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media' # Donde se guardan localmente (OJO: No persistente en Render por defecto)
 
+# Fotos de evidencia: almacenamiento direccionado por contenido (nembus_app/almacenamiento.py), deduplicado y
+# repartido en subcarpetas por hash. EVIDENCIAS_STORAGE='local' (MEDIA_ROOT) o 's3' (S3 o compatible, ej. MinIO
+# con EVIDENCIAS_S3_ENDPOINT_URL=http://localhost:9000; requiere django-storages[s3])
+EVIDENCIAS_STORAGE = os.environ.get('EVIDENCIAS_STORAGE', 'local')
+if EVIDENCIAS_STORAGE == 's3':
+    _evidencias = {
+        'BACKEND': 'nembus_app.almacenamiento.EvidenciasS3',
+        'OPTIONS': {
+            'bucket_name': os.environ.get('EVIDENCIAS_S3_BUCKET', 'nembus-evidencias'),
+            'endpoint_url': os.environ.get('EVIDENCIAS_S3_ENDPOINT_URL') or None,
+            'region_name': os.environ.get('EVIDENCIAS_S3_REGION') or None,
+            'access_key': os.environ.get('EVIDENCIAS_S3_ACCESS_KEY'),
+            'secret_key': os.environ.get('EVIDENCIAS_S3_SECRET_KEY'),
+            'location': os.environ.get('EVIDENCIAS_S3_PREFIJO', ''),
+            'querystring_auth': True, # URLs firmadas: el bucket no necesita ser público
+            'addressing_style': 'path' if os.environ.get('EVIDENCIAS_S3_ENDPOINT_URL') else None, # MinIO
+        },
+    }
+else:
+    _evidencias = {'BACKEND': 'nembus_app.almacenamiento.EvidenciasLocal'}
+
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    # WhiteNoise: estáticos con hash en el nombre y comprimidos (servir estáticos en producción)
+    'staticfiles': {'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'},
+    'evidencias': _evidencias,
+}
+
+# Exportaciones: sobre este número de filas se generan en segundo plano (python manage.py procesar_exportaciones)
+EXPORTACION_UMBRAL_FILAS = int(os.environ.get('EXPORTACION_UMBRAL_FILAS', '20000'))
+
+# Fotos de evidencia: el worker (python manage.py procesar_fotos) las deja en FOTO_FORMATO ('WEBP' o 'JPEG'),
+# con el lado mayor <= FOTO_LADO_MAX px, y genera miniaturas de FOTO_LADO_MINIATURA px para el admin/listados
+FOTO_FORMATO = os.environ.get('FOTO_FORMATO', 'WEBP')
+FOTO_LADO_MAX = int(os.environ.get('FOTO_LADO_MAX', '1600'))
+FOTO_LADO_MINIATURA = int(os.environ.get('FOTO_LADO_MINIATURA', '320'))
+FOTO_CALIDAD = int(os.environ.get('FOTO_CALIDAD', '80'))
+
+# Gestión de turnos: cada venta son ~6 campos POST por bomba; el límite por defecto (1000) corta turnos de ~150 ventas
+DATA_UPLOAD_MAX_NUMBER_FIELDS = int(os.environ.get('DATA_UPLOAD_MAX_NUMBER_FIELDS', '20000'))
+
+
+# Caché
+# Caché del dashboard de gerencia (nembus_app/cache_dashboard.py), sin Redis. DASHBOARD_CACHE_BACKEND:
+# - 'locmem' (por defecto): en memoria de cada proceso; con varios workers la invalidación no cruza procesos
+#   y el período actual puede quedar desfasado hasta DASHBOARD_CACHE_TIMEOUT segundos, y los cerrados (tras una
+#   venta con fecha pasada o un borrado) hasta DASHBOARD_CACHE_TIMEOUT_HISTORICO.
+# - 'archivo': directorio compartido (DASHBOARD_CACHE_DIR).
+# - 'bd': tabla en la base de datos; crearla una vez con `python manage.py createcachetable`.
+DASHBOARD_CACHE_BACKEND = os.environ.get('DASHBOARD_CACHE_BACKEND', 'locmem')
+_BACKENDS_CACHE_DASHBOARD = {
+    'locmem': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'nembus-dashboard'},
+    'archivo': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': os.environ.get('DASHBOARD_CACHE_DIR', str(BASE_DIR / 'cache_dashboard'))},
+    'bd': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'nembus_cache_dashboard'},
+}
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'dashboard': {**_BACKENDS_CACHE_DASHBOARD[DASHBOARD_CACHE_BACKEND], 'TIMEOUT': None},
+}
+# Segundos que vive en caché el período actual
+DASHBOARD_CACHE_TIMEOUT = int(os.environ.get('DASHBOARD_CACHE_TIMEOUT', '300'))
+# Y los períodos cerrados: con un backend compartido ('archivo', 'bd') la invalidación llega a todos los procesos
+# y no expiran ('none'); con 'locmem' deben expirar (por defecto 1 hora)
+_timeout_historico = os.environ.get('DASHBOARD_CACHE_TIMEOUT_HISTORICO', '3600' if DASHBOARD_CACHE_BACKEND == 'locmem' else 'none')
+DASHBOARD_CACHE_TIMEOUT_HISTORICO = None if _timeout_historico == 'none' else int(_timeout_historico)
+if DASHBOARD_CACHE_TIMEOUT_HISTORICO is None and DASHBOARD_CACHE_BACKEND == 'locmem':
+    raise ImproperlyConfigured("DASHBOARD_CACHE_TIMEOUT_HISTORICO='none' requiere una caché compartida (DASHBOARD_CACHE_BACKEND='archivo' o 'bd').")
+
+# Foto de capacidades de cada trabajador (nembus_app/capacidades.py): se invalida al cambiar su perfil y expira
+# tras CAPACIDADES_CACHE_TIMEOUT segundos. CAPACIDADES_CACHE_BACKEND es 'locmem', 'archivo' o 'bd' (como el del
+# dashboard, con otro prefijo). Con 'locmem' la invalidación no llega a los otros procesos, que seguirían aceptando
+# una asignación revocada mientras dure su foto: por eso ahí dura solo unos segundos.
+CAPACIDADES_CACHE_BACKEND = os.environ.get('CAPACIDADES_CACHE_BACKEND', 'locmem')
+CAPACIDADES_CACHE = 'capacidades'
+CACHES[CAPACIDADES_CACHE] = {**_BACKENDS_CACHE_DASHBOARD[CAPACIDADES_CACHE_BACKEND], 'KEY_PREFIX': 'capacidades'}
+if CAPACIDADES_CACHE_BACKEND == 'locmem':
+    CACHES[CAPACIDADES_CACHE]['LOCATION'] = 'nembus-capacidades'
+CAPACIDADES_CACHE_TIMEOUT = int(os.environ.get('CAPACIDADES_CACHE_TIMEOUT', '5' if CAPACIDADES_CACHE_BACKEND == 'locmem' else '300'))
+
+# Sincronización sin conexión de los choferes (nembus_app/sincronizacion.py): operaciones aceptadas por lote
+SINCRONIZACION_MAX_OPERACIONES = int(os.environ.get('SINCRONIZACION_MAX_OPERACIONES', '500'))
+
+
+# Auditoría (LogEntry del admin, ver nembus_app/auditoria.py)
+# AUDITORIA_ASINCRONA=True: un hilo de fondo escribe los eventos en lotes de hasta AUDITORIA_LOTE filas o cada
+# AUDITORIA_INTERVALO segundos, juntando varios requests. False (por defecto): un bulk_create al final de cada request.
+AUDITORIA_ASINCRONA = os.environ.get('AUDITORIA_ASINCRONA', 'False') == 'True'
+AUDITORIA_LOTE = int(os.environ.get('AUDITORIA_LOTE', '500'))
+AUDITORIA_INTERVALO = float(os.environ.get('AUDITORIA_INTERVALO', '2'))
+
+
+# Instrumentación de requests (nembus_app/instrumentacion.py). Un request que supera algún umbral deja un WARNING
+# 'peticion_lenta' en el log: más de INSTRUMENTACION_LENTA_MS ms, más de INSTRUMENTACION_MAX_CONSULTAS consultas o
+# una misma consulta repetida más de INSTRUMENTACION_MAX_REPETICIONES veces (N+1). INSTRUMENTACION_UMBRALES los
+# ajusta por vista (nombre de URL); None desactiva un umbral.
+INSTRUMENTACION_LENTA_MS = int(os.environ.get('INSTRUMENTACION_LENTA_MS', '1000'))
+INSTRUMENTACION_MAX_CONSULTAS = int(os.environ.get('INSTRUMENTACION_MAX_CONSULTAS', '50'))
+INSTRUMENTACION_MAX_REPETICIONES = int(os.environ.get('INSTRUMENTACION_MAX_REPETICIONES', '10'))
+INSTRUMENTACION_UMBRALES = {
+    # El dashboard y la API hacen un número fijo de consultas sin importar cuántos PDV/camiones haya
+    # (DashboardConsultasTests en tests.py): superar estos valores es una regresión
+    'nembus_app:dashboard_gerente': {'consultas': 10},
+    'nembus_app:api_metricas': {'consultas': 10},
+    # Las exportaciones grandes van al worker; las síncronas pueden tardar más
+    'nembus_app:exportar_reportes': {'ms': 5000},
+    'nembus_app:exportar_ventas_bomba_excel': {'ms': 5000},
+}
+# Header Server-Timing: 'staff' (solo usuarios staff, por defecto), 'todos' o 'no'
+INSTRUMENTACION_SERVER_TIMING = os.environ.get('INSTRUMENTACION_SERVER_TIMING', 'staff')
+
+# Endpoint /metrics para Prometheus (nembus_app/telemetria.py). Los valores de negocio (litros, turnos abiertos,
+# colas, caché) se recalculan en segundo plano cada METRICAS_INTERVALO segundos, no en cada scrape.
+# METRICAS_TOKEN: el scrape debe enviar 'Authorization: Bearer <token>' (bearer_token en Prometheus). Sin token,
+# /metrics solo responde a usuarios staff con sesión (no se confía en la IP: detrás de nginx todo llega de localhost).
+METRICAS_INTERVALO = int(os.environ.get('METRICAS_INTERVALO', '30'))
+METRICAS_TOKEN = os.environ.get('METRICAS_TOKEN', '')
+
+# Modo ASGI (nembus_project/asgi.py): gunicorn nembus_project.asgi:application -k uvicorn_worker.UvicornWorker
+# El dashboard, la API de métricas, /metrics y las exportaciones son vistas async (nembus_app/asincrono.py).
+# ASGI_HILOS_CONSULTAS: hilos (y conexiones a la BD) por proceso para calcular en paralelo las partes de un panel.
+ASGI_HILOS_CONSULTAS = int(os.environ.get('ASGI_HILOS_CONSULTAS', '8'))
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -169,14 +360,24 @@ print(f"CSRF_TRUSTED_ORIGINS configurados: {CSRF_TRUSTED_ORIGINS}") # Para depur
 
 # --- CONFIGURACIONES ADICIONALES (OPCIONALES PERO RECOMENDADAS) ---
 
-# Logging (básico para ver errores en Render)
+# Logging (consola, para ver errores en Render). Los mensajes de nembus_app son 'evento clave=valor ...'
+# para poder filtrarlos; NEMBUS_LOG_LEVEL=DEBUG muestra también el detalle de dashboard/turnos/formularios.
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'formatters': {
+        'estructurado': {
+            'format': 'ts=%(asctime)s nivel=%(levelname)s logger=%(name)s %(message)s',
+        },
+    },
     'handlers': {
         'console': {
             'class': 'logging.StreamHandler',
         },
+        'console_estructurado': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'estructurado',
+        },
     },
     'root': {
         'handlers': ['console'],
@@ -188,5 +389,10 @@ LOGGING = {
             'level': os.getenv('DJANGO_LOG_LEVEL', 'INFO'),
             'propagate': False,
         },
+        'nembus_app': {
+            'handlers': ['console_estructurado'],
+            'level': os.getenv('NEMBUS_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
     },
 }
\ No newline at end of file
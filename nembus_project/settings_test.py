@@ -0,0 +1,12 @@
+# nembus_project/settings_test.py
+# Ajustes de los tests: los de producción más una réplica de lectura. manage.py los usa por defecto con el
+# comando test (o --settings=nembus_project.settings_test).
+from .settings import * # noqa: F401,F403
+from .settings import DATABASES, REPLICA_ALIAS
+
+# Sin DATABASE_REPLICA_URL, la réplica es un espejo de 'default' (TEST MIRROR): la misma BD de pruebas con otro
+# alias, para probar el ruteo (ReplicaRouterTests). El retraso entre dos archivos SQLite se prueba aparte
+# (ReplicaRetrasoSqliteTests).
+if REPLICA_ALIAS not in DATABASES:
+    DATABASES[REPLICA_ALIAS] = dict(DATABASES['default'])
+DATABASES[REPLICA_ALIAS]['TEST'] = {'MIRROR': 'default'}